@@ -0,0 +1,539 @@
+import argparse
+import ctypes.util
+import fnmatch
+import importlib
+import inspect
+import json
+import os
+import pkgutil
+import re
+import sys
+import tempfile
+
+import dstpy as dst
+
+import src.library
+from src.rdf_analyzer.geometry import DetectorGeometry
+from src.rdf_analyzer.reductions import declare_reductions
+from src.rdf_analyzer.utils import logger
+
+# Arguments of the generator methods that are baked into the C++ code (`constant: true` in the configuration).
+# Every other generator argument is passed its parameter name, which becomes the name of the C++ parameter.
+GENERATOR_ARGS = {
+    'r0': "1200.",
+    'b': "3.5",
+    'b_values': "3, 3.5, 4, 4.5",
+    'log10_min': "18.",
+    'log10_max': "20.5",
+    'layer': "0",
+    'threshold': "3.",
+}
+
+# Values of the scalar C++ parameters that must stay in a valid range, by parameter name.
+RUNTIME_VALUES = {
+    'layer': "0",
+    'threshold': "3.",
+    'site_id': "0",
+}
+
+# Inner sizes of the per-counter vectors that hold one value per layer, e.g. pedestal[N][2].
+LAYER_VECTORS = ('pedestal', 'vem', 'MIP', 'pulsearea', 'trace_integral')
+
+ARITHMETIC_TYPES = ('double', 'float', 'int', 'unsigned int', 'short', 'long', 'Long64_t', 'ULong64_t', 'bool',
+                    'std::size_t', 'size_t')
+
+CONTROL_KEYWORDS = ('if', 'for', 'while', 'switch', 'return', 'sizeof')
+
+# Synthetic inputs, the timing loop and the sink that keeps the kernel results alive.
+BENCHMARK_DRIVER = """
+#ifndef TAANALYSIS_BENCH_LIBRARY_H
+#define TAANALYSIS_BENCH_LIBRARY_H
+
+#include <chrono>
+#include <mcheck.h>
+#include <random>
+#include <tuple>
+#include <type_traits>
+#include <vector>
+
+namespace taBenchLibrary {
+
+using Random = std::mt19937_64;
+
+double gSink = 0.;
+
+template <typename T>
+struct Maker {
+    static T Make(Random &random, const int *) {
+        if constexpr (std::is_same_v<T, bool>) {
+            return random() % 2;
+        } else if constexpr (std::is_integral_v<T>) {
+            return static_cast<T>(random() % 4096);
+        } else {
+            return static_cast<T>(std::uniform_real_distribution<double>(0., 1000.)(random));
+        }
+    }
+};
+
+template <typename T>
+struct Maker<ROOT::RVec<T>> {
+    static ROOT::RVec<T> Make(Random &random, const int *shape) {
+        ROOT::RVec<T> values(shape[0]);
+        for (auto &value : values) {
+            value = Maker<T>::Make(random, shape + 1);
+        }
+        return values;
+    }
+};
+
+template <typename T>
+struct Maker<std::vector<T>> {
+    static std::vector<T> Make(Random &random, const int *shape) {
+        std::vector<T> values(shape[0]);
+        for (auto &value : values) {
+            value = Maker<T>::Make(random, shape + 1);
+        }
+        return values;
+    }
+};
+
+template <typename T>
+T Make(Random &random, std::initializer_list<int> shape) {
+    return Maker<T>::Make(random, shape.begin());
+}
+
+template <typename T, typename = void>
+struct HasSize : std::false_type {};
+
+template <typename T>
+struct HasSize<T, std::void_t<decltype(std::declval<const T &>().size())>> : std::true_type {};
+
+template <typename T>
+void Consume(const T &value) {
+    if constexpr (std::is_arithmetic_v<T>) {
+        gSink += value;
+    } else if constexpr (HasSize<T>::value) {
+        gSink += value.size();
+    } else {
+        gSink += *reinterpret_cast<const volatile unsigned char *>(&value);
+    }
+}
+
+template <typename F, typename... Inputs>
+void Loop(F &&kernel, int repeat, const Inputs &...inputs) {
+    const std::size_t nEvents = std::get<0>(std::tie(inputs...)).size();
+    for (int r = 0; r < repeat; ++r) {
+        for (std::size_t i = 0; i < nEvents; ++i) {
+            if constexpr (std::is_void_v<decltype(kernel(inputs[i]...))>) {
+                kernel(inputs[i]...);
+            } else {
+                Consume(kernel(inputs[i]...));
+            }
+        }
+    }
+}
+
+template <typename F, typename... Inputs>
+double NsPerEvent(F &&kernel, int repeat, const Inputs &...inputs) {
+    const std::size_t nEvents = std::get<0>(std::tie(inputs...)).size();
+    const auto start = std::chrono::steady_clock::now();
+    Loop(kernel, repeat, inputs...);
+    const auto stop = std::chrono::steady_clock::now();
+    return std::chrono::duration<double, std::nano>(stop - start).count() / (repeat * nEvents);
+}
+
+// Traces the heap allocations of one pass to MALLOC_TRACE (see `count_allocations`).
+template <typename F, typename... Inputs>
+void TraceAllocations(F &&kernel, const Inputs &...inputs) {
+    mtrace();
+    Loop(kernel, 1, inputs...);
+    muntrace();
+}
+
+}
+
+#endif
+"""
+
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark the C++ kernels generated by the library classes on synthetic events.")
+    parser.add_argument("-k", "--kernels", type=str, nargs="*",
+                        help="Only benchmark the kernels matching these patterns, e.g. 'TASD*.extract*' "
+                             "(default: all)")
+    parser.add_argument("-n", "--n_events", type=int, default=10000,
+                        help="Number of synthetic events (default: 10000)")
+    parser.add_argument("-s", "--mean_size", type=float, default=15.,
+                        help="Mean number of hit counters per event (default: 15)")
+    parser.add_argument("-i", "--inner_size", type=int, default=128,
+                        help="Length of each per-counter vector, e.g. FADC samples (default: 128)")
+    parser.add_argument("-r", "--repeat", type=int, default=10,
+                        help="Number of passes over the events (default: 10)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument("-b", "--baseline", type=str,
+                        help="JSON file of a previous run, to flag the kernels that got slower or allocate more")
+    parser.add_argument("-u", "--update_baseline", action="store_true",
+                        help="Write the results to the baseline file")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.25,
+                        help="Relative slowdown above which a kernel is flagged as a regression (default: 0.25)")
+    parser.add_argument("--no_allocations", action="store_true",
+                        help="Do not count the heap allocations (counting traces every allocation of one pass)")
+    return parser.parse_args()
+
+
+def discover_generators():
+    """
+    Find every public generator method of the classes in src/library.
+
+    :return: List of (qualified name, class instance, method name) tuples.
+    """
+    generators = []
+    for module_info in pkgutil.iter_modules(src.library.__path__):
+        module = importlib.import_module(f"src.library.{module_info.name}")
+        for class_name, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ != module.__name__:
+                continue
+            instance = cls()
+            for method_name, _ in inspect.getmembers(cls, inspect.isfunction):
+                if not method_name.startswith("_"):
+                    generators.append((f"{class_name}.{method_name}", instance, method_name))
+    return generators
+
+
+def generate_code(instance, method_name):
+    """
+    Call a generator with representative arguments.
+
+    :param instance: The library class instance.
+    :param method_name: The generator method.
+    :return: The generated C++ code.
+    """
+    method = getattr(instance, method_name)
+    args = [GENERATOR_ARGS.get(name, name) for name in inspect.signature(method).parameters]
+    return method(*args)
+
+
+def split_parameters(parameters):
+    """
+    Split a C++ parameter list at the commas outside template brackets.
+
+    :param parameters: The parameter list, without the parentheses.
+    :return: List of (type, name) tuples, with the type stripped of const, references and pointers.
+    """
+    parts, depth, current = [], 0, ""
+    for char in parameters:
+        depth += (char == "<") - (char == ">")
+        if char == "," and depth == 0:
+            parts.append(current)
+            current = ""
+        else:
+            current += char
+    parts.append(current)
+
+    result = []
+    for part in filter(str.strip, parts):
+        part = part.split("=")[0].strip()
+        match = re.match(r"(.*?)[\s&*]*\b(\w+)$", part, re.S)
+        cpp_type = re.sub(r"\bconst\b|[&*]", "", match.group(1))
+        cpp_type = re.sub(r"\s+", " ", cpp_type).strip().replace("> >", ">>")
+        result.append((re.sub(r"\s*([<>,:])\s*", r"\1", cpp_type), match.group(2)))
+    return result
+
+
+def find_kernel(code, method_name):
+    """
+    Find the function defined by the generated code: the one named like the method, or else the first one.
+
+    :param code: The generated C++ code.
+    :param method_name: The generator method.
+    :return: The function name and its list of (type, name) parameters, or None if no function is defined.
+    """
+    functions = [(match.group(1), match.group(2)) for match in
+                 re.finditer(r"\b(\w+)\s*\(([^(){};]*)\)\s*(?:const\s*)?\{", code)
+                 if match.group(1) not in CONTROL_KEYWORDS]
+    if not functions:
+        return None
+    for name, parameters in functions:
+        if name == method_name:
+            return name, split_parameters(parameters)
+    name, parameters = next(((name, parameters) for name, parameters in functions if name.startswith(method_name)),
+                            functions[0])
+    return name, split_parameters(parameters)
+
+
+def isolate_code(code, index):
+    """
+    Wrap the generated code of a kernel in its own namespace, so that its declarations cannot clash with those of
+    the benchmark environment or of the other kernels. Its include guards are reset, and its #include lines are
+    kept outside of the namespace.
+
+    :param code: The generated C++ code.
+    :param index: The kernel number, for the namespace.
+    :return: C++ code as a string, declaring the kernel in the namespace taBenchKernel<index>.
+    """
+    lines = code.splitlines()
+    includes = [line for line in lines if line.strip().startswith("#include")]
+    body = [line for line in lines if not line.strip().startswith("#include")]
+    undefs = [f"#undef {guard}" for guard in re.findall(r"#ifndef\s+(\w+)", code)]
+    return "\n".join(includes + undefs + [f"namespace taBenchKernel{index} {{"] + body + ["}"])
+
+
+def input_expression(cpp_type, name, inner_size, site_name):
+    """
+    Get the C++ expression of one synthetic input of an event, with `nCounters` counters.
+
+    :param cpp_type: The parameter type, without const or reference.
+    :param name: The parameter name.
+    :param inner_size: The length of the per-counter vectors.
+    :param site_name: An FD site name, for string parameters.
+    :return: The C++ expression, in terms of `random` and `nCounters`, or None for vectors nested deeper than
+        fadc[N][2][128].
+    """
+    if name in RUNTIME_VALUES and cpp_type in ARITHMETIC_TYPES:
+        return f"static_cast<{cpp_type}>({RUNTIME_VALUES[name]})"
+    if cpp_type == "std::string":
+        return f'std::string("{site_name}")'
+    depth = cpp_type.count("std::vector<")
+    if depth > 2:
+        return None
+    if not cpp_type.startswith("ROOT::RVec<") and depth == 0:
+        return f"taBenchLibrary::Make<{cpp_type}>(random, {{}})"
+    inner = [inner_size] if depth == 1 and name not in LAYER_VECTORS else [2, inner_size][:depth]
+    shape = ", ".join(["nCounters"] + [str(size) for size in inner])
+    return f"taBenchLibrary::Make<{cpp_type}>(random, {{{shape}}})"
+
+
+def driver_code(index, function, parameters, args, site_name):
+    """
+    Generate the C++ code that generates the synthetic inputs of a kernel and times it.
+
+    :param index: The kernel number, for the namespace of its driver.
+    :param function: The kernel function name.
+    :param parameters: The kernel (type, name) parameters.
+    :param args: The command-line arguments.
+    :param site_name: An FD site name, for string parameters.
+    :return: C++ code as a string, or None if a parameter has no synthetic input.
+    """
+    expressions = [input_expression(cpp_type, name, args.inner_size, site_name) for cpp_type, name in parameters]
+    if None in expressions:
+        return None
+    inputs = "\n".join(f"std::vector<{cpp_type}> gInput{i};" for i, (cpp_type, _) in enumerate(parameters))
+    resize = "\n    ".join(f"gInput{i}.resize(nEvents);" for i in range(len(parameters)))
+    fill = "\n        ".join(f"gInput{i}[i] = {expression};" for i, expression in enumerate(expressions))
+    clear = "\n    ".join(f"gInput{i} = {{}};" for i in range(len(parameters)))
+    names = ", ".join(f"gInput{i}" for i in range(len(parameters)))
+    kernel = f"[](const auto &...inputs) {{ return {function}(inputs...); }}"
+    return f"""
+namespace taBenchLibrary {{
+namespace kernel{index} {{
+
+{inputs}
+
+void Generate(int nEvents, double meanSize, int seed) {{
+    Random random(seed);
+    std::poisson_distribution<int> poisson(meanSize);
+    {resize}
+    for (int i = 0; i < nEvents; ++i) {{
+        const int nCounters = 1 + poisson(random);
+        (void)nCounters;
+        {fill}
+    }}
+}}
+
+double Run(int repeat) {{ return NsPerEvent({kernel}, repeat, {names}); }}
+
+void Trace() {{ TraceAllocations({kernel}, {names}); }}
+
+void Clear() {{
+    {clear}
+}}
+
+}}
+}}
+"""
+
+
+def count_allocations(driver, trace_file):
+    """
+    Count the heap allocations of one pass over the events, from the glibc malloc trace (mtrace).
+
+    :param driver: The kernel driver namespace.
+    :param trace_file: Path of the trace.
+    :return: Number of allocations (mallocs and moving reallocs), or None if no trace was written.
+    """
+    os.environ["MALLOC_TRACE"] = trace_file
+    driver.Trace()
+    if not os.path.exists(trace_file):
+        return None
+    n_allocations = 0
+    with open(trace_file) as file:
+        for line in file:
+            fields = line.split()
+            operation = fields[2] if fields and fields[0] == "@" and len(fields) > 2 else (fields or [""])[0]
+            n_allocations += operation in ("+", ">")
+    os.remove(trace_file)
+    return n_allocations
+
+
+def enable_allocation_tracing():
+    """
+    Restart the benchmark with the glibc malloc debugging library preloaded, which mtrace needs since glibc 2.34.
+    """
+    library = ctypes.util.find_library("c_malloc_debug")
+    if library and library not in os.environ.get("LD_PRELOAD", ""):
+        os.environ["LD_PRELOAD"] = " ".join(filter(None, [os.environ.get("LD_PRELOAD"), library]))
+        os.execv(sys.executable, [sys.executable, "-m", "src.bench_library"] + sys.argv[1:])
+
+
+def declare_environment():
+    """
+    Declare what the kernels may use: the fused reductions, and the detector geometry with the FD sites of the
+    detector configurations and a synthetic 24 x 24 grid of counters (IDs XXYY, 1200 m spacing).
+
+    :return: The name of an FD site, for the string parameters.
+    """
+    declare_reductions()
+    detector_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "detectors")
+    counters = {x * 100 + y: ((x - 12) * 1200., (y - 12) * 1200., 0.) for x in range(1, 25) for y in range(1, 25)}
+    geometry = DetectorGeometry(DetectorGeometry.load_detector_configs(detector_dir), counters)
+    geometry.declare()
+    dst.ROOT.gInterpreter.Declare(BENCHMARK_DRIVER)
+    return geometry.sites[0].get("name", "") if geometry.sites else ""
+
+
+def benchmark(generators, args):
+    """
+    Declare and time every kernel. Each kernel is declared in its own namespace (see `isolate_code`).
+
+    :param generators: The (qualified name, class instance, method name) generators.
+    :param args: The command-line arguments.
+    :return: Dictionary with the qualified names as keys and the result dictionaries as values, with 'status'
+        ('ok', 'compile error', 'no function', 'unsupported' or 'generator error'), 'ns_per_event' and
+        'allocations_per_event'.
+    """
+    site_name = declare_environment()
+    results = {}
+    for index, (name, instance, method_name) in enumerate(generators):
+        try:
+            code = generate_code(instance, method_name)
+        except Exception as e:
+            logger.warning(f"{name}: the generator failed. {str(e)}")
+            results[name] = {'status': "generator error"}
+            continue
+        kernel = find_kernel(code, method_name)
+        if kernel is None:
+            results[name] = {'status': "no function"}
+            continue
+        if not dst.ROOT.gInterpreter.Declare(isolate_code(code, index)):
+            logger.warning(f"{name}: the generated code does not compile")
+            results[name] = {'status': "compile error"}
+            continue
+        function, parameters = kernel
+        function = f"::taBenchKernel{index}::{function}"
+        driver = driver_code(index, function, parameters, args, site_name) if parameters else None
+        if driver is None or not dst.ROOT.gInterpreter.Declare(driver):
+            logger.warning(f"{name}: no synthetic inputs for the parameters of {function}: {parameters}")
+            results[name] = {'status': "unsupported"}
+            continue
+
+        driver = getattr(dst.ROOT.taBenchLibrary, f"kernel{index}")
+        driver.Generate(args.n_events, args.mean_size, args.seed)
+        # Warm up once, so that the timing does not include JIT compilation.
+        driver.Run(1)
+        result = {'status': "ok", 'ns_per_event': driver.Run(args.repeat)}
+        if not args.no_allocations:
+            with tempfile.TemporaryDirectory() as trace_dir:
+                n_allocations = count_allocations(driver, os.path.join(trace_dir, "mtrace.log"))
+            if n_allocations is not None:
+                result['allocations_per_event'] = n_allocations / args.n_events
+        driver.Clear()
+        results[name] = result
+    return results
+
+
+def settings_mismatch(baseline, args):
+    """
+    Compare the synthetic-event settings of a baseline with those of this run.
+
+    :param baseline: The baseline file content.
+    :param args: The command-line arguments.
+    :return: List of the settings that differ, as 'name: baseline value -> value of this run' strings.
+    """
+    return [f"{key}: {baseline.get(key)} -> {getattr(args, key)}" for key in ('n_events', 'mean_size', 'inner_size')
+            if baseline.get(key) != getattr(args, key)]
+
+
+def compare(results, baseline, tolerance):
+    """
+    Flag the kernels that no longer compile, got slower than the baseline beyond the tolerance, or allocate more.
+
+    :param results: The benchmark results.
+    :param baseline: The baseline results.
+    :param tolerance: The relative slowdown accepted.
+    :return: Dictionary with the qualified names of the flagged kernels as keys and the reasons as values.
+    """
+    regressions = {}
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None or reference.get('status') != "ok":
+            continue
+        if result['status'] != "ok":
+            regressions[name] = f"{result['status']} (was ok)"
+        elif result['ns_per_event'] > reference['ns_per_event'] * (1. + tolerance):
+            regressions[name] = (f"{result['ns_per_event']:.1f} ns/event, was {reference['ns_per_event']:.1f} "
+                                 f"(+{100. * (result['ns_per_event'] / reference['ns_per_event'] - 1.):.0f}%)")
+        elif result.get('allocations_per_event', 0.) > reference.get('allocations_per_event', float('inf')):
+            regressions[name] = (f"{result['allocations_per_event']:.2f} allocations/event, "
+                                 f"was {reference['allocations_per_event']:.2f}")
+    return regressions
+
+
+def main():
+    args = parse_args()
+    if not args.no_allocations:
+        enable_allocation_tracing()
+
+    generators = [generator for generator in discover_generators()
+                  if not args.kernels or any(fnmatch.fnmatch(generator[0], pattern) for pattern in args.kernels)]
+    results = benchmark(generators, args)
+
+    logger.info(f"{args.n_events} events, {args.mean_size:g} counters/event, {args.inner_size} samples/counter:")
+    for name, result in results.items():
+        if result['status'] == "ok":
+            allocations = result.get('allocations_per_event')
+            allocations = f"{allocations:8.2f} allocations/event" if allocations is not None else ""
+            logger.info(f"  {name:<50} {result['ns_per_event']:10.1f} ns/event  {allocations}")
+        else:
+            logger.info(f"  {name:<50} {result['status'].upper()}")
+
+    failures = [name for name, result in results.items() if result['status'] == "compile error"]
+    regressions = {}
+    if args.baseline and not os.path.exists(args.baseline):
+        logger.warning(f"Baseline {args.baseline} not found. Nothing to compare against.")
+    elif args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        mismatch = settings_mismatch(baseline, args)
+        if mismatch:
+            logger.warning(f"Baseline {args.baseline} was measured on other synthetic events "
+                           f"({', '.join(mismatch)}). Not comparing against it.")
+        else:
+            regressions = compare(results, baseline['kernels'], args.tolerance)
+        for name, reason in regressions.items():
+            logger.warning(f"Regression in {name}: {reason}")
+    if failures:
+        logger.warning(f"Kernels that do not compile: {', '.join(failures)}")
+
+    if args.update_baseline and args.baseline:
+        with open(args.baseline, "w") as file:
+            json.dump({'n_events': args.n_events, 'mean_size': args.mean_size, 'inner_size': args.inner_size,
+                       'kernels': results}, file, indent=2)
+        logger.info(f"Saved the baseline to {args.baseline}")
+
+    sys.exit(1 if failures or regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+
+import dstpy as dst
+
+from src.library.txHybrid_composition import TAx4HybridComposition
+from src.rdf_analyzer.reductions import declare_reductions
+from src.rdf_analyzer.utils import logger
+
+# Synthetic hybrid events and the timing loops of the scalar generators and of the fused reductions.
+BENCHMARK_DRIVER = """
+#ifndef TAANALYSIS_BENCH_REDUCTIONS_H
+#define TAANALYSIS_BENCH_REDUCTIONS_H
+
+#include <chrono>
+#include <TRandom3.h>
+
+namespace taBenchReductions {
+
+std::vector<ROOT::RVec<double>> gValues;
+std::vector<ROOT::RVec<std::vector<double>>> gNested;
+
+void Generate(int nEvents, double meanSize, int innerSize, int seed) {
+    TRandom3 random(seed);
+    gValues.assign(nEvents, {});
+    gNested.assign(nEvents, {});
+    for (int i = 0; i < nEvents; ++i) {
+        const int size = 1 + random.Poisson(meanSize);
+        gValues[i].resize(size);
+        gNested[i].resize(size);
+        for (int j = 0; j < size; ++j) {
+            gValues[i][j] = random.Exp(10.);
+            gNested[i][j].resize(innerSize);
+            for (auto &sample : gNested[i][j]) {
+                sample = random.Gaus(0., 1.);
+            }
+        }
+    }
+}
+
+template <typename F>
+double NsPerEvent(F &&reduce, int repeat) {
+    double sink = 0.;
+    const auto start = std::chrono::steady_clock::now();
+    for (int r = 0; r < repeat; ++r) {
+        for (std::size_t i = 0; i < gValues.size(); ++i) {
+            sink += reduce(gValues[i], gNested[i]);
+        }
+    }
+    const auto stop = std::chrono::steady_clock::now();
+    if (sink == 0.123456789) {
+        std::printf("%f\\n", sink);
+    }
+    return std::chrono::duration<double, std::nano>(stop - start).count() / (repeat * gValues.size());
+}
+
+double Scalar(int repeat) {
+    return NsPerEvent([](const ROOT::RVec<double> &values, const ROOT::RVec<std::vector<double>> &nested) {
+        const double maxVal = findMaxInRVec(values);
+        const int maxIndex = findMaxIndex(values);
+        const auto means = calculateMeanOfVectors(nested);
+        return maxVal + maxIndex + means[0];
+    }, repeat);
+}
+
+double Fused(int repeat) {
+    return NsPerEvent([](const ROOT::RVec<double> &values, const ROOT::RVec<std::vector<double>> &nested) {
+        const auto summary = taReductions::Summarize(values);
+        const auto means = taReductions::MeanOfEach(nested);
+        return summary.max + summary.argmax + means[0];
+    }, repeat);
+}
+
+}
+
+#endif
+"""
+
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Compare the fused reductions with the scalar TAx4HybridComposition generators.")
+    parser.add_argument("-n", "--n_events", type=int, default=100000,
+                        help="Number of synthetic events (default: 100000)")
+    parser.add_argument("-s", "--mean_size", type=float, default=15.,
+                        help="Mean number of hit counters per event (default: 15)")
+    parser.add_argument("-i", "--inner_size", type=int, default=128,
+                        help="Length of each inner vector, e.g. FADC samples (default: 128)")
+    parser.add_argument("-r", "--repeat", type=int, default=10,
+                        help="Number of passes over the events (default: 10)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    library = TAx4HybridComposition()
+    for function in (library.findMaxInRVec("values"), library.findMaxIndex("values"),
+                     library.calculateMeanOfVectors("nested")):
+        dst.ROOT.gInterpreter.Declare(function)
+    declare_reductions()
+    dst.ROOT.gInterpreter.Declare(BENCHMARK_DRIVER)
+
+    bench = dst.ROOT.taBenchReductions
+    bench.Generate(args.n_events, args.mean_size, args.inner_size, args.seed)
+    # Warm up both loops once, so that the timing does not include JIT compilation.
+    bench.Scalar(1)
+    bench.Fused(1)
+
+    scalar = bench.Scalar(args.repeat)
+    fused = bench.Fused(args.repeat)
+    logger.info(f"{args.n_events} events, {args.mean_size:g} counters/event, {args.inner_size} samples/counter:")
+    logger.info(f"  findMaxInRVec + findMaxIndex + calculateMeanOfVectors: {scalar:10.1f} ns/event")
+    logger.info(f"  taReductions::Summarize + MeanOfEach:                 {fused:10.1f} ns/event")
+    logger.info(f"  Speedup: {scalar / fused:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,143 @@
+from src.library.naming import name_suffix
+
+
 class TALEPhotonSearch:
     """
     A class that contains various utility functions for generating C++ code
     related to ROOT RVec operations.
-    """
\ No newline at end of file
+    """
+
+    @staticmethod
+    def _b_values(b_values: str) -> list:
+        """
+        Parse a list of S_b exponents given as a comma- or space-separated string (e.g. "3, 3.5, 4").
+
+        :param b_values: The exponents.
+        :return: List of exponents as floats.
+        """
+        return [float(b) for b in str(b_values).replace(',', ' ').split()]
+
+    @staticmethod
+    def _power_expression(b: float) -> str:
+        """
+        Generate a C++ expression for x^b, in terms of `x`, `sqrtX` and `logX`. Integer and half-integer
+        exponents up to 8 are unrolled into multiplications; other exponents use exp(b log x).
+
+        :param b: The exponent.
+        :return: C++ expression as a string.
+        """
+        if (2 * b).is_integer() and 0 <= b <= 8:
+            factors = ["x"] * int(b) + (["sqrtX"] if not b.is_integer() else [])
+            return " * ".join(factors) or "1."
+        return f"std::exp({b!r} * logX)"
+
+    @staticmethod
+    def _power_terms(powers: list) -> str:
+        """
+        Generate the C++ declarations of `sqrtX` and `logX`, only if one of the power expressions uses them.
+
+        :param powers: The power expressions.
+        :return: C++ code as a string.
+        """
+        terms = []
+        if any("sqrtX" in power for power in powers):
+            terms.append("const double sqrtX = std::sqrt(x);")
+        if any("logX" in power for power in powers):
+            terms.append("const double logX = std::log(x);")
+        return "\n                        ".join(terms)
+
+    @staticmethod
+    def sbParameter(rho: str, r: str, r0: str, b: str) -> str:
+        """
+        Generate C++ code to calculate the S_b parameter, sum_i rho_i (r_i / r0)^b, over all counters
+        of an event. `r0` and `b` are baked into the code: pass them as `constant: true` arguments. They are
+        part of the function name (e.g. `sbParameter_1200_3`), so several values can be used in one analysis.
+
+        :param rho: Name of the RVec holding the counter densities.
+        :param r: Name of the RVec holding the counter distances from the shower axis.
+        :param r0: Reference distance (same units as r), e.g. 1200.
+        :param b: Exponent, e.g. 3.
+        :return: C++ code as a string.
+        """
+        power = TALEPhotonSearch._power_expression(float(b))
+        suffix = name_suffix(float(r0), float(b))
+        return f"""
+                #ifndef TALE_PHOTON_SB_PARAMETER_{suffix.upper()}_H
+                #define TALE_PHOTON_SB_PARAMETER_{suffix.upper()}_H
+
+                double sbParameter_{suffix}(const ROOT::RVec<double>& {rho}, const ROOT::RVec<double>& {r}) {{
+                    const std::size_t n = std::min({rho}.size(), {r}.size());
+                    double sb = 0.;
+                    for (std::size_t i = 0; i < n; ++i) {{
+                        const double x = {r}[i] * (1. / {float(r0)!r});
+                        {TALEPhotonSearch._power_terms([power])}
+                        sb += {rho}[i] * ({power});
+                    }}
+                    return sb;
+                }}
+
+                #endif
+        """
+
+    @staticmethod
+    def ldfParameters(rho: str, r: str, r0: str, b_values: str) -> str:
+        """
+        Generate C++ code to calculate S_b for several exponents together with lateral-distribution
+        summaries, in one pass over the counters of an event. `r0` and `b_values` are baked into the
+        code: pass them as `constant: true` arguments. They are part of the function and result type
+        names (e.g. `ldfParameters_1200_3_3p5`), so several configurations can be used in one analysis.
+
+        The result has the fields `sb` (one S_b per exponent, in the given order), `total_signal`,
+        `mean_distance` (signal-weighted), `max_distance`, `far_signal_fraction` (fraction of the
+        signal beyond r0) and `n_counters`; read them with e.g. `LDF.sb[0]` or `LDF.total_signal`.
+
+        :param rho: Name of the RVec holding the counter densities.
+        :param r: Name of the RVec holding the counter distances from the shower axis.
+        :param r0: Reference distance (same units as r), e.g. 1200.
+        :param b_values: Comma-separated exponents, e.g. "3, 3.5, 4, 4.5".
+        :return: C++ code as a string.
+        """
+        b_values = TALEPhotonSearch._b_values(b_values)
+        powers = [TALEPhotonSearch._power_expression(b) for b in b_values]
+        sums = "\n".join(f"                        ldf.sb[{i}] += signal * ({power});"
+                         for i, power in enumerate(powers))
+        suffix = name_suffix(float(r0), *b_values)
+        return f"""
+                #ifndef TALE_PHOTON_LDF_PARAMETERS_{suffix.upper()}_H
+                #define TALE_PHOTON_LDF_PARAMETERS_{suffix.upper()}_H
+
+                struct LDFParameters_{suffix} {{
+                    std::array<double, {len(b_values)}> sb{{}};
+                    double total_signal = 0.;
+                    double mean_distance = 0.;
+                    double max_distance = 0.;
+                    double far_signal_fraction = 0.;
+                    int n_counters = 0;
+                }};
+
+                LDFParameters_{suffix} ldfParameters_{suffix}(const ROOT::RVec<double>& {rho},
+                                                              const ROOT::RVec<double>& {r}) {{
+                    LDFParameters_{suffix} ldf;
+                    const std::size_t n = std::min({rho}.size(), {r}.size());
+                    double weightedDistance = 0.;
+                    double farSignal = 0.;
+                    for (std::size_t i = 0; i < n; ++i) {{
+                        const double signal = {rho}[i];
+                        const double x = {r}[i] * (1. / {float(r0)!r});
+                        {TALEPhotonSearch._power_terms(powers)}
+{sums}
+                        ldf.total_signal += signal;
+                        weightedDistance += signal * {r}[i];
+                        farSignal += x > 1. ? signal : 0.;
+                        ldf.max_distance = std::max(ldf.max_distance, {r}[i]);
+                    }}
+                    ldf.n_counters = n;
+                    if (ldf.total_signal > 0.) {{
+                        ldf.mean_distance = weightedDistance / ldf.total_signal;
+                        ldf.far_signal_fraction = farSignal / ldf.total_signal;
+                    }}
+                    return ldf;
+                }}
+
+                #endif
+        """
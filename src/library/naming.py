@@ -0,0 +1,9 @@
+def name_suffix(*values: float) -> str:
+    """
+    Encode constants baked into generated C++ code into an identifier suffix, so that each set of constants gets
+    its own functions and include guard.
+
+    :param values: The constants, e.g. 1200. and 3.5.
+    :return: The suffix, e.g. "1200_3p5".
+    """
+    return "_".join(f"{value:g}".replace("-", "m").replace("+", "").replace(".", "p") for value in values)
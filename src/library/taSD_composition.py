@@ -232,3 +232,73 @@ class TASDCompositionFunctions:
                 }}
         """
 
+    @staticmethod
+    def zeroSuppressOffsets(FADC: str, pedestal: str, layer: str, threshold: str) -> str:
+        """
+        Generate C++ code for the offsets of the zero-suppressed FADC bins of one layer: the bins whose counts,
+        minus the counter pedestal (from extractPedestal0/1), are above the threshold. The offset of bin j of
+        counter i is i * 128 + j. Together with zeroSuppressValues, it stores the traces of fadc[N][2][128]
+        sparsely; `src.rdf_analyzer.zero_suppression.decode_traces` rebuilds the dense traces.
+
+        :param FADC: Name of the input vector (assumed to be fadc).
+        :param pedestal: Name of the per-counter pedestals of the layer (e.g. from extractPedestal0).
+        :param layer: The layer (0 or 1), passed to the generated function.
+        :param threshold: The threshold in FADC counts above the pedestal, passed to the generated function.
+        :return: C++ code as a string.
+        """
+        return f"""
+                #ifndef ZERO_SUPPRESS_OFFSETS_H
+                #define ZERO_SUPPRESS_OFFSETS_H
+
+                ROOT::RVec<int> zeroSuppressOffsets(const ROOT::RVec<std::vector<std::vector<int>>>& {FADC},
+                                                    const ROOT::RVec<double>& {pedestal},
+                                                    int layer, double threshold) {{
+                    ROOT::RVec<int> offsets;
+
+                    for (size_t i = 0; i < {FADC}.size(); ++i) {{
+                        for (size_t j = 0; j < 128; ++j) {{
+                            if ({FADC}[i][layer][j] - {pedestal}[i] > threshold) {{
+                                offsets.push_back(i * 128 + j);
+                            }}
+                        }}
+                    }}
+                    return offsets;
+                }}
+
+                #endif
+        """
+
+    @staticmethod
+    def zeroSuppressValues(FADC: str, pedestal: str, layer: str, threshold: str) -> str:
+        """
+        Generate C++ code for the pedestal-subtracted counts of the zero-suppressed FADC bins of one layer, in
+        the order of zeroSuppressOffsets.
+
+        :param FADC: Name of the input vector (assumed to be fadc).
+        :param pedestal: Name of the per-counter pedestals of the layer (e.g. from extractPedestal0).
+        :param layer: The layer (0 or 1), passed to the generated function.
+        :param threshold: The threshold in FADC counts above the pedestal, passed to the generated function.
+        :return: C++ code as a string.
+        """
+        return f"""
+                #ifndef ZERO_SUPPRESS_VALUES_H
+                #define ZERO_SUPPRESS_VALUES_H
+
+                ROOT::RVec<float> zeroSuppressValues(const ROOT::RVec<std::vector<std::vector<int>>>& {FADC},
+                                                     const ROOT::RVec<double>& {pedestal},
+                                                     int layer, double threshold) {{
+                    ROOT::RVec<float> values;
+
+                    for (size_t i = 0; i < {FADC}.size(); ++i) {{
+                        for (size_t j = 0; j < 128; ++j) {{
+                            const double value = {FADC}[i][layer][j] - {pedestal}[i];
+                            if (value > threshold) {{
+                                values.push_back(value);
+                            }}
+                        }}
+                    }}
+                    return values;
+                }}
+
+                #endif
+        """
@@ -80,11 +80,56 @@ class TAx4HybridComposition:
                 }}
                 """
 
+    @staticmethod
+    def summarizeRVec(input_vector: str) -> str:
+        """
+        Generate C++ code to compute the max, argmax, sum, mean, RMS, standard deviation and count
+        of a ROOT RVec in one pass (see taReductions). Read the statistics with e.g. `summary.max`.
+
+        :param input_vector: Name of the input vector.
+        :return: C++ code as a string.
+        """
+        return f"""
+                taReductions::Summary summarizeRVec(const ROOT::RVec<double>& {input_vector}) {{
+                    return taReductions::Summarize({input_vector});
+                }}
+        """
+
+    @staticmethod
+    def summarizeVectors(innerVec: str) -> str:
+        """
+        Generate C++ code to compute the summary statistics of each vector in a vector of vectors,
+        in one pass per vector (see taReductions).
+
+        :param innerVec: Name of the input vector of vectors.
+        :return: C++ code as a string.
+        """
+        return f"""
+                ROOT::RVec<taReductions::Summary> summarizeVectors(const ROOT::RVec<std::vector<double>> &{innerVec}) {{
+                    return taReductions::SummarizeEach({innerVec});
+                }}
+        """
+
+    @staticmethod
+    def meanOfVectors(innerVec: str) -> str:
+        """
+        Generate C++ code to calculate the mean of each vector in a vector of vectors, into a
+        preallocated RVec (see taReductions).
+
+        :param innerVec: Name of the input vector of vectors.
+        :return: C++ code as a string.
+        """
+        return f"""
+                ROOT::RVec<double> meanOfVectors(const ROOT::RVec<std::vector<double>> &{innerVec}) {{
+                    return taReductions::MeanOfEach({innerVec});
+                }}
+        """
+
     @staticmethod
     def coreProximity(HybridCoreX: str, HybridCoreY: str, HotSD_CLF_X: str, HotSD_CLF_Y: str) -> str:
         """
-        Generate a complete C++ function that calculates the distance between two points using
-        the TMath::Sqrt and TMath::Power functions.
+        Generate a complete C++ function that calculates the distance (in km) between two points
+        given in meters.
 
         :param HybridCoreX: Name of the variable holding the X coordinate of HybridCore.
         :param HybridCoreY: Name of the variable holding the Y coordinate of HybridCore.
@@ -95,26 +140,58 @@ class TAx4HybridComposition:
         return f"""
                 double coreProximity(double {HybridCoreX}, double {HybridCoreY}, 
                                          double {HotSD_CLF_X}, double {HotSD_CLF_Y}) {{
-                    return TMath::Sqrt(
-                        TMath::Power({HybridCoreX} - {HotSD_CLF_X}, 2) + 
-                        TMath::Power({HybridCoreY} - {HotSD_CLF_Y}, 2)
-                    ) / 1000.;
+                    const double dx = {HybridCoreX} - {HotSD_CLF_X};
+                    const double dy = {HybridCoreY} - {HotSD_CLF_Y};
+                    return std::sqrt(dx * dx + dy * dy) / 1000.;
+                }}
+                """
+
+    @staticmethod
+    def counterCoreDistances(counter_ids: str, core_x: str, core_y: str) -> str:
+        """
+        Generate a complete C++ function that calculates the ground-plane distances (in km) from the
+        shower core to every hit counter, using the declared counter position table (taGeometry).
+
+        :param counter_ids: Name of the RVec holding the IDs of the hit counters.
+        :param core_x: Name of the variable holding the X coordinate of the core (CLF, meters).
+        :param core_y: Name of the variable holding the Y coordinate of the core (CLF, meters).
+        :return: C++ code for the function as a string.
+        """
+        return f"""
+                ROOT::RVec<double> counterCoreDistances(const ROOT::RVec<int> &{counter_ids},
+                                                        double {core_x}, double {core_y}) {{
+                    return taGeometry::CoreDistances({counter_ids}, {core_x}, {core_y}) / 1000.;
+                }}
+                """
+
+    @staticmethod
+    def counterSiteDistances(counter_ids: str, site_id: str) -> str:
+        """
+        Generate a complete C++ function that calculates the distances (in km) from an FD site to every
+        hit counter, using the declared site and counter position tables (taGeometry).
+
+        :param counter_ids: Name of the RVec holding the IDs of the hit counters.
+        :param site_id: Name of the variable holding the FD site ID.
+        :return: C++ code for the function as a string.
+        """
+        return f"""
+                ROOT::RVec<double> counterSiteDistances(const ROOT::RVec<int> &{counter_ids}, int {site_id}) {{
+                    return taGeometry::SiteDistances({counter_ids}, {site_id}) / 1000.;
                 }}
                 """
 
     @staticmethod
     def getFD_CLF(det_name: str) -> str:
         """
-        Generate a complete C++ function that calls the get_fd_xyz_clf method of TLUTI_DETECTORS
-        and fills the fd_xyz_clf array based on the det_name string.
+        Generate a complete C++ function that looks up the CLF coordinates (x, y, z in meters) of an
+        FD site, by detector name or ID, in the declared geometry tables (taGeometry).
 
         :param det_name: The string representing the detector name (det).
         :return: C++ code for the function as a string.
         """
         return f"""
-                void getFD_CLF(const std::string &{det_name}) {{
-                    double fd_xyz_clf[3];
-                    return TLUTI_DETECTORS::get_fd_xyz_clf({det_name}, fd_xyz_clf);
+                ROOT::RVec<double> getFD_CLF(const std::string &{det_name}) {{
+                    return taGeometry::FdClf({det_name});
                 }}
                 """
 
@@ -1,8 +1,51 @@
 # txSD_spectrum.py
+from src.library.naming import name_suffix
 
 
 class TAx4SDSpectrumFunctions:
     """
     A class that contains various utility functions for generating C++ code
     related to ROOT RVec operations.
-    """
\ No newline at end of file
+
+    The spectrum itself (event counts, exposure, flux and E^3 J) is configured in the
+    'spectrum' section of the analysis configuration.
+    """
+
+    @staticmethod
+    def log10Energy(energy: str) -> str:
+        """
+        Generate C++ code to convert an energy in EeV (e.g. rufldf.energy) to log10(E/eV),
+        the binning variable of the spectrum.
+
+        :param energy: Name of the variable holding the energy in EeV.
+        :return: C++ code as a string.
+        """
+        return f"""
+                double log10Energy(double {energy}) {{
+                    return {energy} > 0. ? 18. + std::log10({energy}) : -1.;
+                }}
+        """
+
+    @staticmethod
+    def energyInBinRange(log10_energy: str, log10_min: str, log10_max: str) -> str:
+        """
+        Generate C++ code to check whether log10(E/eV) lies in the spectrum range. `log10_min` and
+        `log10_max` are baked into the code: pass them as `constant: true` arguments. They are part of
+        the function name (e.g. `energyInBinRange_18_20p5`), so several ranges can be used in one analysis.
+
+        :param log10_energy: Name of the variable holding log10(E/eV).
+        :param log10_min: Lower edge of the spectrum range.
+        :param log10_max: Upper edge of the spectrum range.
+        :return: C++ code as a string.
+        """
+        suffix = name_suffix(float(log10_min), float(log10_max))
+        return f"""
+                #ifndef TX_SD_ENERGY_IN_BIN_RANGE_{suffix.upper()}_H
+                #define TX_SD_ENERGY_IN_BIN_RANGE_{suffix.upper()}_H
+
+                bool energyInBinRange_{suffix}(double {log10_energy}) {{
+                    return {log10_energy} >= {float(log10_min)!r} && {log10_energy} < {float(log10_max)!r};
+                }}
+
+                #endif
+        """
@@ -0,0 +1,28 @@
+import argparse
+
+from src.rdf_analyzer.zone_map import ZoneMap
+
+
+def parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Build a zone map (per-cluster min/max of scalar branches) for a ROOT file.")
+    parser.add_argument("file_path", type=str, help="Path (or glob pattern) of the ROOT file(s)")
+    parser.add_argument("branches", type=str, nargs="+",
+                        help="Scalar branches to index (e.g. event date, run number, site)")
+    parser.add_argument("--tree_name", type=str, default="taTree",
+                        help="TTree name (default: 'taTree')")
+    parser.add_argument("-o", "--output", type=str,
+                        help="Output sidecar file (default: <file_path>.zonemap.json)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    zone_map = ZoneMap.build(args.file_path, args.tree_name, args.branches)
+    zone_map.save(args.output or f"{args.file_path}.zonemap.json")
+
+
+if __name__ == "__main__":
+    main()
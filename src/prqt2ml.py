@@ -4,12 +4,18 @@ import numpy as np
 import pyarrow.parquet as pq
 import re
 
+from src.rdf_analyzer.compaction import CompactionPlan, DEFAULT_FLOAT_TOLERANCE
+from src.rdf_analyzer.memory import MemoryMonitor, parse_memory_size
+from src.rdf_analyzer.prefetch import Prefetcher, DEFAULT_PREFETCH_CHUNK_BYTES
+from src.rdf_analyzer.zero_suppression import parse_zero_suppress, zero_suppress
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
         description="Process physics data in Parquet format with multiple transformation options"
     )
-    parser.add_argument("input_file", help="Input Parquet file")
+    parser.add_argument("input_file",
+                        help="Input Parquet file (from rt2npz, or from runMyAnalysis with snapshot_format: parquet)")
     parser.add_argument("-o", "--output", default="processed_data.parquet",
                         help="Output file name (default: processed_data.parquet)")
     parser.add_argument("--filter", type=str,
@@ -18,17 +24,38 @@ def parse_args():
                         help="New features to add from jagged columns (e.g., 'MIP0:mean,max')")
     parser.add_argument("--truncate", nargs="+", type=lambda x: x.split(":"),
                         help="Truncate/pad jagged columns (e.g., 'MIP0:100' for max 100 elements)")
+    parser.add_argument("--zero-suppress", type=parse_zero_suppress, nargs="+", metavar="FADC:PEDESTAL[:THR]",
+                        help="Store the FADC traces FADC[N][2][128] zero-suppressed: only the bins more than THR "
+                             "counts (default: 0) above the counter pedestal PEDESTAL[N][2], as offsets and "
+                             "pedestal-subtracted values per layer (e.g. 'fadc:pedestal:3')")
     parser.add_argument("--scale", nargs="+", type=lambda x: x.split(":"),
                         help="Scale numeric columns (e.g., 'Energy:zscore' or 'Xmax:minmax')")
     parser.add_argument("--rename", nargs="+", type=lambda x: x.split(":"),
                         help="Rename columns (e.g., 'Energy_mc:true_energy')")
     parser.add_argument("--format", choices=["parquet", "npz", "hdf5"], default="parquet",
                         help="Output format (default: parquet)")
+    parser.add_argument("-M", "--memory_budget", type=str,
+                        help="Memory budget (e.g. '4GB'). Row groups are processed in chunks sized to fit in it")
+    parser.add_argument("-m", "--memory_report", action="store_true",
+                        help="Print the peak memory of each stage and the largest columns")
+    parser.add_argument("-P", "--prefetch", type=int, default=0, metavar="DEPTH",
+                        help="Read and decompress up to DEPTH chunks of row groups ahead on a background thread, "
+                             "and report the time stalled on I/O (default: 0, no prefetching)")
+    parser.add_argument("-C", "--compact", type=float, nargs="?", const=DEFAULT_FLOAT_TOLERANCE, metavar="TOLERANCE",
+                        help="Store floats (including scaled columns) as float16/float32 where the relative "
+                             f"round-trip error stays within TOLERANCE (default: {DEFAULT_FLOAT_TOLERANCE:g}), and "
+                             "integers in the smallest type that holds their range. Reports the bytes saved per column")
     return parser.parse_args()
 
 
-def process_data(data, args):
+def process_data(data, args, scale_stats=None):
     """Apply all requested transformations to the data"""
+    data = derive_data(data, args)
+    return scale_and_rename(data, args, scale_stats)
+
+
+def derive_data(data, args):
+    """Filter events, process jagged arrays and add derived features"""
 
     # 1. Filter events
     if args.filter:
@@ -57,18 +84,29 @@ def process_data(data, args):
                 elif op == "count":
                     data[f"{col}_count"] = ak.num(jagged, axis=1)
 
-    # 4. Scale numeric columns
+    # 4. Zero-suppress FADC traces
+    if args.zero_suppress:
+        for fadc, pedestal, threshold in args.zero_suppress:
+            data = zero_suppress(data, fadc, pedestal, threshold)
+
+    return data
+
+
+def scale_and_rename(data, args, scale_stats=None):
+    """Scale numeric columns and rename columns. Scaling uses scale_stats if given, else the data itself"""
+
+    # 5. Scale numeric columns
     if args.scale:
         for col, method in args.scale:
             values = ak.to_numpy(data[col])
             if method == "zscore":
-                mean, std = np.mean(values), np.std(values)
+                mean, std = scale_stats[col] if scale_stats else (np.mean(values), np.std(values))
                 data[col] = (values - mean) / std
             elif method == "minmax":
-                _min, _max = np.min(values), np.max(values)
+                _min, _max = scale_stats[col] if scale_stats else (np.min(values), np.max(values))
                 data[col] = (values - _min) / (_max - _min)
 
-    # 5. Rename columns
+    # 6. Rename columns
     if args.rename:
         for old_name, new_name in args.rename:
             data[new_name] = data[old_name]
@@ -88,17 +126,147 @@ def save_data(data, args):
     print(f"Saved processed data to {args.output}")
 
 
+def iterate_row_groups(input_file, chunk_bytes):
+    """Read the Parquet file in chunks of whole row groups of about chunk_bytes (uncompressed)"""
+    metadata = pq.ParquetFile(input_file).metadata
+    row_groups, size = [], 0
+    for i in range(metadata.num_row_groups):
+        row_groups.append(i)
+        size += metadata.row_group(i).total_byte_size
+        if size >= chunk_bytes:
+            yield ak.from_parquet(input_file, row_groups=row_groups)
+            row_groups, size = [], 0
+    if row_groups:
+        yield ak.from_parquet(input_file, row_groups=row_groups)
+
+
+def read_chunks(args, chunk_bytes, name):
+    """Iterate over the row-group chunks of the input, read ahead on a background thread if prefetching"""
+    chunks = iterate_row_groups(args.input_file, chunk_bytes)
+    return Prefetcher(chunks, args.prefetch, name) if args.prefetch else chunks
+
+
+def compute_scale_stats(chunks, args):
+    """Compute the scaling statistics of the filtered data over all chunks"""
+    sums = {col: [0, 0., 0., np.inf, -np.inf] for col, _ in args.scale}
+    for chunk in chunks:
+        chunk = derive_data(chunk, args)
+        for col, stats in sums.items():
+            values = ak.to_numpy(chunk[col])
+            if len(values) == 0:
+                continue
+            stats[0] += len(values)
+            stats[1] += np.sum(values)
+            stats[2] += np.sum(np.square(values, dtype=np.float64))
+            stats[3] = min(stats[3], np.min(values))
+            stats[4] = max(stats[4], np.max(values))
+
+    scale_stats = {}
+    for col, method in args.scale:
+        n, total, total_sq, _min, _max = sums[col]
+        if method == "zscore":
+            mean = total / n
+            scale_stats[col] = (mean, np.sqrt(total_sq / n - mean ** 2))
+        elif method == "minmax":
+            scale_stats[col] = (_min, _max)
+    return scale_stats
+
+
+def compute_compaction_plan(chunks, args, scale_stats=None):
+    """Choose the compacted column types from the processed data of all chunks"""
+    plan = CompactionPlan(args.compact)
+    for chunk in chunks:
+        plan.update(process_data(chunk, args, scale_stats))
+    plan.choose()
+    return plan
+
+
+def process_chunks(args, chunk_bytes, memory):
+    """Process the input chunk by chunk, streaming Parquet output one row group per chunk"""
+    scale_stats = None
+    if args.scale:
+        with memory.stage("scale statistics"):
+            chunks = read_chunks(args, chunk_bytes, "scale statistics")
+            scale_stats = compute_scale_stats(chunks, args)
+        if args.prefetch:
+            chunks.print_report()
+
+    # Every row group must have the same schema, so the compacted types are chosen in a separate pass
+    plan = None
+    if args.compact is not None:
+        with memory.stage("compaction plan"):
+            chunks = read_chunks(args, chunk_bytes, "compaction plan")
+            plan = compute_compaction_plan(chunks, args, scale_stats)
+        if args.prefetch:
+            chunks.print_report()
+
+    writer = None
+    processed_chunks = []
+    sizes = {}
+    chunks = read_chunks(args, chunk_bytes, "process")
+    with memory.stage("process"):
+        try:
+            for chunk in chunks:
+                processed = process_data(chunk, args, scale_stats)
+                if plan is not None:
+                    processed = plan.apply(processed)
+                for field in processed.fields:
+                    sizes[field] = max(processed[field].nbytes, sizes.get(field, 0))
+                if args.format != "parquet":
+                    processed_chunks.append(processed)
+                    continue
+                table = ak.to_arrow_table(processed)
+                if writer is None:
+                    writer = pq.ParquetWriter(args.output, table.schema)
+                writer.write_table(table)
+                memory.check("process")
+        finally:
+            if writer is not None:
+                writer.close()
+    if args.prefetch:
+        chunks.print_report()
+
+    if args.format == "parquet":
+        print(f"Saved processed data to {args.output}")
+    else:
+        print(f"The {args.format} format is not written in chunks. Concatenating all chunks before saving.")
+        with memory.stage("save"):
+            save_data(ak.concatenate(processed_chunks), args)
+    if plan is not None:
+        plan.print_report()
+    return sizes
+
+
 def main():
     args = parse_args()
+    memory = MemoryMonitor(parse_memory_size(args.memory_budget) if args.memory_budget else None)
+
+    # With a memory budget or prefetching, process the row groups in chunks (that fit in the budget)
+    chunk_bytes = memory.chunk_bytes(4 + args.prefetch) or (DEFAULT_PREFETCH_CHUNK_BYTES if args.prefetch else None)
+    if chunk_bytes:
+        print(f"Processing in chunks of {chunk_bytes // 2 ** 20} MB")
+        sizes = process_chunks(args, chunk_bytes, memory)
+    else:
+        # Load data with memory mapping for large files
+        with memory.stage("read"):
+            data = ak.from_parquet(args.input_file)
 
-    # Load data with memory mapping for large files
-    data = ak.from_parquet(args.input_file)
+        # Process data
+        with memory.stage("process"):
+            processed_data = process_data(data, args)
+            if args.compact is not None:
+                plan = CompactionPlan(args.compact)
+                plan.update(processed_data)
+                processed_data = plan.apply(processed_data)
+                plan.print_report()
+        sizes = {field: processed_data[field].nbytes for field in processed_data.fields}
 
-    # Process data
-    processed_data = process_data(data, args)
+        # Save results
+        with memory.stage("save"):
+            save_data(processed_data, args)
 
-    # Save results
-    save_data(processed_data, args)
+    if args.memory_report:
+        memory.print_report(sizes)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,259 @@
+from typing import Dict, Any, List, Optional, Tuple
+import hashlib
+import shutil
+import glob
+import json
+import os
+
+import numpy as np
+import dstpy as dst
+
+from src.rdf_analyzer.utils import logger
+
+
+class CutInfo:
+    def __init__(self, name: str, n_pass: int, n_all: int):
+        """
+        Pass and total counts of one filter, merged over checkpoint segments. Mirrors ROOT's TCutInfo.
+
+        :param name: The filter name.
+        :param n_pass: Number of entries passing the filter.
+        :param n_all: Number of entries entering the filter.
+        """
+        self.name = name
+        self.n_pass = n_pass
+        self.n_all = n_all
+
+    def GetName(self) -> str:
+        return self.name
+
+    def GetPass(self) -> int:
+        return self.n_pass
+
+    def GetAll(self) -> int:
+        return self.n_all
+
+    def GetEff(self) -> float:
+        return 100. * self.n_pass / self.n_all if self.n_all else 0.
+
+
+class CheckpointManager:
+    def __init__(self, checkpoint_dir: str, key: str, segments: List[Tuple[int, int]]):
+        """
+        Persists the results of an analysis segment by segment, so that a restarted job resumes after the last
+        completed segment instead of reprocessing it.
+
+        Each completed segment leaves its partial histograms ('segment_<i>.root'), its cut-flow counts (in
+        'state.json'), its event lists ('event_list_<name>_<i>.npy') and its snapshot of selected events
+        ('processed_tree_<i>.root' or '.parquet').
+
+        :param checkpoint_dir: Directory of the checkpoint files.
+        :param key: Digest of the configuration and input; checkpoints of a different key are discarded.
+        :param segments: The [start, stop) input entry ranges processed one after the other.
+        """
+        self.checkpoint_dir = checkpoint_dir
+        self.state_file = os.path.join(checkpoint_dir, "state.json")
+        self.key = key
+        self.segments = segments
+        self.cut_flows: Dict[int, Dict[str, List[int]]] = {}
+        self._load_state()
+
+    @staticmethod
+    def config_key(config: Dict[str, Any], every: Any, seed: int = 0) -> str:
+        """
+        Compute the digest of everything the results of a checkpointed run depend on: the configuration, the
+        segmentation, the seed of the bootstrap replicas, and the size and modification time of the input files,
+        of the library file that generates the C++ code of the columns and of the zone map.
+
+        :param config: The analysis configuration.
+        :param every: The segmentation ('file' or a number of entries).
+        :param seed: The --seed of the run.
+        :return: Hexadecimal SHA-1 digest.
+        """
+        input_files = [(path, os.path.getsize(path), os.path.getmtime(path))
+                       for path in sorted(glob.glob(config['input_file']))]
+        side_files = [(path, os.path.getsize(path), os.path.getmtime(path))
+                      for path in (config.get('library_file'), config.get('zone_map')) if path and os.path.exists(path)]
+        content = json.dumps([config, str(every), seed, input_files, side_files], sort_keys=True, default=str)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    @staticmethod
+    def segment_ranges(every: Any, file_ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """
+        Split the input into segments: one per input file, or ranges of a fixed number of entries.
+
+        :param every: 'file', or the number of entries per segment.
+        :param file_ranges: The [start, stop) entry ranges of the input files.
+        :return: List of [start, stop) entry ranges.
+        """
+        if str(every) == 'file':
+            return [(start, stop) for start, stop in file_ranges if stop > start]
+        n_entries = file_ranges[-1][1] if file_ranges else 0
+        step = max(int(every), 1)
+        return [(start, min(start + step, n_entries)) for start in range(0, n_entries, step)]
+
+    def _load_state(self) -> None:
+        """
+        Load the completed segments of a previous run with the same key, or start a new checkpoint directory.
+        """
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r') as file:
+                state = json.load(file)
+            if state.get('key') == self.key and [tuple(s) for s in state.get('segments', [])] == self.segments:
+                self.cut_flows = {int(index): cut_flow for index, cut_flow in state.get('cut_flows', {}).items()}
+                logger.info(f"Resuming from checkpoint: {len(self.cut_flows)} of {len(self.segments)} segments done")
+                return
+            logger.warning(f"Checkpoint in {self.checkpoint_dir} is from a different configuration or input. "
+                           f"Starting over.")
+            self.clear()
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self._save_state()
+
+    def _save_state(self) -> None:
+        """
+        Write the state file atomically, so that a job killed while writing it leaves the previous state.
+        """
+        temporary_file = f"{self.state_file}.tmp"
+        with open(temporary_file, 'w') as file:
+            json.dump({'key': self.key, 'segments': self.segments, 'cut_flows': self.cut_flows}, file)
+        os.replace(temporary_file, self.state_file)
+
+    def pending_segments(self) -> List[Tuple[int, Tuple[int, int]]]:
+        """
+        Get the segments that have not been completed yet.
+
+        :return: List of (segment index, [start, stop) entry range).
+        """
+        return [(index, segment) for index, segment in enumerate(self.segments) if index not in self.cut_flows]
+
+    def snapshot_file(self, index: int, output_format: str = "root") -> str:
+        """
+        Get the path of the snapshot of a segment.
+
+        :param index: The segment index.
+        :param output_format: 'root' or 'parquet'.
+        :return: Path to the segment's snapshot file.
+        """
+        return os.path.join(self.checkpoint_dir, f"processed_tree_{index}.{output_format}")
+
+    def save_segment(self, index: int, histograms: List[Any], cut_flow: Any) -> None:
+        """
+        Persist the partial histograms and cut-flow counts of a completed segment, then mark it as done.
+
+        :param index: The segment index.
+        :param histograms: The filled histograms of the segment (None entries are skipped).
+        :param cut_flow: The cut-flow report of the segment.
+        """
+        segment_file = os.path.join(self.checkpoint_dir, f"segment_{index}.root")
+        output = dst.ROOT.TFile(f"{segment_file}.tmp", "RECREATE")
+        for histogram in histograms:
+            if histogram:
+                output.WriteObject(histogram, histogram.GetName())
+        output.Close()
+        os.replace(f"{segment_file}.tmp", segment_file)
+
+        self.cut_flows[index] = {info.GetName(): [int(info.GetPass()), int(info.GetAll())] for info in cut_flow}
+        self._save_state()
+        logger.info(f"Checkpoint: segment {index + 1} of {len(self.segments)} done")
+
+    def save_rows(self, index: int, name: str, rows: np.ndarray) -> None:
+        """
+        Persist the rows of an event list collected in a segment. Call before `save_segment`.
+
+        :param index: The segment index.
+        :param name: The event list name.
+        :param rows: The collected rows.
+        """
+        np.save(os.path.join(self.checkpoint_dir, f"event_list_{name}_{index}.npy"), rows)
+
+    def merged_rows(self, name: str, width: int) -> np.ndarray:
+        """
+        Concatenate the rows of an event list over all segments.
+
+        :param name: The event list name.
+        :param width: The number of values per row.
+        :return: Array of shape (rows, width).
+        """
+        files = [os.path.join(self.checkpoint_dir, f"event_list_{name}_{index}.npy")
+                 for index in sorted(self.cut_flows)]
+        rows = [np.load(file) for file in files if os.path.exists(file)]
+        return np.concatenate(rows) if rows else np.zeros((0, width))
+
+    def merged_histograms(self, names: List[Optional[str]]) -> List[Any]:
+        """
+        Merge the partial histograms of all segments.
+
+        :param names: The histogram names, in booking order (None for failed bookings).
+        :return: The merged histograms, in the same order (None where no segment has the histogram).
+        """
+        merged: List[Any] = [None] * len(names)
+        for index in sorted(self.cut_flows):
+            file = dst.ROOT.TFile.Open(os.path.join(self.checkpoint_dir, f"segment_{index}.root"))
+            for i, name in enumerate(names):
+                histogram = file.Get(name) if name else None
+                if not histogram:
+                    continue
+                if merged[i] is None:
+                    merged[i] = histogram.Clone(name)
+                    if merged[i].InheritsFrom("TH1"):
+                        merged[i].SetDirectory(0)
+                else:
+                    merged[i].Add(histogram)
+            file.Close()
+        return merged
+
+    def merged_cut_flow(self) -> List[CutInfo]:
+        """
+        Sum the cut-flow counts of all segments.
+
+        :return: List of CutInfo, in the order of the filters.
+        """
+        counts: Dict[str, List[int]] = {}
+        for index in sorted(self.cut_flows):
+            for name, (n_pass, n_all) in self.cut_flows[index].items():
+                total = counts.setdefault(name, [0, 0])
+                total[0] += n_pass
+                total[1] += n_all
+        return [CutInfo(name, n_pass, n_all) for name, (n_pass, n_all) in counts.items()]
+
+    def merge_snapshots(self, output_file: str, output_format: str = "root") -> None:
+        """
+        Merge the snapshots of all segments into one output file.
+
+        :param output_file: Path to the merged file.
+        :param output_format: 'root' or 'parquet'.
+        """
+        files = [self.snapshot_file(index, output_format) for index in sorted(self.cut_flows)]
+        files = [file for file in files if os.path.exists(file)]
+        if not files:
+            logger.warning(f"No events passed the selection. {output_file} was not written.")
+            return
+
+        if output_format == "parquet":
+            import pyarrow.parquet as pq
+
+            writer = None
+            try:
+                for file in files:
+                    table = pq.read_table(file)
+                    if writer is None:
+                        writer = pq.ParquetWriter(output_file, table.schema)
+                    writer.write_table(table)
+            finally:
+                if writer is not None:
+                    writer.close()
+        else:
+            merger = dst.ROOT.TFileMerger(False)
+            merger.OutputFile(output_file, "RECREATE")
+            for file in files:
+                merger.AddFile(file)
+            if not merger.Merge():
+                logger.error(f"Failed to merge the checkpoint snapshots into {output_file}.")
+                return
+        logger.info(f"Merged {len(files)} checkpoint snapshots into {output_file}")
+
+    def clear(self) -> None:
+        """
+        Remove the checkpoint directory, e.g. after the results have been saved.
+        """
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
@@ -0,0 +1,185 @@
+from typing import Any, Dict, Iterable, Optional
+import numpy as np
+
+from src.rdf_analyzer.memory import format_bytes
+from src.rdf_analyzer.utils import logger
+
+# Default relative precision kept by the float downcasts: float32 rounds to 6e-8, so it always passes; float16
+# (5e-4) only passes with an explicit, looser tolerance.
+DEFAULT_FLOAT_TOLERANCE = 1e-6
+
+# Candidate types, narrowest first.
+FLOAT_TYPES = (np.float16, np.float32)
+SIGNED_TYPES = (np.int8, np.int16, np.int32, np.int64)
+UNSIGNED_TYPES = (np.uint8, np.uint16, np.uint32, np.uint64)
+
+
+def leaf_values(column: Any) -> Optional[np.ndarray]:
+    """
+    Get the numbers of a flat or jagged awkward column as one flat NumPy array.
+
+    :param column: An awkward array field.
+    :return: The flat values, or None if the column holds records, strings or missing values.
+    """
+    import awkward as ak
+
+    try:
+        values = ak.to_numpy(ak.flatten(column, axis=None))
+    except (TypeError, ValueError):
+        return None
+    return values if values.dtype.kind in "fiu" else None
+
+
+def relative_error(values: np.ndarray, dtype: Any) -> float:
+    """
+    Largest relative error of casting floats to a narrower type and back. NaNs and infinities must stay as they
+    are; finite values that overflow count as an infinite error.
+
+    :param values: The floating-point values.
+    :param dtype: The narrower floating-point type.
+    :return: The largest |x - cast(x)| / |x| over the nonzero values.
+    """
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        cast = values.astype(dtype).astype(values.dtype)
+        same = (cast == values) | (np.isnan(cast) & np.isnan(values))
+        if np.all(same):
+            return 0.
+        error = np.abs(cast[~same] - values[~same]) / np.abs(values[~same])
+    return float(np.max(np.nan_to_num(error, nan=np.inf, posinf=np.inf)))
+
+
+class CompactionPlan:
+    def __init__(self, float_tolerance: float = DEFAULT_FLOAT_TOLERANCE):
+        """
+        Chooses the narrowest storage type of each numeric column of converted data: floats are downcast to
+        float16 or float32 when the round-trip relative error stays within the tolerance, and integers are narrowed
+        to the smallest type that holds their observed range. Flat and jagged columns are handled alike; record,
+        string and optional columns are kept as they are.
+
+        The types are chosen from statistics accumulated over all the data (`update`, chunk by chunk), so that
+        every chunk written is given the same schema. `apply` casts a chunk, checks the round-trip error and
+        counts the bytes saved per column.
+
+        :param float_tolerance: Largest relative error accepted for a float downcast.
+        """
+        self.float_tolerance = float_tolerance
+        self.stats = {}
+        self.types = None
+        self.bytes_before = {}
+        self.bytes_after = {}
+        self.max_errors = {}
+
+    def update(self, data: Any) -> None:
+        """
+        Accumulate the ranges of the integer columns and the round-trip errors of the float columns.
+
+        :param data: An awkward array of records, e.g. one chunk of the converted data.
+        """
+        for field in data.fields:
+            values = leaf_values(data[field])
+            if values is None:
+                self.stats[field] = None
+                continue
+            stats = self.stats.setdefault(field, {'dtype': values.dtype})
+            if stats is None or stats['dtype'] != values.dtype:
+                self.stats[field] = None
+            elif values.dtype.kind == "f":
+                for dtype in FLOAT_TYPES:
+                    if np.dtype(dtype).itemsize < values.dtype.itemsize and len(values):
+                        stats[dtype] = max(stats.get(dtype, 0.), relative_error(values, dtype))
+            elif len(values):
+                stats['min'] = min(stats.get('min', values.min()), values.min())
+                stats['max'] = max(stats.get('max', values.max()), values.max())
+
+    def choose(self) -> Dict[str, Any]:
+        """
+        Choose the storage type of each column from the accumulated statistics.
+
+        :return: Dictionary with the column names as keys and the NumPy types as values, for the columns that
+            are narrowed.
+        """
+        self.types = {}
+        for field, stats in self.stats.items():
+            if stats is None:
+                continue
+            dtype = stats['dtype']
+            if dtype.kind == "f":
+                candidates = [candidate for candidate in FLOAT_TYPES if candidate in stats
+                              and stats[candidate] <= self.float_tolerance]
+            elif 'min' not in stats:
+                candidates = []
+            else:
+                types = SIGNED_TYPES if stats['min'] < 0 else UNSIGNED_TYPES
+                candidates = [candidate for candidate in types
+                              if np.iinfo(candidate).min <= stats['min'] and stats['max'] <= np.iinfo(candidate).max]
+            if candidates and np.dtype(candidates[0]).itemsize < dtype.itemsize:
+                self.types[field] = candidates[0]
+        return self.types
+
+    def apply(self, data: Any) -> Any:
+        """
+        Cast the columns of a chunk to their chosen types, and check that the round trip is within the tolerance
+        (exact for integers).
+
+        :param data: An awkward array of records, e.g. one chunk of the converted data.
+        :return: The compacted array.
+        :raises ValueError: If a column does not round-trip, e.g. a chunk that was not passed to `update`.
+        """
+        import awkward as ak
+
+        if self.types is None:
+            self.choose()
+        for field in data.fields:
+            self.bytes_before[field] = self.bytes_before.get(field, 0) + data[field].nbytes
+            dtype = self.types.get(field)
+            if dtype is not None:
+                values = leaf_values(data[field])
+                if np.dtype(dtype).kind == "f":
+                    error = relative_error(values, dtype)
+                    ok = error <= self.float_tolerance
+                else:
+                    error = 0.
+                    ok = bool(np.array_equal(values.astype(dtype), values))
+                if not ok:
+                    raise ValueError(f"Column {field} does not round-trip through {np.dtype(dtype).name} "
+                                     f"(relative error {error:.3g}, tolerance {self.float_tolerance:.3g})")
+                self.max_errors[field] = max(self.max_errors.get(field, 0.), error)
+                data[field] = ak.values_astype(data[field], dtype)
+            self.bytes_after[field] = self.bytes_after.get(field, 0) + data[field].nbytes
+        return data
+
+    def print_report(self) -> None:
+        """Log the type, largest round-trip error and bytes saved of each compacted column, and the total."""
+        logger.info(f"Compaction report (float tolerance {self.float_tolerance:.3g}):")
+        for field, dtype in sorted(self.types.items(), key=lambda item: self.saved(item[0]), reverse=True):
+            logger.info(f"  {field:<40} {self.stats[field]['dtype'].name:>8} -> {np.dtype(dtype).name:<8} "
+                        f"max error {self.max_errors.get(field, 0.):.2e}  saved {format_bytes(self.saved(field)):>10}")
+        before = sum(self.bytes_before.values())
+        after = sum(self.bytes_after.values())
+        if before:
+            logger.info(f"  Total: {format_bytes(before)} -> {format_bytes(after)} "
+                        f"({100. * (before - after) / before:.1f}% saved)")
+
+    def saved(self, field: str) -> int:
+        """
+        Bytes saved on a column so far.
+
+        :param field: The column name.
+        :return: The in-memory size before compaction minus the size after.
+        """
+        return self.bytes_before.get(field, 0) - self.bytes_after.get(field, 0)
+
+
+def compaction_plan(chunks: Iterable[Any], float_tolerance: float = DEFAULT_FLOAT_TOLERANCE) -> CompactionPlan:
+    """
+    Build a compaction plan from a pass over all the chunks of the data.
+
+    :param chunks: Iterable of awkward arrays of records.
+    :param float_tolerance: Largest relative error accepted for a float downcast.
+    :return: The plan, with its types chosen.
+    """
+    plan = CompactionPlan(float_tolerance)
+    for chunk in chunks:
+        plan.update(chunk)
+    plan.choose()
+    return plan
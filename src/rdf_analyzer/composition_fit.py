@@ -0,0 +1,296 @@
+from typing import Dict, Any, List, Optional, Tuple
+import multiprocessing
+import hashlib
+import glob
+import json
+import os
+
+import numpy as np
+import dstpy as dst
+
+from src.rdf_analyzer.spectrum import spectrum_bin_edges
+from src.rdf_analyzer.utils import logger
+
+
+def fit_templates(task: Tuple[np.ndarray, np.ndarray, int, float]) -> Dict[str, Any]:
+    """
+    Fit the fractions of the template distributions to one data distribution. Runs in a worker process.
+
+    The fit maximizes the binned Poisson likelihood of the data given the normalized templates, with the
+    fractions summing to one, by expectation-maximization (which keeps the fractions in [0, 1]). The fraction
+    errors come from the inverse of the observed information of the template yields. The fit quality is the
+    likelihood-ratio chi^2 (Poisson deviance) over the Xmax bins covered by the templates.
+
+    :param task: Tuple of (data counts per Xmax bin, template counts per template and Xmax bin,
+        maximum number of iterations, convergence tolerance on the fractions).
+    :return: Dictionary with 'fractions', 'errors', 'n_events', 'n_outside' (events in Xmax bins no template
+        covers), 'deviance', 'ndf', 'iterations' and 'converged'.
+    """
+    data, templates, max_iterations, tolerance = task
+    n_templates = len(templates)
+    totals = templates.sum(axis=1)
+    usable = totals > 0
+    covered = templates[usable].sum(axis=0) > 0
+    shapes = templates[usable][:, covered] / totals[usable, None]
+    counts = data[covered]
+    n_events = counts.sum()
+
+    result = {'fractions': [np.nan] * n_templates, 'errors': [np.nan] * n_templates, 'n_events': float(n_events),
+              'n_outside': float(data[~covered].sum()), 'deviance': np.nan, 'ndf': 0, 'iterations': 0,
+              'converged': False}
+    if n_events <= 0 or not usable.any():
+        return result
+
+    k = len(shapes)
+    fractions = np.full(k, 1. / k)
+    for iteration in range(1, max_iterations + 1):
+        expected = fractions @ shapes
+        ratio = np.divide(counts, expected, out=np.zeros_like(counts), where=expected > 0)
+        updated = fractions * (shapes @ ratio) / n_events
+        change = np.max(np.abs(updated - fractions))
+        fractions = updated
+        result['iterations'] = iteration
+        if change < tolerance:
+            result['converged'] = True
+            break
+
+    expected = n_events * (fractions @ shapes)
+    weights = np.divide(counts, expected ** 2, out=np.zeros_like(counts), where=expected > 0)
+    information = (shapes * weights) @ shapes.T
+    jacobian = (np.eye(k) - fractions[:, None]) / n_events
+    covariance = jacobian @ np.linalg.pinv(information) @ jacobian.T
+
+    filled = counts > 0
+    deviance = 2. * (np.sum(expected - counts) + np.sum(counts[filled] * np.log(counts[filled] / expected[filled])))
+    result['fractions'] = np.zeros(n_templates)
+    result['fractions'][usable] = fractions
+    result['errors'] = np.full(n_templates, np.nan)
+    result['errors'][usable] = np.sqrt(np.clip(np.diag(covariance), 0., None))
+    result['fractions'] = result['fractions'].tolist()
+    result['errors'] = result['errors'].tolist()
+    result['deviance'] = float(deviance)
+    result['ndf'] = int(max(covered.sum() - k, 0))
+    return result
+
+
+class TemplateSet:
+    def __init__(self, key: str, names: List[str], counts: np.ndarray):
+        """
+        MC Xmax distributions of each primary in energy bins, used as fit templates.
+
+        :param key: The cache key of the templates (see `cache_key`).
+        :param names: The primary names, e.g. ['proton', 'helium', 'nitrogen', 'iron'].
+        :param counts: Array of shape (primaries, energy bins, Xmax bins).
+        """
+        self.key = key
+        self.names = names
+        self.counts = counts
+
+    @staticmethod
+    def cache_key(templates: List[Dict[str, Any]], energy_edges: List[float], xmax_edges: List[float]) -> str:
+        """
+        Compute the key of a template set from everything it depends on: the template configurations, the binning,
+        and the size and modification time of the MC files.
+
+        :param templates: The 'templates' entries of the 'composition_fit' configuration.
+        :param energy_edges: The energy bin edges.
+        :param xmax_edges: The Xmax bin edges.
+        :return: Hexadecimal SHA-1 digest.
+        """
+        mc_files = [(path, os.path.getsize(path), os.path.getmtime(path))
+                    for template in templates for path in sorted(glob.glob(template['mc_file']))]
+        content = json.dumps([templates, [round(edge, 9) for edge in energy_edges],
+                              [round(edge, 9) for edge in xmax_edges], mc_files], sort_keys=True, default=str)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    @staticmethod
+    def load_or_compute(templates: List[Dict[str, Any]], energy_edges: List[float], xmax_edges: List[float],
+                        cache_dir: str) -> 'TemplateSet':
+        """
+        Load the templates from the cache, or fill them from the MC files and add them to the cache.
+
+        :param templates: The 'templates' entries of the 'composition_fit' configuration.
+        :param energy_edges: The energy bin edges.
+        :param xmax_edges: The Xmax bin edges.
+        :param cache_dir: Directory of the cached templates.
+        :return: The template set.
+        """
+        key = TemplateSet.cache_key(templates, energy_edges, xmax_edges)
+        cache_file = os.path.join(cache_dir, f"templates_{key}.json")
+        if os.path.exists(cache_file):
+            logger.info(f"Using cached Xmax templates {cache_file}")
+            return TemplateSet.load(cache_file)
+
+        template_set = TemplateSet.compute(key, templates, energy_edges, xmax_edges)
+        os.makedirs(cache_dir, exist_ok=True)
+        template_set.save(cache_file)
+        return template_set
+
+    @staticmethod
+    def compute(key: str, templates: List[Dict[str, Any]], energy_edges: List[float],
+                xmax_edges: List[float]) -> 'TemplateSet':
+        """
+        Fill the energy-Xmax histogram of each primary from its MC sample ('energy' and 'xmax' expressions of the
+        'mc_tree' in 'mc_file', after the 'cuts'). The event loops of all primaries run concurrently.
+
+        :param key: The cache key of the templates.
+        :param templates: The 'templates' entries of the 'composition_fit' configuration.
+        :param energy_edges: The energy bin edges.
+        :param xmax_edges: The Xmax bin edges.
+        :return: The template set.
+        """
+        energy = np.array(energy_edges, dtype=np.float64)
+        xmax = np.array(xmax_edges, dtype=np.float64)
+        booked = []
+        for template in templates:
+            df = dst.ROOT.RDataFrame(template.get('mc_tree', 'taTree'), template['mc_file'])
+            df = df.Define("template_energy", template['energy']).Define("template_xmax", template['xmax'])
+            for cut in template.get('cuts') or []:
+                df = df.Filter(cut)
+            model = (f"template_{template['name']}", template['name'], len(energy) - 1, energy, len(xmax) - 1, xmax)
+            booked.append(df.Histo2D(model, "template_energy", "template_xmax"))
+        dst.ROOT.RDF.RunGraphs(booked)
+
+        counts = np.array([[[histogram.GetBinContent(i + 1, j + 1) for j in range(len(xmax) - 1)]
+                            for i in range(len(energy) - 1)] for histogram in booked])
+        logger.info(f"Filled Xmax templates for {', '.join(template['name'] for template in templates)}")
+        return TemplateSet(key, [template['name'] for template in templates], counts)
+
+    def save(self, output_file: str) -> None:
+        """
+        Save the templates to a JSON file.
+
+        :param output_file: Path to the JSON file.
+        """
+        with open(output_file, 'w') as file:
+            json.dump({'key': self.key, 'names': self.names, 'counts': self.counts.tolist()}, file)
+        logger.info(f"Saved Xmax templates to {output_file}")
+
+    @staticmethod
+    def load(template_file: str) -> 'TemplateSet':
+        """
+        Load templates from a JSON file with 'names' and 'counts' lists.
+
+        :param template_file: Path to the JSON file.
+        :return: The template set.
+        """
+        with open(template_file, 'r') as file:
+            content = json.load(file)
+        return TemplateSet(content.get('key', ''), content['names'], np.array(content['counts'], dtype=np.float64))
+
+
+class CompositionFitter:
+    def __init__(self, composition: Dict[str, Any], output_dir: str, cache_dir: Optional[str] = None):
+        """
+        Fills an energy-Xmax histogram in the analysis event loop and fits the MC Xmax templates of the configured
+        primaries to each energy bin, in parallel worker processes.
+
+        :param composition: The 'composition_fit' configuration.
+        :param output_dir: Directory of the fit table.
+        :param cache_dir: Directory of the cached templates, unless 'cache_dir' is configured
+            (default: the 'template_cache' subdirectory of output_dir).
+        """
+        self.composition = composition
+        self.output_dir = output_dir
+        self.name = composition.get('name', 'composition')
+        self.energy_edges = spectrum_bin_edges(composition['energy'])
+        self.xmax_edges = spectrum_bin_edges(composition['xmax'])
+        self.cache_dir = composition.get('cache_dir') or cache_dir or os.path.join(output_dir, "template_cache")
+        self.n_workers = composition.get('processes') or os.cpu_count()
+
+    def book(self, df: dst.ROOT.RDataFrame) -> Any:
+        """
+        Book the energy-Xmax histogram of the selected events.
+
+        :param df: The RDataFrame of selected events.
+        :return: The booked histogram.
+        """
+        energy = np.array(self.energy_edges, dtype=np.float64)
+        xmax = np.array(self.xmax_edges, dtype=np.float64)
+        logger.info(f"Creating composition histogram for {self.composition['xmax_column']} "
+                    f"vs. {self.composition['energy_column']}")
+        return df.Histo2D((f"{self.name}_data", "Data;log_{10}(E/eV);X_{max} [g/cm^{2}]",
+                           len(energy) - 1, energy, len(xmax) - 1, xmax),
+                          self.composition['energy_column'], self.composition['xmax_column'])
+
+    def finalize(self, booked: Any) -> List[Any]:
+        """
+        Fit the templates to every energy bin and write the fractions, their errors and the fit quality to
+        '<name>.txt'. Bins with fewer than 'min_events' events are not fitted.
+
+        :param booked: The booked energy-Xmax histogram, or the filled one (e.g. merged from checkpoints).
+        :return: The data histogram, one fraction histogram per primary and the deviance/ndf histogram.
+        """
+        data_hist = booked.GetPtr() if hasattr(booked, 'GetPtr') else booked
+        n_energy, n_xmax = len(self.energy_edges) - 1, len(self.xmax_edges) - 1
+        data = np.array([[data_hist.GetBinContent(i + 1, j + 1) for j in range(n_xmax)] for i in range(n_energy)])
+        templates = TemplateSet.load_or_compute(self.composition['templates'], self.energy_edges, self.xmax_edges,
+                                                self.cache_dir)
+
+        min_events = self.composition.get('min_events', 1)
+        fitted = [i for i in range(n_energy) if data[i].sum() >= min_events]
+        tasks = [(data[i], templates.counts[:, i, :], self.composition.get('max_iterations', 10000),
+                  self.composition.get('tolerance', 1e-8)) for i in fitted]
+        logger.info(f"Fitting {len(templates.names)} templates to {len(tasks)} of {n_energy} energy bins "
+                    f"with {min(self.n_workers, max(len(tasks), 1))} workers...")
+        results: List[Optional[Dict[str, Any]]] = [None] * n_energy
+        if tasks:
+            with multiprocessing.get_context("spawn").Pool(min(self.n_workers, len(tasks))) as pool:
+                for i, result in zip(fitted, pool.map(fit_templates, tasks)):
+                    results[i] = result
+                    if not result['converged']:
+                        logger.warning(f"Composition fit of energy bin {i} did not converge.")
+
+        histograms = [data_hist]
+        for t, name in enumerate(templates.names):
+            values = [result['fractions'][t] if result else 0. for result in results]
+            errors = [result['errors'][t] if result else 0. for result in results]
+            histograms.append(self._histogram(name, f"{name} fraction;log_{{10}}(E/eV);Fraction",
+                                              np.nan_to_num(values), np.nan_to_num(errors)))
+        quality = [result['deviance'] / result['ndf'] if result and result['ndf'] else 0. for result in results]
+        histograms.append(self._histogram("deviance_ndf", "Fit quality;log_{10}(E/eV);Deviance/ndf", quality))
+        self._write_table(templates.names, results)
+        return histograms
+
+    def _histogram(self, quantity: str, title: str, values: np.ndarray,
+                   errors: Optional[np.ndarray] = None) -> dst.ROOT.TH1D:
+        """
+        Create a histogram in the energy binning from per-bin values.
+
+        :param quantity: Suffix of the histogram name.
+        :param title: Histogram and axis titles.
+        :param values: The value of each bin.
+        :param errors: The error of each bin (default: 0).
+        :return: The histogram.
+        """
+        edges = np.array(self.energy_edges, dtype=np.float64)
+        histogram = dst.ROOT.TH1D(f"{self.name}_{quantity}", title, len(edges) - 1, edges)
+        histogram.SetDirectory(0)
+        for i, value in enumerate(values):
+            histogram.SetBinContent(i + 1, value)
+            histogram.SetBinError(i + 1, errors[i] if errors is not None else 0.)
+        histogram.SetStats(0)
+        return histogram
+
+    def _write_table(self, names: List[str], results: List[Optional[Dict[str, Any]]]) -> None:
+        """
+        Write the fit table, one row per energy bin. Bins that were not fitted have NaN fractions.
+
+        :param names: The primary names.
+        :param results: The fit result of each energy bin (None for bins that were not fitted).
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        output_file = os.path.join(self.output_dir, f"{self.name}.txt")
+        header = " ".join(["log10E_low log10E_high n_events n_outside"] + [f"f_{name} f_{name}_err" for name in names]
+                          + ["deviance ndf p_value iterations converged"])
+        rows = []
+        for i, result in enumerate(results):
+            result = result or {'fractions': [np.nan] * len(names), 'errors': [np.nan] * len(names), 'n_events': 0.,
+                                'n_outside': 0., 'deviance': np.nan, 'ndf': 0, 'iterations': 0, 'converged': False}
+            p_value = dst.ROOT.TMath.Prob(result['deviance'], result['ndf']) if result['ndf'] else np.nan
+            fractions = [value for pair in zip(result['fractions'], result['errors']) for value in pair]
+            rows.append([self.energy_edges[i], self.energy_edges[i + 1], result['n_events'], result['n_outside'],
+                         *fractions, result['deviance'], result['ndf'], p_value, result['iterations'],
+                         int(result['converged'])])
+        np.savetxt(output_file, np.array(rows, dtype=np.float64), header=header, fmt="%.6g")
+        logger.info(f"Saved composition fit table to {output_file}")
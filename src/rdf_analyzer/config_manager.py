@@ -60,7 +60,8 @@ class ConfigManager:
     def _replace_placeholders_in_yaml(self) -> None:
         """
         Replaces placeholders such as 'profile_fit_index' and 'detector_id_placeholder' in the YAML config
-        directly with their actual values.
+        directly with their actual values. The 'fd_clf_x', 'fd_clf_y' and 'fd_clf_z' placeholders become the
+        constant CLF coordinates of the detector in the declared geometry tables (see DetectorGeometry).
 
         This method assumes that the configuration is a dictionary that can contain strings, lists, and dictionaries.
         """
@@ -69,8 +70,9 @@ class ConfigManager:
         replacements = {
             "profile_fit_index": str(self.profile_fit_index),
             "detector_id_placeholder": self.detector_id,
-            "fd_clf_x": str(self.config.get('detector').get('clf_x')),
-            "fd_clf_y": str(self.config.get('detector').get('clf_y'))
+            "fd_clf_x": "taGeometry::kDetectorClf[0]",
+            "fd_clf_y": "taGeometry::kDetectorClf[1]",
+            "fd_clf_z": "taGeometry::kDetectorClf[2]"
         }
 
         # Function to perform the replacement in a string
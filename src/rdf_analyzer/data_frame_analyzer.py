@@ -1,15 +1,28 @@
-
-from typing import Any, List
+from typing import Any, Dict, List, Set, Tuple, Union
 import importlib.util
+import time
 import sys
 import os
 
 import dstpy as dst
 
+from src.rdf_analyzer.checkpoint import CheckpointManager
+from src.rdf_analyzer.composition_fit import CompositionFitter
 from src.rdf_analyzer.config_manager import ConfigManager
+from src.rdf_analyzer.cut_optimizer import CutOptimizer
 from src.rdf_analyzer.data_frame_manager import DataFrameManager
+from src.rdf_analyzer.dependency_graph import DependencyGraph
+from src.rdf_analyzer.event_list import EventListCollector
+from src.rdf_analyzer.features import jagged_feature_columns
+from src.rdf_analyzer.geometry import DetectorGeometry
+from src.rdf_analyzer.group_by import GroupByAggregator
 from src.rdf_analyzer.histogram_manager import HistogramManager
 from src.rdf_analyzer.library_manager import LibraryFunctionHandler
+from src.rdf_analyzer.memory import MemoryMonitor, parse_memory_size
+from src.rdf_analyzer.preview import PreviewSampler
+from src.rdf_analyzer.reductions import declare_reductions
+from src.rdf_analyzer.spectrum import SpectrumCalculator
+from src.rdf_analyzer.zone_map import ZoneMap, COLUMN_PATTERN
 
 from src.rdf_analyzer.utils import logger
 
@@ -25,15 +38,61 @@ class DataFrameAnalyzer:
         # Get the analysis + detector configuration
         self.config = self.config_manager.config
 
+        # Track memory per stage, and size the event loop and outputs to the memory budget
+        self.memory = MemoryMonitor(parse_memory_size(self.args.memory_budget) if self.args.memory_budget else None)
+        self.n_threads = self.memory.n_threads(os.cpu_count()) if self.args.parallel else 1
+
         # Initialize other components
         self.df_manager = DataFrameManager(self.config['tree_name'],
                                            self.config['input_file'],
                                            self.config['output_dir'],
                                            self.client,
-                                           self.args.parallel)
+                                           self.args.parallel,
+                                           self.n_threads,
+                                           self.config.get('friends'))
+
+        # The detector geometry tables and the fused reductions are declared by run_analysis, if an expression
+        # refers to them
+        self.geometry = DetectorGeometry.from_config(self.config)
+
+        # Preview mode processes a sample of the input and extrapolates to the full dataset
+        self.preview = None
+        if self.args.preview is not None or self.args.preview_fraction is not None:
+            self.preview = PreviewSampler(self.args.preview, self.args.preview_fraction, self.args.seed)
 
         self.user_function_handler = LibraryFunctionHandler(self._load_analysis_library())
-        self.histogram_manager = HistogramManager(self.df_manager.output_dir)
+        self.histogram_manager = HistogramManager(os.path.join(self.df_manager.output_dir, "preview")
+                                                  if self.preview else self.df_manager.output_dir)
+        self.dependency_graph = DependencyGraph(self.config)
+        self.spectrum = None
+        if self.config.get('spectrum'):
+            self.spectrum = SpectrumCalculator(self.config['spectrum'], self.config['detector'],
+                                               self.histogram_manager.output_dir,
+                                               os.path.join(self.df_manager.output_dir, "exposure_cache"))
+        self.composition = None
+        if self.config.get('composition_fit'):
+            self.composition = CompositionFitter(self.config['composition_fit'], self.histogram_manager.output_dir,
+                                                 os.path.join(self.df_manager.output_dir, "template_cache"))
+        self.event_lists = [EventListCollector(event_list, self.histogram_manager.output_dir)
+                            for event_list in self.config.get('event_lists') or []]
+        self.group_bys = [GroupByAggregator(group_by, self.histogram_manager.output_dir)
+                          for group_by in self.config.get('group_by') or []]
+        self.uncut_df = None
+        self.checkpoint = None
+        if self.args.checkpoint:
+            if self.preview:
+                logger.warning("Checkpointing is not used in preview mode.")
+            else:
+                segments = CheckpointManager.segment_ranges(self.args.checkpoint, self.df_manager.file_ranges())
+                self.checkpoint = CheckpointManager(os.path.join(self.df_manager.output_dir, "checkpoint"),
+                                                    CheckpointManager.config_key(self.config, self.args.checkpoint,
+                                                                                 self.args.seed),
+                                                    segments)
+        self.cut_flow_report = None
+        self.zone_map_entries = None
+        self.memory_watch = None
+        self.preview_entries = None
+        self.timings = {}
 
     def _load_analysis_library(self) -> Any:
         """
@@ -66,12 +125,31 @@ class DataFrameAnalyzer:
 
     def run_analysis(self) -> List[dst.ROOT.TH1F]:
         histograms = []
+        start_time = time.perf_counter()
+
+        # Columns that no cut, histogram or snapshot column depends on are not defined:
+        live_columns = self.dependency_graph.live_columns()
+
+        # Declare the detector geometry tables and the fused reductions, if the live columns or the cuts refer to them:
+        sources = self._expression_sources(live_columns)
+        if any("taGeometry::" in source for source in sources):
+            self.geometry.declare()
+        if any("taReductions::" in source for source in sources):
+            declare_reductions()
+
+        # Join the secondary trees by event time:
+        for join_id, join in enumerate(self.config.get('joins') or []):
+            self.df_manager.join_tree(join, join_id, os.path.join(self.df_manager.output_dir, "join_cache"),
+                                      live_columns)
 
         # Define new columns:
         new_columns = self.config.get('new_columns', [])
         if new_columns:
             logger.info("Defining new columns...")
             for col in new_columns:
+                if col['name'] not in live_columns:
+                    logger.info(f"Skipping unused column {col['name']}")
+                    continue
                 self.df_manager.define_new_column(col)
 
         # Apply user functions to define custom columns:
@@ -79,21 +157,415 @@ class DataFrameAnalyzer:
         if user_funcs:
             logger.info("Applying user-defined functions...")
             for user_function in user_funcs:
+                if user_function['new_column'] not in live_columns:
+                    logger.info(f"Skipping unused user function {user_function['callable']} "
+                                f"for column {user_function['new_column']}")
+                    continue
                 new_column_dict = self.user_function_handler.apply_library_function(user_function, self.df_manager.df)
                 self.df_manager.define_new_column(new_column_dict)
 
+        # Summarize jagged columns into scalar features, one pass per vector:
+        jagged_features = jagged_feature_columns(self.config)
+        if jagged_features:
+            logger.info("Defining jagged-column features...")
+            for col in jagged_features:
+                if col['name'] not in live_columns:
+                    logger.info(f"Skipping unused feature {col['name']}")
+                    continue
+                self.df_manager.define_new_column(col)
+
+        # Keep the DataFrame before the cuts, for the pass rates of the group_by aggregations:
+        self.uncut_df = self.df_manager.df
+
         # Apply cuts:
         cuts = self.config.get('cuts', [])
         if cuts:
+            if self.args.optimize_cuts and self.args.parallel:
+                logger.warning("Cut optimization (-O) samples the input with Range, which implicit multithreading "
+                               "(--parallel) does not support. Cuts applied in configured order.")
+            elif self.args.optimize_cuts:
+                cuts = CutOptimizer(self.dependency_graph, self.args.optimize_cuts).optimize(self.df_manager.df, cuts)
             logger.info("Applying cuts...")
             for cut in cuts:
                 self.df_manager.apply_selection(cut)
 
-        # Create histograms:
+            # Skip the entry ranges that cannot pass the cuts:
+            zone_map_file = self.config.get('zone_map')
+            if zone_map_file:
+                self._restrict_to_zone_map(zone_map_file, cuts)
+
+        # Restrict the event loop to the preview sample:
+        if self.preview:
+            n_full = self.df_manager.n_selected_entries()
+            self.df_manager.restrict_entry_ranges(self.preview.entry_ranges(self.df_manager))
+            self.preview_entries = (self.df_manager.n_selected_entries(), n_full)
+            logger.info(f"Preview: processing {self.preview_entries[0]} of {n_full} entries")
+            self._warm_up()
+
         histos = self.config.get('hist_params', [])
+        if self.checkpoint:
+            return self._run_checkpointed(histos)
+
+        # Book the cut-flow report, so it is filled in the same event loop as the histograms:
+        self.cut_flow_report = self.df_manager.df.Report()
+
+        # Create histograms and their bootstrap replicas:
+        booked = self._book_histograms(histos)
+        bootstrap_histos = [hist for hist in histos if hist.get('bootstrap')]
+        bootstrap_booked = self._book_bootstrap(bootstrap_histos)
+
+        # Book the log-energy histogram of the spectrum:
+        spectrum_booked = self.spectrum.book(self.df_manager.df) if self.spectrum else None
+
+        # Book the energy-Xmax histogram of the composition fit:
+        composition_booked = self.composition.book(self.df_manager.df) if self.composition else None
+
+        # Book the collection of the event lists:
+        event_lists_booked = [collector.book(self.df_manager.df) for collector in self.event_lists]
+
+        # Book the group_by aggregations:
+        group_bys_booked = [aggregator.book(self.df_manager.df, self.uncut_df) for aggregator in self.group_bys]
+
+        self._watch_memory()
+
+        # Run the event loop explicitly in preview mode, to measure the throughput:
+        if self.preview:
+            loop_start = time.perf_counter()
+            self.timings['setup'] = loop_start - start_time
+            self.cut_flow_report.GetValue()
+            self.timings['event_loop'] = time.perf_counter() - loop_start
+
         if histos:
-            logger.info("Creating histograms...")
-            for hist in histos:
-                histograms.append(self.histogram_manager.create_histogram(hist, self.df_manager.df))
+            histograms = self.histogram_manager.finalize_histograms(histos, booked)
+            histograms.extend(self.histogram_manager.finalize_bootstrap(bootstrap_histos, bootstrap_booked,
+                                                                        histograms))
+
+        # Divide the event counts by the (cached) exposure:
+        if self.spectrum:
+            histograms.extend(self.spectrum.finalize(spectrum_booked))
+
+        # Fit the Xmax templates to each energy bin:
+        if self.composition:
+            histograms.extend(self.composition.finalize(composition_booked))
+
+        # Write the event lists:
+        for collector, booked_rows in zip(self.event_lists, event_lists_booked):
+            if booked_rows is not None:
+                collector.finalize(collector.rows(booked_rows))
+
+        # Write the group_by tables:
+        for aggregator, (selected, passed) in zip(self.group_bys, group_bys_booked):
+            if selected is not None:
+                aggregator.finalize(aggregator.parse(aggregator.flat_result(selected), len(aggregator.values)),
+                                    aggregator.parse(aggregator.flat_result(passed), 0) if passed is not None else None)
 
         return histograms
+
+    def _expression_sources(self, live_columns: Set[str]) -> List[str]:
+        """
+        Collect the expressions and the generated C++ code that the analysis declares to ROOT.
+
+        These are the cuts, the expressions of the live columns and of the joins, the C++ code generated by the
+        library methods of the live user functions and the MC expressions of the spectrum exposure.
+
+        :param live_columns: The defined columns that are needed by the analysis outputs.
+        :return: List of expressions and code.
+        """
+        sources = [str(cut) for cut in self.config.get('cuts') or []]
+        for col in (self.config.get('new_columns') or []) + jagged_feature_columns(self.config):
+            if col['name'] in live_columns:
+                sources.append(col['expression'])
+        for user_function in self.config.get('user_functions') or []:
+            if user_function['new_column'] in live_columns:
+                sources.extend(str(arg['value']) for arg in user_function.get('args') or [])
+                sources.append(self.user_function_handler.library_code(user_function))
+        for join in self.config.get('joins') or []:
+            sources.extend([str(join['primary_time']), str(join['secondary_time'])])
+            sources.extend(str(col['expression']) for col in join.get('columns') or [])
+            sources.extend(str(cut) for cut in join.get('cuts') or [])
+        exposure = (self.config.get('spectrum') or {}).get('exposure') or {}
+        if exposure.get('mc_file'):
+            sources.append(str(exposure.get('mc_energy')))
+            sources.extend(str(cut) for cut in exposure.get('mc_cuts') or [])
+        return sources
+
+    def _watch_memory(self) -> None:
+        """
+        Warn during the next event loop if the memory gets close to the budget. Called just before each event loop,
+        since the watch is consumed by the first event loop that runs after it is booked.
+        """
+        if self.memory.budget:
+            self.memory_watch = self.df_manager.watch_memory(self.memory.warning_bytes)
+
+    def _warm_up(self) -> None:
+        """
+        Run the event loop once on the first entry, so that the JIT compilation of the columns and cuts is not
+        included in the event loop timed in preview mode. Must be called before any result is booked.
+        """
+        entry_ranges = self.df_manager.entry_ranges
+        self.df_manager.set_entry_ranges(PreviewSampler.first_entries(entry_ranges, 1))
+        self.df_manager.df.Count().GetValue()
+        self.df_manager.set_entry_ranges(entry_ranges)
+
+    def _book_histograms(self, histos: List[Dict]) -> List[Any]:
+        """
+        Book the configured histograms on the DataFrame.
+
+        :param histos: The 'hist_params' entries of the configuration.
+        :return: The booked results (None for failed bookings).
+        """
+        if not histos:
+            return []
+        logger.info("Creating histograms...")
+        return [self.histogram_manager.create_histogram(hist, self.df_manager.df) for hist in histos]
+
+    def _book_bootstrap(self, bootstrap_histos: List[Dict]) -> List[Any]:
+        """
+        Book the bootstrap replicas of the histograms with a 'bootstrap' entry, seeded with --seed.
+
+        :param bootstrap_histos: The 'hist_params' entries with a 'bootstrap' entry.
+        :return: The booked replicas (None for failed bookings).
+        """
+        return [self.histogram_manager.create_bootstrap_replicas(hist, self.df_manager.df, self.args.seed)
+                for hist in bootstrap_histos]
+
+    def _run_checkpointed(self, histos: List[Dict]) -> List[Any]:
+        """
+        Run the event loop segment by segment, checkpointing the histograms, cut flow and selected events of each
+        segment. Segments completed by a previous run with the same configuration are not processed again.
+
+        Each segment is one event loop that only reads the entries of the segment (see
+        `DataFrameManager.set_entry_ranges`), and writes its selected events in the same loop.
+
+        :param histos: The 'hist_params' entries of the configuration.
+        :return: The histograms merged over all segments.
+        """
+        base_ranges = self.df_manager.entry_ranges
+        columns, output_format, snapshot_options = self._snapshot_settings()
+        bootstrap_histos = [hist for hist in histos if hist.get('bootstrap')]
+        names = [hist['name'] for hist in histos] + [f"{hist['name']}_replicas" for hist in bootstrap_histos]
+        names += [f"{self.spectrum.name}_counts"] if self.spectrum else []
+        names += [f"{self.composition.name}_data"] if self.composition else []
+
+        for index, segment in self.checkpoint.pending_segments():
+            entry_ranges = self.df_manager.intersect_entry_ranges(base_ranges, [segment])
+            if not entry_ranges:
+                self.checkpoint.save_segment(index, [], [])
+                continue
+            logger.info(f"Processing segment {index + 1} of {len(self.checkpoint.segments)}: entries {segment}")
+            self.df_manager.set_entry_ranges(entry_ranges)
+            report = self.df_manager.df.Report()
+            booked = self._book_histograms(histos) + self._book_bootstrap(bootstrap_histos)
+            if self.spectrum:
+                booked.append(self.spectrum.book(self.df_manager.df))
+            if self.composition:
+                booked.append(self.composition.book(self.df_manager.df))
+            event_lists_booked = [collector.book(self.df_manager.df) for collector in self.event_lists]
+            group_bys_booked = [aggregator.book(self.df_manager.df, self.uncut_df) for aggregator in self.group_bys]
+            snapshot = staging_file = None
+            if output_format == "root":
+                snapshot = self.df_manager.book_snapshot(self.checkpoint.snapshot_file(index), columns,
+                                                         snapshot_options)
+            elif output_format == "parquet":
+                staging_file, snapshot = self.df_manager.book_parquet(self.checkpoint.snapshot_file(index, "parquet"),
+                                                                      columns)
+            self._watch_memory()
+            report.GetValue()
+            if staging_file:
+                self.df_manager.convert_to_parquet(staging_file, self.checkpoint.snapshot_file(index, "parquet"))
+            for collector, booked_rows in zip(self.event_lists, event_lists_booked):
+                if booked_rows is not None:
+                    self.checkpoint.save_rows(index, collector.name, collector.rows(booked_rows))
+            for aggregator, booked_groups in zip(self.group_bys, group_bys_booked):
+                for suffix, result in zip(("selected", "all"), booked_groups):
+                    if result is not None:
+                        self.checkpoint.save_rows(index, f"{aggregator.name}_{suffix}", aggregator.flat_result(result))
+            self.checkpoint.save_segment(index, [result.GetPtr() for result in booked if result is not None],
+                                         report.GetValue())
+        self.df_manager.set_entry_ranges(base_ranges)
+
+        merged = self.checkpoint.merged_histograms(names)
+        histograms = self.histogram_manager.finalize_histograms(histos, merged[:len(histos)]) if histos else []
+        histograms.extend(self.histogram_manager.finalize_bootstrap(
+            bootstrap_histos, merged[len(histos):len(histos) + len(bootstrap_histos)], histograms))
+        n_booked = len(histos) + len(bootstrap_histos)
+        if self.spectrum and merged[n_booked] is not None:
+            histograms.extend(self.spectrum.finalize(merged[n_booked]))
+        if self.composition and merged[-1] is not None:
+            histograms.extend(self.composition.finalize(merged[-1]))
+        for collector in self.event_lists:
+            collector.finalize(self.checkpoint.merged_rows(collector.name, collector.width))
+        for aggregator in self.group_bys:
+            aggregator.finalize(aggregator.parse(self.checkpoint.merged_rows(f"{aggregator.name}_selected", 1),
+                                                 len(aggregator.values)),
+                                aggregator.parse(self.checkpoint.merged_rows(f"{aggregator.name}_all", 1), 0)
+                                if aggregator.pass_rate else None)
+        return histograms
+
+    def _restrict_to_zone_map(self, zone_map_file: str, cuts: List[str]) -> None:
+        """
+        Restrict the event loop to the entry ranges that the zone map allows for the cuts. Not done when a group_by
+        aggregation has pass rates, whose counts before the cuts would otherwise miss the skipped entries.
+
+        Defined columns that are plain copies of a branch (e.g. `DATE: "rusdraw.yymmdd"`) are matched to the branch.
+
+        :param zone_map_file: Path to the zone map sidecar file.
+        :param cuts: The cuts of the analysis.
+        """
+        pass_rates = [aggregator.name for aggregator in self.group_bys if aggregator.pass_rate]
+        if pass_rates:
+            logger.warning(f"Zone map {zone_map_file} not used: the pass rates of the group_by aggregations "
+                           f"{', '.join(pass_rates)} count all input entries. Reading all entries.")
+            return
+        zone_map = ZoneMap.load(zone_map_file)
+        if not zone_map.is_current(self.config['input_file'], self.config['tree_name']):
+            logger.warning(f"Zone map {zone_map_file} does not match the input file. Reading all entries.")
+            return
+
+        aliases = {col['name']: col['expression'].strip() for col in self.config.get('new_columns') or []
+                   if isinstance(col['expression'], str) and COLUMN_PATTERN.match(col['expression'].strip())}
+        entry_ranges = zone_map.entry_ranges(cuts, aliases)
+        n_selected = sum(stop - start for start, stop in entry_ranges)
+        n_total = sum(stop - start for start, stop in zone_map.clusters)
+        logger.info(f"Zone map: reading {n_selected} of {n_total} entries in {len(entry_ranges)} entry ranges")
+        if n_selected < n_total:
+            logger.info(f"Zone map: the {n_total - n_selected} skipped entries are not counted in the cut flow, "
+                        f"they are reported as the 'zone map' line")
+            self.df_manager.restrict_entry_ranges(entry_ranges)
+            self.zone_map_entries = (n_selected, n_total)
+
+    def save_events(self) -> None:
+        """
+        Save the selected events, as configured by 'snapshot_columns' and 'snapshot_format'.
+
+        With a memory budget, the flush and basket sizes of the ROOT snapshot are chosen to fit in it. With
+        checkpointing, the snapshots of the segments are merged and the checkpoint is removed.
+
+        The 'friend' format writes the derived columns and a 'passed' flag of every input entry, rather than the
+        selected events, to 'friend_tree.root', to be attached by later runs with the 'friends' configuration.
+        """
+        columns, output_format, snapshot_options = self._snapshot_settings()
+        if output_format == "friend":
+            self.df_manager.save_friend(os.path.join(self.df_manager.output_dir, "friend_tree.root"),
+                                        self._friend_df(), columns if "passed" in columns else columns + ["passed"])
+            if self.checkpoint:
+                self.checkpoint.clear()
+            return
+        if self.checkpoint:
+            self.checkpoint.merge_snapshots(os.path.join(self.df_manager.output_dir, f"processed_tree.{output_format}"),
+                                            output_format)
+            self.checkpoint.clear()
+            return
+        self.df_manager.save_df(self.df_manager.output_dir,
+                                columns,
+                                output_format,
+                                snapshot_options=snapshot_options)
+
+    def _friend_df(self) -> dst.ROOT.RDataFrame:
+        """
+        Get the DataFrame of the friend tree: every input entry, with the 'passed' flag of the cuts.
+
+        If the input already has a 'passed' column (e.g. from an attached friend tree), it is redefined with the
+        cuts of this run.
+
+        :return: The DataFrame before the cuts, with the 'passed' column.
+        """
+        cuts = self.config.get('cuts') or []
+        passed = " && ".join(f"({cut})" for cut in cuts) if cuts else "true"
+        if "passed" in {str(column) for column in self.uncut_df.GetColumnNames()}:
+            logger.info("Redefining the 'passed' column of the input with the cuts of this run")
+            return self.uncut_df.Redefine("passed", passed)
+        return self.uncut_df.Define("passed", passed)
+
+    def _snapshot_settings(self) -> Tuple[Union[List[str], str, None], str, Dict[str, int]]:
+        """
+        Get the columns, format and buffer sizes of the saved events.
+
+        :return: The 'snapshot_columns' (None for all columns; when jagged features are defined, a regular
+            expression matching all columns but the internal feature summaries, so that ROOT selects the top-level
+            branches as for all columns; the columns defined by this run for the friend format; for the Parquet
+            format, the columns of fundamental types, see `DataFrameManager.parquet_columns`), the
+            'snapshot_format' and the snapshot options sized to the memory budget.
+        :raises ValueError: If a 'snapshot_columns' entry cannot be written to Parquet.
+        """
+        columns = self.config.get('snapshot_columns')
+        output_format = self.config.get('snapshot_format', 'root')
+        internal = {col['name'] for col in jagged_feature_columns(self.config) if col.get('internal')}
+        if output_format == "parquet":
+            columns = self.df_manager.parquet_columns(columns, internal)
+        elif columns is None and output_format == "friend":
+            defined = {str(column) for column in self.df_manager.df.GetDefinedColumnNames()}
+            columns = [name for name in self.dependency_graph.definitions if name in defined and name not in internal]
+        elif columns is None and internal:
+            columns = f"^(?!({'|'.join(sorted(internal))})$).*$"
+        n_columns = len(columns) if isinstance(columns, list) else len(self.df_manager.df.GetColumnNames())
+        return columns, output_format, self.memory.snapshot_options(n_columns, self.n_threads)
+
+    def memory_sizes(self, histograms: List[Any]) -> Dict[str, int]:
+        """
+        Estimate the memory held by each histogram.
+
+        :param histograms: The histograms returned by `run_analysis`.
+        :return: Dictionary of histogram names to sizes in bytes.
+        """
+        sizes = {}
+        for hist in histograms:
+            if not hist:
+                continue
+            if hist.InheritsFrom("THnSparse"):
+                sizes[hist.GetName()] = int(hist.GetNbins() * 8 * (hist.GetNdimensions() + 2))
+            else:
+                sizes[hist.GetName()] = int(hist.GetNcells() * 8 * (2 if hist.GetSumw2N() else 1))
+        return sizes
+
+    def print_report(self) -> None:
+        """
+        Print the efficiency report of the applied cuts.
+
+        If the cuts were reordered by the cut optimizer, they are still reported in their configured order.
+        In preview mode, the pass counts extrapolated to the full dataset are shown as well. The entries skipped by
+        the zone map are never read, so they are reported as a first 'zone map' pseudo-cut.
+        """
+        cuts = self.config.get('cuts', [])
+        if self.zone_map_entries:
+            n_read, n_total = self.zone_map_entries
+            print(f"{'zone map (not read)'.ljust(30)}: pass={n_read:<10} all={n_total:<10} "
+                  f"-- eff={100. * n_read / n_total:.2f} %")
+        if self.checkpoint:
+            logger.info("Cut-flow report (merged over checkpoint segments):")
+            self.df_manager.print_cut_flow(cuts, self.checkpoint.merged_cut_flow())
+        elif (self.args.optimize_cuts or self.preview) and cuts:
+            logger.info("Cut-flow report (configured order):")
+            self.df_manager.print_cut_flow(cuts, self.cut_flow_report.GetValue(), self._extrapolation_factor())
+        else:
+            self.cut_flow_report.Print()
+
+    def _extrapolation_factor(self) -> Any:
+        """
+        Get the ratio of the number of entries in the full dataset to the number of entries processed in preview mode.
+
+        :return: The extrapolation factor, or None outside of preview mode.
+        """
+        if not self.preview_entries or not self.preview_entries[0]:
+            return None
+        n_processed, n_full = self.preview_entries
+        return n_full / n_processed
+
+    def print_preview_summary(self) -> None:
+        """
+        Print the preview summary: processed fraction, measured throughput, estimated wall time of the full run,
+        and the cut flow extrapolated to the full dataset.
+
+        The throughput is measured on the event loop that follows the warm-up (see `_warm_up`), so the one-off JIT
+        compilation is counted in the setup time only once, and not scaled to the full dataset.
+        """
+        n_processed, n_full = self.preview_entries
+        event_loop_time = self.timings['event_loop']
+        throughput = n_processed / event_loop_time if event_loop_time > 0 else float('inf')
+        logger.info(f"Preview: processed {n_processed} of {n_full} entries "
+                    f"(extrapolation factor {self._extrapolation_factor() or 0:.1f})")
+        logger.info(f"Preview: setup {self.timings['setup']:.1f} s (including the JIT warm-up), "
+                    f"event loop {event_loop_time:.1f} s ({throughput:.0f} entries/s)")
+        logger.info(f"Preview: estimated wall time of the full analysis pass: "
+                    f"{self.timings['setup'] + n_full / throughput:.0f} s (not including saving the events)")
+        self.print_report()
@@ -1,13 +1,39 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple, Union
+import re
+import os
 
 import dstpy as dst
 import numpy as np
 
+from src.rdf_analyzer.memory import MEMORY_WATCH_HELPER
+from src.rdf_analyzer.tree_join import JoinIndex, join_columns
 from src.rdf_analyzer.utils import logger
 
+# Column types that can be written to Parquet: fundamental types, and RVecs or vectors thereof.
+FUNDAMENTAL_TYPES = {"bool", "char", "signed char", "unsigned char", "short", "unsigned short", "int", "unsigned int",
+                     "unsigned", "long", "unsigned long", "long long", "unsigned long long", "float", "double",
+                     "Bool_t", "Char_t", "UChar_t", "Short_t", "UShort_t", "Int_t", "UInt_t", "Long_t", "ULong_t",
+                     "Long64_t", "ULong64_t", "Float_t", "Double_t", "Float16_t", "Double32_t"}
+CONTAINER_PATTERN = re.compile(r"^(?:ROOT::VecOps::RVec|ROOT::RVec|std::vector|vector)<\s*(.+?)\s*>$")
+
+
+def is_columnar_type(type_name: str) -> bool:
+    """
+    Check whether a column type can be written to Parquet.
+
+    :param type_name: The type of the column, as returned by `GetColumnType`.
+    :return: True for fundamental types and (nested) RVecs or vectors of fundamental types.
+    """
+    type_name = type_name.strip()
+    match = CONTAINER_PATTERN.match(type_name)
+    if match:
+        return is_columnar_type(match.group(1))
+    return type_name in FUNDAMENTAL_TYPES
+
 
 class DataFrameManager:
-    def __init__(self, tree_name: str, input_file: str, output_dir: str, client: Any = None, parallel: bool = False):
+    def __init__(self, tree_name: str, input_file: str, output_dir: str, client: Any = None, parallel: bool = False,
+                 n_threads: int = 0, friends: Optional[List[Dict[str, str]]] = None):
         """
         Initializes the DataFrameHandler with the given ROOT TTree and input file.
 
@@ -16,39 +42,253 @@ class DataFrameManager:
         :param output_dir: Path to the directory where output files will be saved.
         :param client: Dask client for parallel processing (optional).
         :param parallel: Whether to enable parallel processing (default is False).
+        :param n_threads: Number of event-loop threads with parallel processing (default: 0, all cores).
+        :param friends: Friend trees aligned entry by entry with the input (e.g. written with the 'friend' snapshot
+            format), as dictionaries with 'input_file' and 'tree_name'. Their columns are read instead of being
+            defined again.
         """
         self.tree_name = tree_name
         self.input_file = input_file
         self.output_dir = output_dir
         self.client = client
         self.parallel = parallel
+        self.n_threads = n_threads
+        self.friends = friends or []
+        self.friend_columns = set()
+        self.chains = []
+        self.input_files = None
+        self.entry_ranges = None
+        self.entry_list = None
         self.df = self._load_dataframe()
+        # The DataFrame before any column definition or cut:
+        self.input_df = self.df
 
     def _load_dataframe(self) -> dst.ROOT.RDataFrame:
         """
         Loads the ROOT TTree into a RDataFrame.
 
-        If parallel processing is enabled, the DataFrame will be loaded with Dask support; otherwise,
-        it will be loaded in a single-threaded mode.
+        If parallel processing is enabled, the event loop runs on `n_threads` threads with ROOT's implicit
+        multithreading; otherwise, it will be loaded in a single-threaded mode.
+
+        The DataFrame reads the input chain, so that the entry ranges set with `set_entry_ranges` restrict the
+        entries read by the event loop (all entries by default).
 
         :return: The RDataFrame loaded from the specified TTree and input file.
         """
         if self.parallel:
-            return dst.ROOT.RDataFrame(self.tree_name, self.input_file)
-        return dst.ROOT.RDataFrame(self.tree_name, self.input_file)
+            dst.ROOT.EnableImplicitMT(self.n_threads)
+        return dst.ROOT.RDataFrame(self._chain_with_friends())
+
+    def _chain_with_friends(self) -> dst.ROOT.TChain:
+        """
+        Chains the input files and attaches the friend trees (if any), entry by entry.
+
+        :return: The input chain with its friends. The chains are kept alive with the manager.
+        """
+        chain = dst.ROOT.TChain(self.tree_name)
+        chain.Add(self.input_file)
+        self.chains.append(chain)
+        for friend in self.friends:
+            friend_chain = dst.ROOT.TChain(friend.get('tree_name', 'friend'))
+            friend_chain.Add(friend['input_file'])
+            if friend_chain.GetEntries() != chain.GetEntries():
+                logger.warning(f"Friend tree {friend['input_file']} has {friend_chain.GetEntries()} entries, "
+                               f"the input has {chain.GetEntries()}. The entries may not be aligned.")
+            chain.AddFriend(friend_chain)
+            self.chains.append(friend_chain)
+            self.friend_columns |= {str(branch.GetName()) for branch in friend_chain.GetListOfBranches()}
+            logger.info(f"Attached friend tree {friend['input_file']}")
+        return chain
+
+    def set_entry_ranges(self, entry_ranges: Optional[List[Tuple[int, int]]]) -> None:
+        """
+        Restricts the following event loops to the given input entry ranges.
+
+        The ranges are attached to the input chain of this manager as a TEntryList, so the event loop only reads
+        the entries inside them, and they apply to every node of its DataFrame.
+
+        :param entry_ranges: List of [start, stop) input entry ranges, or None to process all entries.
+        """
+        self.entry_ranges = entry_ranges
+        self._apply_entry_ranges(entry_ranges)
+
+    def _apply_entry_ranges(self, entry_ranges: Optional[List[Tuple[int, int]]]) -> None:
+        """
+        Attaches the entry ranges to the input chain, as a TEntryList with one sub-list per input file.
+
+        :param entry_ranges: List of [start, stop) input entry ranges, or None to process all entries.
+        """
+        chain = self.chains[0]
+        if entry_ranges is None:
+            chain.SetEntryList(dst.ROOT.nullptr)
+            self.entry_list = None
+            return
+        entry_list = dst.ROOT.TEntryList("entry_ranges", "entry_ranges")
+        for file_name, file_start, file_stop in self._input_files():
+            sub_list = dst.ROOT.TEntryList("", "", self.tree_name, file_name)
+            for start, stop in entry_ranges:
+                start, stop = max(start, file_start), min(stop, file_stop)
+                if start < stop:
+                    sub_list.EnterRange(start - file_start, stop - file_start)
+            entry_list.Add(sub_list)
+        chain.SetEntryList(entry_list)
+        self.entry_list = entry_list
+
+    def restrict_entry_ranges(self, entry_ranges: List[Tuple[int, int]]) -> None:
+        """
+        Further restricts the following event loops to the given input entry ranges.
+
+        :param entry_ranges: List of [start, stop) input entry ranges, intersected with the current ones.
+        """
+        self.set_entry_ranges(self.intersect_entry_ranges(self.entry_ranges, entry_ranges))
+
+    @staticmethod
+    def intersect_entry_ranges(first: Optional[List[Tuple[int, int]]],
+                               second: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """
+        Intersects two lists of entry ranges.
+
+        :param first: List of [start, stop) entry ranges, or None for all entries.
+        :param second: List of [start, stop) entry ranges.
+        :return: Sorted list of the [start, stop) entry ranges contained in both.
+        """
+        if first is None:
+            return sorted(second)
+        return sorted((max(start, other_start), min(stop, other_stop))
+                      for start, stop in first for other_start, other_stop in second
+                      if other_start < stop and other_stop > start)
+
+    def n_selected_entries(self) -> int:
+        """
+        Get the number of input entries inside the current entry ranges.
+
+        :return: The number of input entries the event loop will process.
+        """
+        if self.entry_ranges is None:
+            return self.n_input_entries()
+        return sum(stop - start for start, stop in self.entry_ranges)
+
+    def cluster_ranges(self) -> List[Tuple[int, int]]:
+        """
+        Get the entry ranges of the clusters of the input tree(s), as global entry numbers of the chain.
+
+        :return: List of [start, stop) entry ranges, one per cluster.
+        """
+        chain = dst.ROOT.TChain(self.tree_name)
+        chain.Add(self.input_file)
+        clusters = []
+        offset = 0
+        for element in chain.GetListOfFiles():
+            file = dst.ROOT.TFile.Open(element.GetTitle())
+            tree = file.Get(self.tree_name)
+            n_entries = tree.GetEntries()
+            cluster_iterator = tree.GetClusterIterator(0)
+            start = cluster_iterator()
+            while start < n_entries:
+                stop = cluster_iterator.GetNextEntry()
+                clusters.append((offset + start, offset + stop))
+                start = cluster_iterator()
+            offset += n_entries
+            file.Close()
+        return clusters
+
+    def file_ranges(self) -> List[Tuple[int, int]]:
+        """
+        Get the entry ranges of the input files, as global entry numbers of the chain.
+
+        :return: List of [start, stop) entry ranges, one per file.
+        """
+        return [(start, stop) for _, start, stop in self._input_files()]
+
+    def _input_files(self) -> List[Tuple[str, int, int]]:
+        """
+        Get the input files of the chain with their entry ranges, read once per manager.
+
+        :return: List of (file name, start, stop) tuples, with [start, stop) as global entry numbers of the chain.
+        """
+        if self.input_files is None:
+            self.input_files = []
+            offset = 0
+            for element in self.chains[0].GetListOfFiles():
+                file = dst.ROOT.TFile.Open(element.GetTitle())
+                n_entries = file.Get(self.tree_name).GetEntries()
+                self.input_files.append((str(element.GetTitle()), offset, offset + n_entries))
+                offset += n_entries
+                file.Close()
+        return self.input_files
+
+    def n_input_entries(self) -> int:
+        """
+        Get the number of entries in the input tree(s), before any selection.
+
+        :return: The number of input entries.
+        """
+        return sum(stop - start for _, start, stop in self._input_files())
 
     def column_to_numpy(self, columns: List[str]) -> Dict[str, np.ndarray]:
         """
         Prepares the data (columns) from the DataFrame as NumPy arrays.
 
-        This method extracts the specified columns from the DataFrame and returns them as a dictionary
-        with column names as keys and their respective data as NumPy arrays.
+        This method extracts the specified columns from the DataFrame in a single event loop and returns them as
+        a dictionary with column names as keys and their respective data as NumPy arrays. If the combined
+        extraction fails, the columns are extracted one by one so that a single bad column does not lose the rest.
+
+        Jagged columns are returned as object arrays of RVecs; use `columns_to_awkward` for those.
 
         :param columns: List of column names to extract from the DataFrame.
         :return: A dictionary where keys are column names and values are the corresponding NumPy arrays.
         """
+        try:
+            return dict(self.df.AsNumpy(list(columns)))
+        except Exception as e:
+            logger.error(f"Error while extracting columns {columns}: {str(e)}. Extracting them one by one.")
         return {column: self._extract_column(column) for column in columns}
 
+    def columns_to_awkward(self, columns: List[str]) -> Any:
+        """
+        Extracts columns from the DataFrame as an awkward array of records, in a single event loop.
+
+        Jagged (RVec) columns are converted directly into awkward list arrays, without going through NumPy
+        object arrays.
+
+        :param columns: List of column names to extract from the DataFrame.
+        :return: An awkward array with one field per column.
+        """
+        import awkward as ak
+
+        return ak.from_rdataframe(self.df, columns=tuple(columns))
+
+    def iterate_chunks(self, columns: List[str], chunk_size: int = 100000,
+                       library: str = "numpy") -> Iterator[Any]:
+        """
+        Iterates over the selected events in batches of bounded size.
+
+        The input is processed in ranges of `chunk_size` entries. Each batch is extracted by an event loop
+        restricted to its range with the entry list of the input chain, so the whole iteration reads every input
+        entry once, and each batch holds at most `chunk_size` selected events and never the whole selection.
+
+        :param columns: List of column names to extract.
+        :param chunk_size: Number of input entries processed per batch.
+        :param library: 'numpy' to yield dictionaries of NumPy arrays (as `column_to_numpy`), or 'awkward' to yield
+            awkward arrays (as `columns_to_awkward`).
+        :return: Iterator over the batches.
+        """
+        n_entries = self.n_input_entries()
+        try:
+            for start in range(0, n_entries, chunk_size):
+                chunk_ranges = self.intersect_entry_ranges(self.entry_ranges,
+                                                           [(start, min(start + chunk_size, n_entries))])
+                if not chunk_ranges:
+                    continue
+                self._apply_entry_ranges(chunk_ranges)
+                logger.debug(f"Extracting entries {start} to {min(start + chunk_size, n_entries)}")
+                if library == "awkward":
+                    yield self.columns_to_awkward(columns)
+                else:
+                    yield self.column_to_numpy(columns)
+        finally:
+            self._apply_entry_ranges(self.entry_ranges)
+
     def _extract_column(self, column: str) -> np.ndarray:
         """
         Extracts column data from the DataFrame and handles any errors during extraction.
@@ -68,9 +308,14 @@ class DataFrameManager:
         """
         Define a new column in the RDataFrame.
 
+        If the column is read from a friend tree, it is not defined again.
+
         :param column_info: Dictionary containing column name and expression.
         :return: Self for chaining.
         """
+        if column_info['name'] in self.friend_columns:
+            logger.info(f"Column {column_info['name']} is read from a friend tree")
+            return self
         expression = column_info['expression'] \
             if isinstance(column_info['expression'], str) \
             else column_info['expression']
@@ -79,6 +324,35 @@ class DataFrameManager:
         # self.df.Display([f"{column_info['name']}"]).Print()
         return self
 
+    def join_tree(self, join: Dict[str, Any], join_id: int, cache_dir: str,
+                  live_columns: Optional[set] = None) -> 'DataFrameManager':
+        """
+        Join a secondary tree (e.g. FD reconstructions to SD events) by event time, within a tolerance.
+
+        The secondary event times and joined column values are sorted into an index, built once and cached on
+        disk, and each primary event is matched to the nearest secondary event by binary search. The joined
+        columns are defined as ordinary columns (NaN where no event matched), together with '<name>_index',
+        '<name>_matched' and '<name>_dt'.
+
+        :param join: A 'joins' entry of the configuration, with 'name', 'input_file', 'tree_name', 'primary_time',
+            'secondary_time', 'tolerance', 'columns' and optionally 'cuts' on the secondary tree.
+        :param join_id: The position of the join in the configuration.
+        :param cache_dir: Directory of the cached indices.
+        :param live_columns: Only define these columns (default: all join columns). Columns read from a friend
+            tree are not defined.
+        :return: Self for chaining.
+        """
+        columns = [column for column in join_columns(join, join_id)
+                   if (live_columns is None or column['name'] in live_columns)
+                   and column['name'] not in self.friend_columns]
+        if not columns:
+            logger.info(f"Skipping unused join {join['name']}")
+            return self
+        JoinIndex.load_or_build(join, cache_dir).declare(join, join_id)
+        for column in columns:
+            self.define_new_column(column)
+        return self
+
     def apply_selection(self, selection: str) -> 'DataFrameManager':
         """
         Applies event selection to the RDataFrame using ROOT's filter.
@@ -90,17 +364,270 @@ class DataFrameManager:
         :return: The DataFrameHandler instance, enabling method chaining.
         """
         logger.info(f"Applying selection: {selection}")
-        self.df = self.df.Filter(selection, f"{selection}".ljust(30))
+        self.df = self.df.Filter(selection, self._selection_name(selection))
         return self
 
-    def save_df(self, output_dir: str) -> None:
+    @staticmethod
+    def _selection_name(selection: str) -> str:
+        """
+        Get the name under which a selection is registered in the cut-flow report.
+
+        :param selection: The filtering condition as a string expression.
+        :return: The padded filter name.
+        """
+        return f"{selection}".ljust(30)
+
+    def print_cut_flow(self, selections: List[str], report: Any = None, scale: Optional[float] = None) -> None:
+        """
+        Prints the cut-flow report with the selections listed in the given order.
+
+        The pass and total counts of each selection are those measured in the event loop, i.e. relative to the
+        selections that were applied before it. The cumulative efficiency is relative to the number of entries
+        entering the first applied selection.
+
+        :param selections: The selections in the order in which they should be reported.
+        :param report: A booked cut-flow report (default: a new report of the DataFrame).
+        :param scale: If given, the pass counts are also shown multiplied by this factor, e.g. to extrapolate the
+            counts of a sampled run to the full dataset.
+        """
+        cut_info = {info.GetName(): info for info in (report if report is not None else self.df.Report().GetValue())}
+        if not cut_info:
+            return
+        n_total = max(info.GetAll() for info in cut_info.values())
+        for selection in selections:
+            info = cut_info.get(self._selection_name(selection))
+            if info is None:
+                continue
+            cumulative = 100. * info.GetPass() / n_total if n_total else 0.
+            extrapolated = f" (full dataset: ~{info.GetPass() * scale:.0f})" if scale is not None else ""
+            print(f"{info.GetName()}: pass={info.GetPass():<10} all={info.GetAll():<10} "
+                  f"-- eff={info.GetEff():.2f} % cumulative eff={cumulative:.2f} %{extrapolated}")
+
+    def save_df(self, output_dir: str, columns: Union[List[str], str, None] = None, output_format: str = "root",
+                chunk_size: int = 100000, snapshot_options: Optional[Dict[str, int]] = None) -> None:
         """
-        Saves the DataFrame to a ROOT file in the specified output directory.
+        Saves the DataFrame to a ROOT or Parquet file in the specified output directory.
 
-        The DataFrame is saved as a TTree in a ROOT file with the name 'processed_tree.root'.
+        With the 'root' format, the DataFrame is saved as a TTree in a ROOT file with the name
+        'processed_tree.root'. With the 'parquet' format, it is saved as 'processed_tree.parquet'
+        (see `save_parquet`).
 
-        :param output_dir: The directory where the ROOT file will be saved.
+        :param output_dir: The directory where the file will be saved.
+        :param columns: Names of the columns to save (default: all columns), or for the 'root' format a regular
+            expression matching them.
+        :param output_format: 'root' (default) or 'parquet'.
+        :param chunk_size: Number of events per Parquet row group.
+        :param snapshot_options: Optional 'auto_flush' and 'basket_size' of the ROOT snapshot, in bytes.
         """
+        if output_format == "parquet":
+            self.save_parquet(f"{output_dir}/processed_tree.parquet", self.parquet_columns(columns), chunk_size)
+            return
+
         output_file = f"{output_dir}/processed_tree.root"
         logger.info(f"Saving DataFrame to {output_file}")
-        self.df.Snapshot(self.tree_name, output_file)
+        self.book_snapshot(output_file, columns, snapshot_options, lazy=False)
+
+    def save_friend(self, output_file: str, df: dst.ROOT.RDataFrame, columns: List[str],
+                    chunk_size: int = 100000) -> None:
+        """
+        Saves columns of every input entry as a friend tree, aligned entry by entry with the input.
+
+        All input entries are written, whatever the cuts and entry ranges, so later runs can attach the file with
+        the 'friends' configuration. The columns are written in a single event loop: a single-threaded snapshot
+        keeps the input order; with implicit multithreading, the entries are snapshot with their entry number to a
+        staging file, which is then copied in input order (see `_copy_in_entry_order`).
+
+        :param output_file: Path to the ROOT file. The tree is named 'friend'.
+        :param df: The DataFrame to save, before any cut.
+        :param columns: Names of the columns to save. They must be fundamental types or RVecs thereof.
+        :param chunk_size: Number of entries per batch of the ordered copy.
+        """
+        logger.info(f"Saving friend tree to {output_file}")
+        column_names = dst.ROOT.std.vector('string')()
+        for column in columns:
+            column_names.push_back(column)
+        self._apply_entry_ranges(None)
+        try:
+            if not dst.ROOT.IsImplicitMTEnabled():
+                df.Snapshot("friend", output_file, column_names)
+            else:
+                staging_file = f"{output_file}.staging.root"
+                column_names.push_back("friend_entry_")
+                df.Define("friend_entry_", "rdfentry_").Snapshot("friend", staging_file, column_names)
+                self._copy_in_entry_order(staging_file, output_file, columns, chunk_size)
+        finally:
+            self._apply_entry_ranges(self.entry_ranges)
+        logger.info(f"Saved {len(columns)} columns of {self.n_input_entries()} entries to {output_file}")
+
+    @staticmethod
+    def _copy_in_entry_order(staging_file: str, output_file: str, columns: List[str], chunk_size: int) -> None:
+        """
+        Copies the 'friend' tree of a multithreaded snapshot in the order of its 'friend_entry_' column, and removes
+        the staging file. Each thread writes runs of consecutive entries, so each output batch is read as a few
+        contiguous entry ranges of the staging file.
+
+        :param staging_file: Path to the staging ROOT file.
+        :param output_file: Path to the ROOT file. The tree is named 'friend'.
+        :param columns: Names of the columns to copy.
+        :param chunk_size: Number of entries per batch.
+        """
+        import awkward as ak
+        import uproot
+
+        try:
+            with uproot.open(staging_file) as staging, uproot.recreate(output_file) as file:
+                source = staging["friend"]
+                order = np.argsort(source["friend_entry_"].array(library="np"), kind="stable")
+                tree = None
+                for start in range(0, len(order), chunk_size):
+                    indices = order[start:start + chunk_size]
+                    breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+                    runs = [source.arrays(columns, entry_start=int(run[0]), entry_stop=int(run[-1]) + 1, library="ak")
+                            for run in np.split(indices, breaks)]
+                    chunk = ak.concatenate(runs)
+                    arrays = {column: chunk[column] for column in columns}
+                    if tree is None:
+                        file["friend"] = arrays
+                        tree = file["friend"]
+                    else:
+                        tree.extend(arrays)
+        finally:
+            os.remove(staging_file)
+
+    def book_snapshot(self, output_file: str, columns: Union[List[str], str, None] = None,
+                      snapshot_options: Optional[Dict[str, int]] = None, lazy: bool = True) -> Any:
+        """
+        Books a ROOT snapshot of the DataFrame, written during the next event loop (or immediately if not lazy).
+
+        :param output_file: Path to the ROOT file.
+        :param columns: Names of the columns to save, or a regular expression matching them (default: all
+            columns).
+        :param snapshot_options: Optional 'auto_flush' and 'basket_size' of the snapshot, in bytes.
+        :param lazy: Whether to write the snapshot in the next event loop instead of immediately.
+        :return: The booked snapshot, which must be kept alive until the event loop has run.
+        """
+        options = self._snapshot_options(snapshot_options or {})
+        options.fLazy = lazy
+        if columns is None or isinstance(columns, str):
+            return self.df.Snapshot(self.tree_name, output_file, columns or "", options)
+        column_names = dst.ROOT.std.vector('string')()
+        for column in columns:
+            column_names.push_back(column)
+        return self.df.Snapshot(self.tree_name, output_file, column_names, options)
+
+    @staticmethod
+    def _snapshot_options(snapshot_options: Dict[str, int]) -> dst.ROOT.RDF.RSnapshotOptions:
+        """
+        Creates the RSnapshotOptions of a snapshot.
+
+        :param snapshot_options: Optional 'auto_flush' (flush the baskets every N bytes) and 'basket_size', in bytes.
+        :return: The snapshot options.
+        """
+        options = dst.ROOT.RDF.RSnapshotOptions()
+        if snapshot_options.get('auto_flush'):
+            options.fAutoFlush = -snapshot_options['auto_flush']
+        if snapshot_options.get('basket_size') and hasattr(options, 'fBasketSize'):
+            options.fBasketSize = snapshot_options['basket_size']
+        return options
+
+    def watch_memory(self, warning_bytes: int, every_n_entries: int = 100000) -> Any:
+        """
+        Books a check of the resident memory every N input entries of the next event loop, which warns once when
+        the memory exceeds the given threshold. Book it just before the event loop to watch: any event loop consumes
+        it.
+
+        :param warning_bytes: The resident memory above which a warning is printed.
+        :param every_n_entries: Number of entries between checks.
+        :return: The booked result, which must be kept alive until the event loop has run.
+        """
+        dst.ROOT.gInterpreter.Declare(MEMORY_WATCH_HELPER)
+        dst.ROOT.taAnalysis.gMemoryWarningBytes = warning_bytes
+        return dst.ROOT.taAnalysis.WatchMemory(dst.ROOT.RDF.AsRNode(self.input_df), every_n_entries)
+
+    def parquet_columns(self, columns: Optional[List[str]] = None, exclude: Iterable[str] = ()) -> List[str]:
+        """
+        Get the columns to write to Parquet, which must be fundamental types or RVecs thereof.
+
+        :param columns: Names of the columns to save (default: all columns of such types; columns of other types,
+            e.g. the DST objects, are skipped, and so are the sub-branches of a column that is written whole).
+        :param exclude: Names of columns not to save, e.g. internal columns.
+        :return: The column names.
+        :raises ValueError: If one of the given columns has another type.
+        """
+        names = [str(column) for column in (columns if columns is not None else self.df.GetColumnNames())]
+        unsupported = [name for name in names if not is_columnar_type(str(self.df.GetColumnType(name)))]
+        if columns is not None and unsupported:
+            raise ValueError(f"Columns {unsupported} cannot be written to Parquet: only fundamental types and RVecs "
+                             f"or vectors thereof are supported. Select their members in 'snapshot_columns' instead.")
+        if unsupported:
+            logger.info(f"Not writing {len(unsupported)} columns of non-fundamental types to Parquet, "
+                        f"e.g. {unsupported[0]}")
+        exclude = set(exclude) | set(unsupported)
+        kept = [name for name in names if name not in exclude]
+        return [name for name in kept if "." not in name or name.split(".")[0] not in kept]
+
+    def save_parquet(self, output_file: str, columns: List[str], chunk_size: int = 100000) -> None:
+        """
+        Saves the selected events to a Parquet file, in a single event loop.
+
+        The event loop writes the columns to a staging ROOT file next to the output (see `book_parquet`), which is
+        then converted to Parquet row groups of `chunk_size` events, so only one row group is held in memory.
+
+        :param output_file: Path to the Parquet file.
+        :param columns: Names of the columns to save (see `parquet_columns`).
+        :param chunk_size: Number of events per row group.
+        """
+        logger.info(f"Saving DataFrame to {output_file}")
+        staging_file = self.book_parquet(output_file, columns, lazy=False)[0]
+        self.convert_to_parquet(staging_file, output_file, chunk_size)
+
+    def book_parquet(self, output_file: str, columns: List[str], lazy: bool = True) -> Tuple[str, Any]:
+        """
+        Books the snapshot of the columns to the staging ROOT file of a Parquet file, written during the next
+        event loop (or immediately if not lazy). Convert it with `convert_to_parquet` after the event loop.
+
+        :param output_file: Path to the Parquet file.
+        :param columns: Names of the columns to save (see `parquet_columns`).
+        :param lazy: Whether to write the staging file in the next event loop instead of immediately.
+        :return: The path to the staging file, and the booked snapshot, which must be kept alive until the event
+            loop has run.
+        """
+        staging_file = f"{output_file}.staging.root"
+        return staging_file, self.book_snapshot(staging_file, columns, lazy=lazy)
+
+    def convert_to_parquet(self, staging_file: str, output_file: str, chunk_size: int = 100000) -> None:
+        """
+        Converts a staging ROOT file (see `book_parquet`) to a Parquet file, one row group per batch of events, and
+        removes it. Jagged columns are written as Arrow list types, and the file can be read directly by `prqt2ml`.
+
+        :param staging_file: Path to the staging ROOT file.
+        :param output_file: Path to the Parquet file.
+        :param chunk_size: Number of events per row group.
+        """
+        import awkward as ak
+        import pyarrow.parquet as pq
+        import uproot
+
+        writer = None
+        n_events = 0
+        try:
+            with uproot.open(staging_file) as file:
+                tree = file[self.tree_name]
+                for chunk in tree.iterate(filter_name=lambda name: not name.startswith("R_rdf_"),
+                                          step_size=chunk_size, library="ak"):
+                    if len(chunk) == 0:
+                        continue
+                    table = ak.to_arrow_table(chunk, extensionarray=False, list_to32=True)
+                    if writer is None:
+                        writer = pq.ParquetWriter(output_file, table.schema)
+                    writer.write_table(table)
+                    n_events += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+            os.remove(staging_file)
+
+        if writer is None:
+            logger.warning(f"No events passed the selection. {output_file} was not written.")
+        else:
+            logger.info(f"Saved {n_events} events to {output_file}")
@@ -0,0 +1,161 @@
+import re
+from typing import Dict, Any, Iterable, List, Set
+
+from src.rdf_analyzer.features import jagged_feature_columns
+from src.rdf_analyzer.tree_join import join_columns
+
+# A (possibly dotted) identifier that is not the tail of a longer token, a member access or a C++ scope.
+IDENTIFIER_PATTERN = re.compile(r"(?<![\w.:])[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*(?![\w.])")
+CALL_OR_SCOPE_PATTERN = re.compile(r"\s*(\(|::)")
+
+# Keys of 'hist_params' entries that name the columns a histogram is filled from.
+HISTOGRAM_COLUMN_KEYS = ('column', 'x_column', 'y_column', 'columns')
+
+
+def referenced_columns(expression: Any) -> Set[str]:
+    """
+    Extract the names an RDataFrame expression may refer to as columns.
+
+    Function calls (`findMaxInRVec(...)`) and C++ scopes (`TMath::Pi`) are skipped. For dotted branch names
+    such as `rusdgeom.xcore`, both the full name and its top-level branch are returned; for method calls on a
+    column (`MIP0.size()`) the method name is dropped.
+
+    :param expression: The expression to inspect. Non-string values (e.g. numbers) have no references.
+    :return: Set of candidate column names.
+    """
+    if not isinstance(expression, str):
+        return set()
+
+    names = set()
+    for match in IDENTIFIER_PATTERN.finditer(expression):
+        name = match.group(0)
+        follower = CALL_OR_SCOPE_PATTERN.match(expression, match.end())
+        if follower:
+            if follower.group(1) == '::' or '.' not in name:
+                continue
+            name = name.rsplit('.', 1)[0]
+        names.add(name)
+        names.add(name.split('.', 1)[0])
+    return names
+
+
+class DependencyGraph:
+    def __init__(self, config: Dict[str, Any]):
+        """
+        Builds the column dependency graph of an analysis configuration.
+
+        Every column defined in 'new_columns', 'user_functions', 'jagged_features' or 'joins' is mapped to the
+        names referenced by its expression (or by its function arguments).
+
+        :param config: The analysis configuration dictionary.
+        """
+        self.definitions = self._collect_definitions(config)
+        self.roots = self._collect_roots(config)
+
+    @staticmethod
+    def _collect_definitions(config: Dict[str, Any]) -> Dict[str, Set[str]]:
+        """
+        Map each defined column to the names it references.
+
+        :param config: The analysis configuration dictionary.
+        :return: A dictionary with defined column names as keys and referenced names as values.
+        """
+        definitions = {}
+        for col in config.get('new_columns') or []:
+            definitions[col['name']] = referenced_columns(col['expression'])
+        for user_function in config.get('user_functions') or []:
+            args = user_function.get('args') or []
+            definitions[user_function['new_column']] = set().union(
+                *(referenced_columns(str(arg['value'])) for arg in args))
+        for col in jagged_feature_columns(config):
+            definitions[col['name']] = referenced_columns(col['expression'])
+        for join_id, join in enumerate(config.get('joins') or []):
+            for col in join_columns(join, join_id):
+                definitions[col['name']] = referenced_columns(col['expression'])
+        return definitions
+
+    def _collect_roots(self, config: Dict[str, Any]) -> Set[str]:
+        """
+        Collect the names read directly by the outputs of the analysis: cuts, histograms, the spectrum, the
+        composition fit, the event lists, the group_by aggregations and the snapshot.
+
+        If no 'snapshot_columns' list is configured, the snapshot writes every column, so every defined column
+        is a root.
+
+        :param config: The analysis configuration dictionary.
+        :return: Set of names referenced by the analysis outputs.
+        """
+        roots = set()
+        for cut in config.get('cuts') or []:
+            roots |= referenced_columns(cut)
+        for hist in config.get('hist_params') or []:
+            for key in HISTOGRAM_COLUMN_KEYS:
+                value = hist.get(key)
+                for column in value if isinstance(value, list) else [value]:
+                    roots |= referenced_columns(column)
+        if config.get('spectrum'):
+            roots |= referenced_columns(config['spectrum'].get('column'))
+        if config.get('composition_fit'):
+            roots |= referenced_columns(config['composition_fit'].get('energy_column'))
+            roots |= referenced_columns(config['composition_fit'].get('xmax_column'))
+        for event_list in config.get('event_lists') or []:
+            for column in list(event_list.get('columns') or []) + [event_list.get('by')]:
+                roots |= referenced_columns(column)
+        for group_by in config.get('group_by') or []:
+            for column in list(group_by.get('keys') or []) + [aggregation.get('column')
+                                                               for aggregation in group_by.get('aggregations') or []]:
+                roots |= referenced_columns(column)
+
+        snapshot_columns = config.get('snapshot_columns')
+        if snapshot_columns is None:
+            roots |= set(self.definitions) - {col['name'] for col in jagged_feature_columns(config)
+                                              if col.get('internal')}
+        else:
+            for column in snapshot_columns:
+                roots |= referenced_columns(column)
+        return roots
+
+    def live_columns(self) -> Set[str]:
+        """
+        Find the defined columns that are needed, directly or indirectly, by the analysis outputs.
+
+        :return: Set of defined column names that must be defined.
+        """
+        return self.resolve(self.roots) & set(self.definitions)
+
+    def resolve(self, names: Iterable[str]) -> Set[str]:
+        """
+        Transitively expand a set of names through the defined columns they depend on.
+
+        :param names: The names to expand.
+        :return: The names themselves plus every name they depend on, directly or indirectly.
+        """
+        resolved = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name in resolved:
+                continue
+            resolved.add(name)
+            pending.extend(self.definitions.get(name, ()))
+        return resolved
+
+    def base_columns(self, expression: Any) -> Set[str]:
+        """
+        Find the top-level input branches an expression ultimately reads, looking through defined columns.
+
+        :param expression: The expression to inspect.
+        :return: Set of top-level branch names (names that are not defined in the configuration).
+        """
+        return {name.split('.', 1)[0] for name in self.resolve(referenced_columns(expression))
+                if name not in self.definitions}
+
+    def dependency_order(self, expressions: List[Any]) -> Dict[int, Set[int]]:
+        """
+        For each expression, list the earlier expressions that share an input branch with it.
+
+        :param expressions: Expressions in their configured order.
+        :return: A dictionary mapping each index to the set of earlier indices it must follow.
+        """
+        inputs = [self.base_columns(expression) for expression in expressions]
+        return {i: {j for j in range(i) if inputs[i] & inputs[j]} for i in range(len(expressions))}
@@ -0,0 +1,198 @@
+from typing import Dict, Any
+import os
+
+import numpy as np
+import dstpy as dst
+
+from src.rdf_analyzer.utils import logger
+
+# RDataFrame action that collects rows of values of the selected events, one buffer per processing slot. With a
+# positive K, each slot keeps only its K best rows (ranked by the last value of the row) in a bounded heap, and the
+# heaps are merged at the end of the event loop. The result is flat and row-major.
+EVENT_LIST_HELPER = """
+#ifndef TAANALYSIS_EVENT_LIST_HELPER_H
+#define TAANALYSIS_EVENT_LIST_HELPER_H
+
+#include <algorithm>
+#include <cmath>
+#include <iterator>
+#include <utility>
+#include <vector>
+#include <ROOT/RDataFrame.hxx>
+
+namespace taAnalysis {
+
+class EventListHelper : public ROOT::Detail::RDF::RActionImpl<EventListHelper> {
+public:
+    using Result_t = std::vector<double>;
+    using Entry_t = std::pair<double, std::vector<double>>;
+
+private:
+    std::size_t fK;
+    bool fLargest;
+    std::vector<std::vector<double>> fRows;
+    std::vector<std::vector<Entry_t>> fHeaps;
+    std::shared_ptr<std::vector<double>> fResult;
+
+    // True if a should be kept rather than b. The heap top is the worst row kept.
+    bool Better(double a, double b) const { return fLargest ? a > b : a < b; }
+
+public:
+    EventListHelper(std::size_t k, bool largest) : fK(k), fLargest(largest), fResult(new std::vector<double>()) {
+        const unsigned int nSlots = ROOT::IsImplicitMTEnabled() ? ROOT::GetThreadPoolSize() : 1;
+        fRows.resize(nSlots);
+        fHeaps.resize(nSlots);
+    }
+    EventListHelper(EventListHelper &&) = default;
+    EventListHelper(const EventListHelper &) = delete;
+
+    std::shared_ptr<std::vector<double>> GetResultPtr() const { return fResult; }
+    void Initialize() {}
+    void InitTask(TTreeReader *, unsigned int) {}
+
+    // The last value of the row is the ranking key.
+    void Exec(unsigned int slot, const ROOT::RVec<double> &row) {
+        if (fK == 0) {
+            fRows[slot].insert(fRows[slot].end(), row.begin(), row.end());
+            return;
+        }
+        const double key = row.back();
+        if (std::isnan(key)) {
+            return;
+        }
+        auto &heap = fHeaps[slot];
+        auto compare = [this](const Entry_t &a, const Entry_t &b) { return Better(a.first, b.first); };
+        if (heap.size() < fK) {
+            heap.emplace_back(key, std::vector<double>(row.begin(), row.end()));
+            std::push_heap(heap.begin(), heap.end(), compare);
+        } else if (Better(key, heap.front().first)) {
+            std::pop_heap(heap.begin(), heap.end(), compare);
+            heap.back().first = key;
+            heap.back().second.assign(row.begin(), row.end());
+            std::push_heap(heap.begin(), heap.end(), compare);
+        }
+    }
+
+    void Finalize() {
+        if (fK == 0) {
+            for (const auto &rows : fRows) {
+                fResult->insert(fResult->end(), rows.begin(), rows.end());
+            }
+            return;
+        }
+        std::vector<Entry_t> merged;
+        for (auto &heap : fHeaps) {
+            std::move(heap.begin(), heap.end(), std::back_inserter(merged));
+        }
+        auto compare = [this](const Entry_t &a, const Entry_t &b) { return Better(a.first, b.first); };
+        const std::size_t n = std::min(fK, merged.size());
+        std::partial_sort(merged.begin(), merged.begin() + n, merged.end(), compare);
+        for (std::size_t i = 0; i < n; ++i) {
+            fResult->insert(fResult->end(), merged[i].second.begin(), merged[i].second.end());
+        }
+    }
+
+    std::string GetActionName() { return "EventList"; }
+};
+
+inline ROOT::RDF::RResultPtr<std::vector<double>> BookEventList(ROOT::RDF::RNode df, const std::string &column,
+                                                               std::size_t k, bool largest) {
+    return df.Book<ROOT::RVec<double>>(EventListHelper(k, largest), {column});
+}
+
+}
+
+#endif
+"""
+
+
+class EventListCollector:
+    def __init__(self, event_list: Dict[str, Any], output_dir: str):
+        """
+        Collects the values of some columns (e.g. run and event IDs) of the selected events in the analysis event
+        loop, either for every event or for the top K events by a ranking column, and writes them to a small
+        CSV or Parquet file.
+
+        :param event_list: An 'event_lists' entry of the configuration, with 'name', 'columns' and optionally
+            'top_k', 'by', 'order' ('descending' or 'ascending') and 'format' ('csv' or 'parquet').
+        :param output_dir: Directory of the output file.
+        """
+        self.event_list = event_list
+        self.output_dir = output_dir
+        self.name = event_list['name']
+        self.columns = list(event_list['columns'])
+        self.top_k = int(event_list.get('top_k') or 0)
+        self.by = event_list.get('by') or self.columns[0]
+        self.largest = event_list.get('order', 'descending') == 'descending'
+        self.output_format = event_list.get('format', 'csv')
+        self.width = len(self.columns) + bool(self.top_k)
+
+    def book(self, df: dst.ROOT.RDataFrame) -> Any:
+        """
+        Book the collection of the rows. The columns must be scalars; the values are stored as doubles.
+
+        :param df: The RDataFrame of selected events.
+        :return: The booked flat row buffer, or None if an error occurs.
+        """
+        dst.ROOT.gInterpreter.Declare(EVENT_LIST_HELPER)
+        values = self.columns + ([self.by] if self.top_k else [])
+        row = ", ".join(f"static_cast<double>({column})" for column in values)
+        try:
+            packed = df.Define(f"{self.name}_row", f"ROOT::RVec<double>{{{row}}}")
+            logger.info(f"Collecting {f'the top {self.top_k} events by {self.by}' if self.top_k else 'events'} "
+                        f"for event list {self.name}")
+            return dst.ROOT.taAnalysis.BookEventList(dst.ROOT.RDF.AsRNode(packed), f"{self.name}_row", self.top_k,
+                                                     self.largest)
+        except Exception as e:
+            logger.warning(f"Could not book event list {self.name}. {str(e)}. No event list created.")
+            return None
+
+    def rows(self, booked: Any) -> np.ndarray:
+        """
+        Get the collected rows (runs the event loop if it has not run yet).
+
+        :param booked: The booked row buffer.
+        :return: Array of shape (rows, values); for top-K lists, the last value is the ranking key.
+        """
+        values = np.array(booked.GetValue(), dtype=np.float64)
+        return values.reshape(-1, self.width)
+
+    def select(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Order the rows: by the ranking key, keeping the top K, or by the columns for a list of every event.
+
+        The threads fill their buffers in no particular order, and checkpoint segments are concatenated, so the
+        rows are sorted to make the output reproducible.
+
+        :param rows: The collected rows, possibly concatenated from several event loops.
+        :return: The selected rows, without the ranking key.
+        """
+        if self.top_k:
+            keys = -rows[:, -1] if self.largest else rows[:, -1]
+            return rows[np.argsort(keys, kind='stable')[:self.top_k], :-1]
+        return rows[np.lexsort(rows[:, ::-1].T)] if len(rows) else rows
+
+    def finalize(self, rows: np.ndarray) -> None:
+        """
+        Write the selected rows to '<name>.csv' or '<name>.parquet'. Columns whose values are all integers are
+        written as integers.
+
+        :param rows: The collected rows, possibly concatenated from several event loops.
+        """
+        rows = self.select(rows)
+        os.makedirs(self.output_dir, exist_ok=True)
+        output_file = os.path.join(self.output_dir, f"{self.name}.{self.output_format}")
+        integer = [bool(np.all(np.isfinite(rows[:, i])) and np.all(np.mod(rows[:, i], 1.) == 0.))
+                   for i in range(len(self.columns))]
+
+        if self.output_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.table({column: rows[:, i].astype(np.int64) if integer[i] else rows[:, i]
+                              for i, column in enumerate(self.columns)})
+            pq.write_table(table, output_file)
+        else:
+            np.savetxt(output_file, rows, delimiter=",", header=",".join(self.columns), comments="",
+                       fmt=["%d" if is_integer else "%.17g" for is_integer in integer])
+        logger.info(f"Saved {len(rows)} events to {output_file}")
@@ -0,0 +1,45 @@
+from typing import Dict, Any, List
+
+# Summary features of a jagged column, as fields of taReductions::Summary. The floating-point features of an
+# empty vector are NaN (written as such in the snapshot), like the missing values of `prqt2ml --add-features`.
+JAGGED_OPERATIONS = {
+    'mean': "{summary}.count ? {summary}.mean : std::numeric_limits<double>::quiet_NaN()",
+    'max': "{summary}.count ? {summary}.max : std::numeric_limits<double>::quiet_NaN()",
+    'rms': "{summary}.count ? {summary}.rms : std::numeric_limits<double>::quiet_NaN()",
+    'stddev': "{summary}.count ? {summary}.stddev : std::numeric_limits<double>::quiet_NaN()",
+    'sum': "{summary}.sum",
+    'argmax': "{summary}.argmax",
+    'count': "{summary}.count",
+}
+
+# Features that stay integers when a floating-point 'type' is configured.
+INTEGER_OPERATIONS = ('argmax', 'count')
+
+
+def jagged_feature_columns(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Translate the 'jagged_features' section of the configuration into column definitions.
+
+    Each entry summarizes one jagged column: a '<prefix>_summary' column computes all statistics of the vector
+    in one pass (taReductions::Summarize), and each requested operation reads one field of it into the scalar
+    column '<prefix>_<operation>'. The prefix defaults to the column name, as in `prqt2ml --add-features`.
+    The summary columns are marked 'internal': they hold a C++ struct and are not written to the snapshot.
+
+    :param config: The analysis configuration dictionary.
+    :return: List of {'name': ..., 'expression': ...} definitions, in definition order.
+    """
+    columns = []
+    for feature in config.get('jagged_features') or []:
+        prefix = feature.get('prefix') or feature['column'].replace('.', '_')
+        summary = f"{prefix}_summary"
+        columns.append({'name': summary, 'expression': f"taReductions::Summarize({feature['column']})",
+                        'internal': True})
+        for operation in feature.get('operations') or ['mean', 'max', 'sum', 'count']:
+            if operation not in JAGGED_OPERATIONS:
+                raise ValueError(f"Unknown jagged feature operation '{operation}' for {feature['column']}. "
+                                 f"Available operations: {', '.join(JAGGED_OPERATIONS)}")
+            expression = JAGGED_OPERATIONS[operation].format(summary=summary)
+            if feature.get('type') and operation not in INTEGER_OPERATIONS:
+                expression = f"static_cast<{feature['type']}>({expression})"
+            columns.append({'name': f"{prefix}_{operation}", 'expression': expression})
+    return columns
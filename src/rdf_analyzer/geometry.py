@@ -0,0 +1,223 @@
+from typing import Dict, Any, List, Optional, Tuple
+import glob
+import os
+
+import dstpy as dst
+import yaml
+
+from src.rdf_analyzer.utils import logger
+
+GEOMETRY_KERNELS = """
+inline ROOT::RVec<double> FdClf(const std::string &detector) {
+    for (int i = 0; i < kNSites; ++i) {
+        if (detector == kSiteNames[i] || detector == kSiteDetectorIds[i]) {
+            return ROOT::RVec<double>{kSiteClf[i][0], kSiteClf[i][1], kSiteClf[i][2]};
+        }
+    }
+    return ROOT::RVec<double>{kNaN, kNaN, kNaN};
+}
+
+inline ROOT::RVec<double> FdClfBySiteId(int siteId) {
+    for (int i = 0; i < kNSites; ++i) {
+        if (kSiteIds[i] == siteId) {
+            return ROOT::RVec<double>{kSiteClf[i][0], kSiteClf[i][1], kSiteClf[i][2]};
+        }
+    }
+    return ROOT::RVec<double>{kNaN, kNaN, kNaN};
+}
+
+inline double CounterCoordinate(int counterId, int axis) {
+    return (counterId >= 0 && counterId < kCounterTableSize) ? kCounterXYZ[counterId][axis] : kNaN;
+}
+
+// Distances in the ground plane from (x0, y0) to each point.
+inline ROOT::RVec<double> PlanarDistances(const ROOT::RVec<double> &x, const ROOT::RVec<double> &y,
+                                          double x0, double y0) {
+    const auto n = x.size();
+    ROOT::RVec<double> distances(n);
+    for (std::size_t i = 0; i < n; ++i) {
+        const double dx = x[i] - x0;
+        const double dy = y[i] - y0;
+        distances[i] = std::sqrt(dx * dx + dy * dy);
+    }
+    return distances;
+}
+
+// Distances in the ground plane from the shower core to each counter.
+inline ROOT::RVec<double> CoreDistances(const ROOT::RVec<int> &counterIds, double coreX, double coreY) {
+    const auto n = counterIds.size();
+    ROOT::RVec<double> distances(n);
+    for (std::size_t i = 0; i < n; ++i) {
+        const double dx = CounterCoordinate(counterIds[i], 0) - coreX;
+        const double dy = CounterCoordinate(counterIds[i], 1) - coreY;
+        distances[i] = std::sqrt(dx * dx + dy * dy);
+    }
+    return distances;
+}
+
+// Distances from the shower core to each counter, measured in the plane perpendicular to the shower axis.
+inline ROOT::RVec<double> ShowerPlaneDistances(const ROOT::RVec<int> &counterIds, double coreX, double coreY,
+                                               double theta, double phi) {
+    const double ux = std::sin(theta) * std::cos(phi);
+    const double uy = std::sin(theta) * std::sin(phi);
+    const double uz = std::cos(theta);
+    const auto n = counterIds.size();
+    ROOT::RVec<double> distances(n);
+    for (std::size_t i = 0; i < n; ++i) {
+        const double dx = CounterCoordinate(counterIds[i], 0) - coreX;
+        const double dy = CounterCoordinate(counterIds[i], 1) - coreY;
+        const double dz = CounterCoordinate(counterIds[i], 2) - kCoreAltitude;
+        const double along = dx * ux + dy * uy + dz * uz;
+        distances[i] = std::sqrt(std::max(dx * dx + dy * dy + dz * dz - along * along, 0.));
+    }
+    return distances;
+}
+
+// Three-dimensional distances from an FD site to each counter.
+inline ROOT::RVec<double> SiteDistances(const ROOT::RVec<int> &counterIds, int siteId) {
+    const auto site = FdClfBySiteId(siteId);
+    const auto n = counterIds.size();
+    ROOT::RVec<double> distances(n);
+    for (std::size_t i = 0; i < n; ++i) {
+        const double dx = CounterCoordinate(counterIds[i], 0) - site[0];
+        const double dy = CounterCoordinate(counterIds[i], 1) - site[1];
+        const double dz = CounterCoordinate(counterIds[i], 2) - site[2];
+        distances[i] = std::sqrt(dx * dx + dy * dy + dz * dz);
+    }
+    return distances;
+}
+"""
+
+
+class DetectorGeometry:
+    def __init__(self, detector_configs: List[Dict[str, Any]],
+                 counter_positions: Optional[Dict[int, Tuple[float, float, float]]] = None,
+                 detector: Optional[Dict[str, Any]] = None, core_altitude: float = 0.):
+        """
+        Constant detector geometry tables, declared once to ROOT in the `taGeometry` namespace.
+
+        The tables hold the CLF coordinates of every FD site with 'clf_x', 'clf_y' and 'clf_z' in its detector
+        configuration, and the CLF coordinates of the SD counters, indexed by counter ID. Vectorized kernels compute
+        the distances from the shower core or from an FD site to every counter of an event in one call.
+
+        :param detector_configs: The detector configurations (contents of src/config/detectors/*.yaml).
+        :param counter_positions: Counter ID mapped to its (x, y, z) CLF coordinates in meters (optional).
+        :param detector: The configuration of the analysed detector, whose CLF coordinates become `kDetectorClf`.
+        :param core_altitude: Altitude of the shower core in the CLF frame, in meters, for shower-plane distances.
+        """
+        self.sites = [config for config in detector_configs
+                      if all(config.get(key) is not None for key in ('clf_x', 'clf_y', 'clf_z'))]
+        self.counter_positions = counter_positions or {}
+        self.detector = detector or {}
+        self.core_altitude = core_altitude
+
+    @staticmethod
+    def from_config(config: Dict[str, Any]) -> 'DetectorGeometry':
+        """
+        Load the geometry of an analysis: every detector configuration next to 'detector_config', and the
+        counter position table named by 'counter_positions' in the analysis or detector configuration.
+
+        :param config: The analysis configuration (with the detector configuration under 'detector').
+        :return: The detector geometry.
+        """
+        detector_dir = os.path.dirname(os.path.abspath(config['detector_config']))
+        detector_configs = DetectorGeometry.load_detector_configs(detector_dir)
+        counter_file = config.get('counter_positions') or (config.get('detector') or {}).get('counter_positions')
+        counter_positions = DetectorGeometry.load_counter_positions(counter_file) if counter_file else None
+        return DetectorGeometry(detector_configs, counter_positions, config.get('detector'),
+                                config.get('core_altitude', 0.))
+
+    @staticmethod
+    def load_detector_configs(detector_dir: str) -> List[Dict[str, Any]]:
+        """
+        Load every detector configuration YAML file in a directory.
+
+        :param detector_dir: The directory containing the detector configurations.
+        :return: List of detector configuration dictionaries.
+        """
+        configs = []
+        for path in sorted(glob.glob(os.path.join(detector_dir, "*.yaml"))):
+            with open(path, 'r') as file:
+                configs.append(yaml.safe_load(file) or {})
+        return configs
+
+    @staticmethod
+    def load_counter_positions(counter_file: str) -> Dict[int, Tuple[float, float, float]]:
+        """
+        Load a counter position table: one counter per line with its ID and x, y, z CLF coordinates in meters,
+        separated by whitespace or commas. Lines starting with '#' are ignored.
+
+        :param counter_file: Path to the counter position table.
+        :return: Counter ID mapped to its (x, y, z) coordinates.
+        """
+        positions = {}
+        with open(counter_file, 'r') as file:
+            for line in file:
+                fields = line.replace(',', ' ').split()
+                if not fields or fields[0].startswith('#'):
+                    continue
+                positions[int(fields[0])] = (float(fields[1]), float(fields[2]), float(fields[3]))
+        logger.info(f"Loaded {len(positions)} counter positions from {counter_file}")
+        return positions
+
+    def cpp_source(self) -> str:
+        """
+        Generate the C++ declarations of the geometry tables and kernels.
+
+        The counter table is a dense array indexed by counter ID, so a lookup is a single load; IDs without a known
+        position give NaN coordinates.
+
+        :return: C++ code as a string.
+        """
+        detector_clf = ", ".join(repr(float(self.detector[key])) if self.detector.get(key) is not None else "kNaN"
+                                 for key in ('clf_x', 'clf_y', 'clf_z'))
+        n_sites = max(len(self.sites), 1)
+        site_names = ", ".join(f'"{site.get("name", "")}"' for site in self.sites) or '""'
+        site_detector_ids = ", ".join(f'"{site.get("detector_id", "")}"' for site in self.sites) or '""'
+        site_ids = ", ".join(str(site.get('site_id') if site.get('site_id') is not None else -1)
+                             for site in self.sites) or "-1"
+        site_clf = ", ".join(f"{{{site['clf_x']!r}, {site['clf_y']!r}, {site['clf_z']!r}}}"
+                             for site in self.sites) or "{kNaN, kNaN, kNaN}"
+
+        table_size = max(self.counter_positions, default=-1) + 1
+        rows = [self.counter_positions.get(counter_id) for counter_id in range(table_size)]
+        counter_xyz = ",\n    ".join(f"{{{row[0]!r}, {row[1]!r}, {row[2]!r}}}" if row else "{kNaN, kNaN, kNaN}"
+                                     for row in rows) or "{kNaN, kNaN, kNaN}"
+
+        return f"""
+#ifndef TAANALYSIS_GEOMETRY_H
+#define TAANALYSIS_GEOMETRY_H
+
+#include <algorithm>
+#include <cmath>
+#include <limits>
+#include <string>
+
+namespace taGeometry {{
+
+constexpr double kNaN = std::numeric_limits<double>::quiet_NaN();
+constexpr double kCoreAltitude = {float(self.core_altitude)!r};
+constexpr double kDetectorClf[3] = {{{detector_clf}}};
+
+constexpr int kNSites = {len(self.sites)};
+const char *const kSiteNames[{n_sites}] = {{{site_names}}};
+const char *const kSiteDetectorIds[{n_sites}] = {{{site_detector_ids}}};
+constexpr int kSiteIds[{n_sites}] = {{{site_ids}}};
+constexpr double kSiteClf[{n_sites}][3] = {{{site_clf}}};
+
+constexpr int kCounterTableSize = {table_size};
+constexpr double kCounterXYZ[{max(table_size, 1)}][3] = {{
+    {counter_xyz}
+}};
+{GEOMETRY_KERNELS}
+}}
+
+#endif
+"""
+
+    def declare(self) -> None:
+        """
+        Declare the geometry tables and kernels to ROOT.
+        """
+        dst.ROOT.gInterpreter.Declare(self.cpp_source())
+        logger.info(f"Declared detector geometry: {len(self.sites)} FD sites, {len(self.counter_positions)} counters")
@@ -0,0 +1,386 @@
+from typing import Dict, Any, List, Optional, Tuple
+from collections import Counter
+import math
+import os
+
+import numpy as np
+import dstpy as dst
+
+from src.rdf_analyzer.utils import logger
+
+# RDataFrame action that aggregates values by group key in one hash map per processing slot, merged at the end of
+# the event loop. Quantiles use a mergeable sketch with relative accuracy (DDSketch): non-zero values are counted in
+# logarithmic buckets of index ceil(log_gamma |x|), with gamma = (1 + accuracy) / (1 - accuracy).
+#
+# The result is flat: per group, the key values, the number of entries, then for each value column the number of
+# (non-NaN) values, their sum, min and max, the numbers of positive and negative buckets, the count of zeros, and
+# the (bucket index, count) pairs of the positive and negative buckets.
+GROUP_BY_HELPER = """
+#ifndef TAANALYSIS_GROUP_BY_HELPER_H
+#define TAANALYSIS_GROUP_BY_HELPER_H
+
+#include <algorithm>
+#include <cmath>
+#include <limits>
+#include <unordered_map>
+#include <vector>
+#include <ROOT/RDataFrame.hxx>
+
+namespace taAnalysis {
+
+struct GroupSketch {
+    std::unordered_map<int, ULong64_t> positive, negative;
+    ULong64_t zero = 0;
+};
+
+struct GroupAccumulator {
+    ULong64_t count = 0;
+    std::vector<double> n, sum, min, max;
+    std::vector<GroupSketch> sketches;
+};
+
+struct GroupKeyHash {
+    std::size_t operator()(const std::vector<double> &key) const {
+        std::size_t h = 0;
+        for (const double x : key) {
+            h ^= std::hash<double>{}(x) + 0x9E3779B97F4A7C15ULL + (h << 6) + (h >> 2);
+        }
+        return h;
+    }
+};
+
+class GroupByHelper : public ROOT::Detail::RDF::RActionImpl<GroupByHelper> {
+public:
+    using Result_t = std::vector<double>;
+    using Map_t = std::unordered_map<std::vector<double>, GroupAccumulator, GroupKeyHash>;
+
+private:
+    std::size_t fNKeys, fNValues;
+    bool fSketch;
+    double fLogGamma;
+    std::vector<Map_t> fMaps;
+    std::vector<std::vector<double>> fKeys;
+    std::shared_ptr<std::vector<double>> fResult;
+
+    GroupAccumulator NewAccumulator() const {
+        GroupAccumulator acc;
+        acc.n.assign(fNValues, 0.);
+        acc.sum.assign(fNValues, 0.);
+        acc.min.assign(fNValues, std::numeric_limits<double>::infinity());
+        acc.max.assign(fNValues, -std::numeric_limits<double>::infinity());
+        acc.sketches.resize(fSketch ? fNValues : 0);
+        return acc;
+    }
+
+    void AddToSketch(GroupSketch &sketch, double x) const {
+        if (x > 0.) {
+            ++sketch.positive[int(std::ceil(std::log(x) / fLogGamma))];
+        } else if (x < 0.) {
+            ++sketch.negative[int(std::ceil(std::log(-x) / fLogGamma))];
+        } else {
+            ++sketch.zero;
+        }
+    }
+
+    static void Merge(GroupAccumulator &into, const GroupAccumulator &acc) {
+        into.count += acc.count;
+        for (std::size_t v = 0; v < into.n.size(); ++v) {
+            into.n[v] += acc.n[v];
+            into.sum[v] += acc.sum[v];
+            into.min[v] = std::min(into.min[v], acc.min[v]);
+            into.max[v] = std::max(into.max[v], acc.max[v]);
+        }
+        for (std::size_t v = 0; v < into.sketches.size(); ++v) {
+            for (const auto &bucket : acc.sketches[v].positive) {
+                into.sketches[v].positive[bucket.first] += bucket.second;
+            }
+            for (const auto &bucket : acc.sketches[v].negative) {
+                into.sketches[v].negative[bucket.first] += bucket.second;
+            }
+            into.sketches[v].zero += acc.sketches[v].zero;
+        }
+    }
+
+public:
+    GroupByHelper(std::size_t nKeys, std::size_t nValues, bool sketch, double accuracy)
+        : fNKeys(nKeys), fNValues(nValues), fSketch(sketch),
+          fLogGamma(std::log((1. + accuracy) / (1. - accuracy))), fResult(new std::vector<double>()) {
+        const unsigned int nSlots = ROOT::IsImplicitMTEnabled() ? ROOT::GetThreadPoolSize() : 1;
+        fMaps.resize(nSlots);
+        fKeys.assign(nSlots, std::vector<double>(nKeys));
+    }
+    GroupByHelper(GroupByHelper &&) = default;
+    GroupByHelper(const GroupByHelper &) = delete;
+
+    std::shared_ptr<std::vector<double>> GetResultPtr() const { return fResult; }
+    void Initialize() {}
+    void InitTask(TTreeReader *, unsigned int) {}
+
+    // The row holds the key values, then the values to aggregate.
+    void Exec(unsigned int slot, const ROOT::RVec<double> &row) {
+        auto &key = fKeys[slot];
+        std::copy(row.begin(), row.begin() + fNKeys, key.begin());
+        auto &map = fMaps[slot];
+        auto it = map.find(key);
+        if (it == map.end()) {
+            it = map.emplace(key, NewAccumulator()).first;
+        }
+        auto &acc = it->second;
+        ++acc.count;
+        for (std::size_t v = 0; v < fNValues; ++v) {
+            const double x = row[fNKeys + v];
+            if (std::isnan(x)) {
+                continue;
+            }
+            acc.n[v] += 1.;
+            acc.sum[v] += x;
+            acc.min[v] = std::min(acc.min[v], x);
+            acc.max[v] = std::max(acc.max[v], x);
+            if (fSketch) {
+                AddToSketch(acc.sketches[v], x);
+            }
+        }
+    }
+
+    void Finalize() {
+        auto &merged = fMaps[0];
+        for (std::size_t slot = 1; slot < fMaps.size(); ++slot) {
+            for (const auto &group : fMaps[slot]) {
+                auto it = merged.find(group.first);
+                if (it == merged.end()) {
+                    merged.emplace(group.first, group.second);
+                } else {
+                    Merge(it->second, group.second);
+                }
+            }
+        }
+        auto &out = *fResult;
+        for (const auto &group : merged) {
+            const auto &acc = group.second;
+            out.insert(out.end(), group.first.begin(), group.first.end());
+            out.push_back(acc.count);
+            for (std::size_t v = 0; v < fNValues; ++v) {
+                out.insert(out.end(), {acc.n[v], acc.sum[v], acc.min[v], acc.max[v]});
+                if (!fSketch) {
+                    out.insert(out.end(), {0., 0., 0.});
+                    continue;
+                }
+                const auto &sketch = acc.sketches[v];
+                out.insert(out.end(), {double(sketch.positive.size()), double(sketch.negative.size()),
+                                       double(sketch.zero)});
+                for (const auto *buckets : {&sketch.positive, &sketch.negative}) {
+                    for (const auto &bucket : *buckets) {
+                        out.insert(out.end(), {double(bucket.first), double(bucket.second)});
+                    }
+                }
+            }
+        }
+    }
+
+    std::string GetActionName() { return "GroupBy"; }
+};
+
+inline ROOT::RDF::RResultPtr<std::vector<double>> BookGroupBy(ROOT::RDF::RNode df, const std::string &column,
+                                                             std::size_t nKeys, std::size_t nValues, bool sketch,
+                                                             double accuracy) {
+    return df.Book<ROOT::RVec<double>>(GroupByHelper(nKeys, nValues, sketch, accuracy), {column});
+}
+
+}
+
+#endif
+"""
+
+# Aggregations of a value column. 'quantile' gives one output column per configured quantile.
+GROUP_BY_OPERATIONS = ('count', 'sum', 'mean', 'min', 'max', 'quantile')
+
+
+class GroupByAggregator:
+    def __init__(self, group_by: Dict[str, Any], output_dir: str):
+        """
+        Aggregates columns of the selected events by group key (e.g. date, run or site) in the analysis event loop,
+        and writes one row per group to '<name>.csv'.
+
+        :param group_by: A 'group_by' entry of the configuration, with 'name', 'keys' and 'aggregations' (each with
+            a 'column' and its 'operations'), and optionally 'quantiles', 'accuracy' (relative accuracy of the
+            quantiles) and 'pass_rate' (also count the events before the cuts).
+        :param output_dir: Directory of the output file.
+        """
+        self.group_by = group_by
+        self.output_dir = output_dir
+        self.name = group_by['name']
+        self.keys = list(group_by['keys'])
+        self.aggregations = group_by.get('aggregations') or []
+        self.values = list(dict.fromkeys(aggregation['column'] for aggregation in self.aggregations))
+        self.quantiles = [float(q) for q in group_by.get('quantiles') or [0.5]]
+        self.accuracy = float(group_by.get('accuracy', 0.01))
+        self.pass_rate = bool(group_by.get('pass_rate'))
+        self.sketch = any('quantile' in aggregation.get('operations', []) for aggregation in self.aggregations)
+        for aggregation in self.aggregations:
+            for operation in aggregation.get('operations', []):
+                if operation not in GROUP_BY_OPERATIONS:
+                    raise ValueError(f"Unknown group_by operation '{operation}' for {aggregation['column']}. "
+                                     f"Available operations: {', '.join(GROUP_BY_OPERATIONS)}")
+
+    def book(self, df: dst.ROOT.RDataFrame, all_df: Optional[dst.ROOT.RDataFrame] = None) -> Tuple[Any, Any]:
+        """
+        Book the aggregation of the selected events and, for pass rates, the event count of each group before the
+        cuts. The key and value columns must be scalars.
+
+        :param df: The RDataFrame of selected events.
+        :param all_df: The RDataFrame before the cuts (used if 'pass_rate' is set).
+        :return: The booked results for the selected events and for all events (None if not needed or on error).
+        """
+        dst.ROOT.gInterpreter.Declare(GROUP_BY_HELPER)
+        logger.info(f"Aggregating {', '.join(self.values) or 'event counts'} by {', '.join(self.keys)} "
+                    f"for {self.name}")
+        selected = self._book(df, self.values, self.sketch)
+        passed = self._book(all_df, [], False) if self.pass_rate and all_df is not None else None
+        return selected, passed
+
+    def _book(self, df: dst.ROOT.RDataFrame, values: List[str], sketch: bool) -> Any:
+        """
+        Book one aggregation action.
+
+        :param df: The RDataFrame to aggregate.
+        :param values: The value columns.
+        :param sketch: Whether to fill quantile sketches.
+        :return: The booked flat result, or None if an error occurs.
+        """
+        row = ", ".join(f"static_cast<double>({column})" for column in self.keys + values)
+        try:
+            packed = df.Define(f"{self.name}_group_row", f"ROOT::RVec<double>{{{row}}}")
+            return dst.ROOT.taAnalysis.BookGroupBy(dst.ROOT.RDF.AsRNode(packed), f"{self.name}_group_row",
+                                                   len(self.keys), len(values), sketch, self.accuracy)
+        except Exception as e:
+            logger.warning(f"Could not book group_by {self.name}. {str(e)}. No aggregation created.")
+            return None
+
+    @staticmethod
+    def flat_result(booked: Any) -> np.ndarray:
+        """
+        Get the flat result of an aggregation (runs the event loop if it has not run yet).
+
+        :param booked: The booked result.
+        :return: The flat result array.
+        """
+        return np.array(booked.GetValue(), dtype=np.float64)
+
+    def parse(self, flat: np.ndarray, n_values: int, groups: Optional[Dict] = None) -> Dict:
+        """
+        Read the groups of a flat aggregation result, merging them into existing groups (e.g. of other checkpoint
+        segments).
+
+        :param flat: The flat result (see GROUP_BY_HELPER).
+        :param n_values: The number of value columns.
+        :param groups: Groups to merge into (default: a new dictionary).
+        :return: Dictionary of key tuples to {'count': ..., 'values': [per-column statistics]}.
+        """
+        groups = {} if groups is None else groups
+        flat = np.ravel(flat)
+        i = 0
+        while i < len(flat):
+            key = tuple(flat[i:i + len(self.keys)].tolist())
+            i += len(self.keys)
+            group = groups.setdefault(key, {'count': 0, 'values': [
+                {'n': 0., 'sum': 0., 'min': math.inf, 'max': -math.inf, 'positive': Counter(), 'negative': Counter(),
+                 'zero': 0} for _ in range(n_values)]})
+            group['count'] += int(flat[i])
+            i += 1
+            for stats in group['values']:
+                n, total, minimum, maximum, n_positive, n_negative, zero = flat[i:i + 7]
+                i += 7
+                stats['n'] += n
+                stats['sum'] += total
+                stats['min'] = min(stats['min'], minimum)
+                stats['max'] = max(stats['max'], maximum)
+                stats['zero'] += int(zero)
+                for buckets, n_buckets in ((stats['positive'], int(n_positive)), (stats['negative'], int(n_negative))):
+                    pairs = flat[i:i + 2 * n_buckets].reshape(-1, 2)
+                    i += 2 * n_buckets
+                    for index, count in pairs:
+                        buckets[int(index)] += int(count)
+        return groups
+
+    def quantile(self, stats: Dict[str, Any], q: float) -> float:
+        """
+        Estimate a quantile from a sketch, within the relative accuracy.
+
+        :param stats: The statistics of a value column in a group.
+        :param q: The quantile, in [0, 1].
+        :return: The quantile estimate, or NaN for an empty group.
+        """
+        n = sum(stats['positive'].values()) + sum(stats['negative'].values()) + stats['zero']
+        if n == 0:
+            return math.nan
+        gamma = (1. + self.accuracy) / (1. - self.accuracy)
+        rank = q * (n - 1)
+        seen = 0
+        for index in sorted(stats['negative'], reverse=True):
+            seen += stats['negative'][index]
+            if seen > rank:
+                return -2. * gamma ** index / (gamma + 1.)
+        seen += stats['zero']
+        if seen > rank:
+            return 0.
+        for index in sorted(stats['positive']):
+            seen += stats['positive'][index]
+            if seen > rank:
+                return 2. * gamma ** index / (gamma + 1.)
+        return stats['max']
+
+    def finalize(self, selected: Dict, passed: Optional[Dict] = None) -> None:
+        """
+        Write one row per group, sorted by key, to '<name>.csv'.
+
+        :param selected: The parsed groups of the selected events.
+        :param passed: The parsed groups of all events before the cuts, for the pass rates.
+        """
+        header = self.keys + ['count']
+        if passed is not None:
+            header += ['n_all', 'pass_rate']
+        for aggregation in self.aggregations:
+            for operation in aggregation.get('operations', []):
+                if operation == 'quantile':
+                    header += [f"{aggregation['column']}_q{100 * q:g}" for q in self.quantiles]
+                else:
+                    header.append(f"{aggregation['column']}_{operation}")
+
+        keys = sorted(set(selected) | set(passed or {}))
+        rows = []
+        for key in keys:
+            group = selected.get(key)
+            count = group['count'] if group else 0
+            row = list(key) + [count]
+            if passed is not None:
+                n_all = passed[key]['count'] if key in passed else 0
+                row += [n_all, count / n_all if n_all else math.nan]
+            for aggregation in self.aggregations:
+                stats = group['values'][self.values.index(aggregation['column'])] if group else None
+                for operation in aggregation.get('operations', []):
+                    row += self._aggregate(stats, operation)
+            rows.append(row)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        output_file = os.path.join(self.output_dir, f"{self.name}.csv")
+        np.savetxt(output_file, np.array(rows, dtype=np.float64).reshape(-1, len(header)), delimiter=",",
+                   header=",".join(header), comments="", fmt="%.10g")
+        logger.info(f"Saved {len(rows)} groups to {output_file}")
+
+    def _aggregate(self, stats: Optional[Dict[str, Any]], operation: str) -> List[float]:
+        """
+        Compute one aggregation of a value column in a group.
+
+        :param stats: The statistics of the value column in the group (None if no event was selected).
+        :param operation: One of GROUP_BY_OPERATIONS.
+        :return: The output values (one per quantile for 'quantile').
+        """
+        if operation == 'quantile':
+            return [self.quantile(stats, q) if stats else math.nan for q in self.quantiles]
+        if not stats or (stats['n'] == 0 and operation != 'count'):
+            return [0. if operation in ('count', 'sum') else math.nan]
+        if operation == 'count':
+            return [stats['n']]
+        if operation == 'mean':
+            return [stats['sum'] / stats['n']]
+        return [stats[operation]]
@@ -1,28 +1,137 @@
+from array import array
+from typing import Any, Dict, List
 import os
-from typing import Dict, List
 
+import numpy as np
 import dstpy as dst
 
+from src.rdf_analyzer.plot_renderer import PlotRenderer
 from src.rdf_analyzer.utils import logger
 
+# RDataFrame action that fills one THnSparseD per processing slot and merges them at the end of the event loop.
+SPARSE_HISTOGRAM_HELPER = """
+#ifndef TAANALYSIS_SPARSE_HISTOGRAM_HELPER_H
+#define TAANALYSIS_SPARSE_HISTOGRAM_HELPER_H
+
+#include <THnSparse.h>
+#include <ROOT/RDataFrame.hxx>
+
+namespace taAnalysis {
+
+class SparseHistogramHelper : public ROOT::Detail::RDF::RActionImpl<SparseHistogramHelper> {
+public:
+    using Result_t = THnSparseD;
+
+private:
+    std::vector<std::shared_ptr<THnSparseD>> fHistos;
+
+public:
+    SparseHistogramHelper(const THnSparseD &model) {
+        const unsigned int nSlots = ROOT::IsImplicitMTEnabled() ? ROOT::GetThreadPoolSize() : 1;
+        for (unsigned int i = 0; i < nSlots; ++i) {
+            fHistos.emplace_back(static_cast<THnSparseD *>(model.Clone()));
+            fHistos.back()->Reset();
+        }
+    }
+    SparseHistogramHelper(SparseHistogramHelper &&) = default;
+    SparseHistogramHelper(const SparseHistogramHelper &) = delete;
+
+    std::shared_ptr<THnSparseD> GetResultPtr() const { return fHistos[0]; }
+    void Initialize() {}
+    void InitTask(TTreeReader *, unsigned int) {}
+
+    void Exec(unsigned int slot, const ROOT::RVec<double> &point) {
+        fHistos[slot]->Fill(point.data());
+    }
+
+    void Finalize() {
+        for (size_t i = 1; i < fHistos.size(); ++i) {
+            fHistos[0]->Add(fHistos[i].get());
+        }
+    }
+
+    std::string GetActionName() { return "SparseHistogram"; }
+};
+
+inline ROOT::RDF::RResultPtr<THnSparseD> BookSparseHistogram(ROOT::RDF::RNode df, const THnSparseD &model,
+                                                             const std::string &column) {
+    return df.Book<ROOT::RVec<double>>(SparseHistogramHelper(model), {column});
+}
+
+}
+
+#endif
+"""
+
+# Per-event Poisson(1) bootstrap weights. The weights of an event depend only on the seed, the entry number and the
+# replica, so every histogram of a run sees the same resampled datasets, whatever the thread scheduling.
+BOOTSTRAP_HELPER = """
+#ifndef TAANALYSIS_BOOTSTRAP_HELPER_H
+#define TAANALYSIS_BOOTSTRAP_HELPER_H
+
+#include <cmath>
+#include <ROOT/RVec.hxx>
+
+namespace taAnalysis {
+
+inline ULong64_t SplitMix64(ULong64_t x) {
+    x += 0x9E3779B97F4A7C15ULL;
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EBULL;
+    return x ^ (x >> 31);
+}
+
+inline ROOT::RVec<double> PoissonWeights(unsigned int nReplicas, ULong64_t entry, ULong64_t seed) {
+    ROOT::RVec<double> weights(nReplicas);
+    const ULong64_t eventSeed = SplitMix64(seed ^ SplitMix64(entry));
+    for (unsigned int r = 0; r < nReplicas; ++r) {
+        const double u = (SplitMix64(eventSeed + r) >> 11) * 0x1.0p-53;
+        // Inversion of the Poisson(1) CDF
+        double p = std::exp(-1.), cdf = p;
+        int k = 0;
+        while (u > cdf && k < 20) {
+            ++k;
+            p /= k;
+            cdf += p;
+        }
+        weights[r] = k;
+    }
+    return weights;
+}
+
+inline ROOT::RVec<double> ReplicaIndices(unsigned int nReplicas) {
+    ROOT::RVec<double> indices(nReplicas);
+    for (unsigned int r = 0; r < nReplicas; ++r) {
+        indices[r] = r + 0.5;
+    }
+    return indices;
+}
+
+}
+
+#endif
+"""
+
 
 class HistogramManager:
     def __init__(self, output_dir: str = None):
         self.output_dir = output_dir
+        self.sparse_helper_declared = False
+        self.bootstrap_helper_declared = False
 
-    @staticmethod
-    def create_histogram(hist: Dict, df: dst.ROOT.RDataFrame) -> dst.ROOT.TH1F:
+    def create_histogram(self, hist: Dict, df: dst.ROOT.RDataFrame) -> Any:
         """
-        Create a histogram or profile plot for a given column in the dataframe, depending on the 'style' specified.
+        Book a histogram or profile plot for a given column in the dataframe, depending on the 'style' specified.
 
-        This method decides whether to create a simple histogram or a profile plot based on the 'style' key in the
-        provided histogram dictionary.
+        This method decides whether to create a simple histogram, a profile plot or a sparse N-dimensional
+        histogram based on the 'style' key in the provided histogram dictionary. The result is only booked;
+        all booked results are filled in the same event loop when `finalize_histograms` is called.
 
         :param hist: A dictionary containing the histogram or profile plot configuration. Expected keys:
-            - 'style': The type of plot to create, either 'histogram' or 'profile_plot'.
+            - 'style': The type of plot to create: 'histogram', 'profile_plot' or 'sparse_histogram'.
             - 'name', 'title', 'bins', 'min', 'max', 'column', etc., depending on the style.
         :param df: The RDataFrame from which the histogram will be created.
-        :return: The created histogram (TH1F object), or None if creation fails or no matching style is found.
+        :return: The booked result, or None if creation fails or no matching style is found.
         """
         if hist['style'] == 'histogram':
             logger.info(f"Creating histogram for {hist['column']}")
@@ -30,8 +139,37 @@ class HistogramManager:
         elif hist['style'] == 'profile_plot':
             logger.info(f"Creating profile plot for {hist['x_column']} vs. {hist['y_column']}")
             return HistogramManager._create_profile_plot(hist, df)
+        elif hist['style'] == 'sparse_histogram':
+            logger.info(f"Creating sparse histogram for {', '.join(hist['columns'])}")
+            return self._create_sparse_histogram(hist, df)
         return None
 
+    def finalize_histograms(self, hist_params: List[Dict], booked: List[Any]) -> List[Any]:
+        """
+        Retrieve the booked histograms and set their drawing parameters.
+
+        Accessing the first booked result runs the event loop, which fills every booked result at once.
+        Sparse histograms are followed by their configured 1D and 2D projections.
+
+        :param hist_params: The histogram configurations, in the order in which they were booked.
+        :param booked: The booked results returned by `create_histogram`, or histograms that are already filled
+            (e.g. merged from checkpoints).
+        :return: List of histograms (TH1, TProfile, TH2 or THnSparse objects); None for failed bookings.
+        """
+        histograms = []
+        for hist, result in zip(hist_params, booked):
+            if result is None:
+                histograms.append(None)
+                continue
+            histogram = result.GetPtr() if hasattr(result, 'GetPtr') else result
+            if hist['style'] == 'sparse_histogram':
+                histograms.append(histogram)
+                histograms.extend(self._project_sparse_histogram(hist, histogram))
+                continue
+            HistogramManager._set_histogram_parameters(hist, histogram)
+            histograms.append(histogram)
+        return histograms
+
     @staticmethod
     def _create_histogram(hist: Dict, df: dst.ROOT.RDataFrame) -> dst.ROOT.TH1F:
         """
@@ -53,8 +191,7 @@ class HistogramManager:
         except Exception as e:
             logger.warning(f"No column found for histogram. {str(e)}. No histogram created.")
             return None
-        HistogramManager._set_histogram_parameters(hist, histogram)
-        return histogram.GetPtr()
+        return histogram
 
     @staticmethod
     def _create_profile_plot(hist: Dict, df: dst.ROOT.RDataFrame) -> dst.ROOT.TH1F:
@@ -79,8 +216,190 @@ class HistogramManager:
             histo = df.Profile1D(
                 (hist['name'], hist['title'], hist['x_bins'], hist['x_min'], hist['x_max'], hist['options']),
                 hist['x_column'], hist['y_column'])
-        HistogramManager._set_histogram_parameters(hist, histo)
-        return histo.GetPtr()
+        return histo
+
+    def _create_sparse_histogram(self, hist: Dict, df: dst.ROOT.RDataFrame) -> Any:
+        """
+        Book a sparse N-dimensional histogram (THnSparseD) of the given columns.
+
+        Only filled bins are stored, so fine multi-dimensional binnings (e.g. energy x zenith x Xmax x core
+        distance) do not allocate the full dense bin grid. The columns are packed into one RVec column per event
+        and filled by a custom RDataFrame action, in the same event loop as the other histograms.
+
+        :param hist: A dictionary containing the sparse histogram configuration. Expected keys:
+            - 'name', 'title', 'columns' (one column per axis),
+            - 'axes': one entry per column with 'title' and either 'bins', 'min', 'max' or 'bin_edges',
+            - optionally 'projections': list of lists of one or two axis indices to project onto.
+        :param df: The RDataFrame containing the columns.
+        :return: The booked THnSparseD result, or None if an error occurs.
+        """
+        columns, axes = hist['columns'], hist['axes']
+        if len(columns) != len(axes):
+            logger.warning(f"Sparse histogram {hist['name']} has {len(columns)} columns but {len(axes)} axes. "
+                           f"No histogram created.")
+            return None
+
+        self._declare_sparse_helper()
+        model = HistogramManager._sparse_histogram_model(hist)
+        point = ", ".join(f"static_cast<double>({column})" for column in columns)
+        try:
+            packed = df.Define(f"{hist['name']}_point", f"ROOT::RVec<double>{{{point}}}")
+            return dst.ROOT.taAnalysis.BookSparseHistogram(dst.ROOT.RDF.AsRNode(packed), model,
+                                                           f"{hist['name']}_point")
+        except Exception as e:
+            logger.warning(f"Could not book sparse histogram {hist['name']}. {str(e)}. No histogram created.")
+            return None
+
+    def _declare_sparse_helper(self) -> None:
+        """
+        Declare the C++ sparse histogram action to ROOT, once per session.
+        """
+        if not self.sparse_helper_declared:
+            dst.ROOT.gInterpreter.Declare(SPARSE_HISTOGRAM_HELPER)
+            self.sparse_helper_declared = True
+
+    def create_bootstrap_replicas(self, hist: Dict, df: dst.ROOT.RDataFrame, seed: int = 0) -> Any:
+        """
+        Book the Poisson-bootstrap replicas of a histogram or profile plot, filled in the same event loop.
+
+        Each event enters replica r with a Poisson(1) weight drawn from a generator seeded by the event's entry
+        number and `seed`. The replicas are stored as one 2D result, named `<name>_replicas`, with the original
+        x binning on the x-axis and the replica index on the y-axis: a TH2D of weighted counts for histograms, a
+        TProfile2D of weighted means for profile plots. The columns must be scalars.
+
+        :param hist: A dictionary containing the histogram configuration, with 'bootstrap' the number of replicas.
+        :param df: The RDataFrame containing the columns.
+        :param seed: Seed of the bootstrap weights.
+        :return: The booked replicas, or None if the style is not supported or an error occurs.
+        """
+        n_replicas = int(hist['bootstrap'])
+        if hist['style'] not in ('histogram', 'profile_plot') or n_replicas < 2:
+            logger.warning(f"Bootstrap replicas need a 'histogram' or 'profile_plot' and at least 2 replicas. "
+                           f"No replicas created for {hist['name']}.")
+            return None
+
+        self._declare_bootstrap_helper()
+        name = f"{hist['name']}_replicas"
+        title = f"{hist['title']} (bootstrap replicas)"
+        x_column = hist['column'] if hist['style'] == 'histogram' else hist['x_column']
+        try:
+            replicas = df.Define(f"{name}_weights",
+                                 f"taAnalysis::PoissonWeights({n_replicas}, rdfentry_, {int(seed)}ULL)") \
+                .Define(f"{name}_index", f"taAnalysis::ReplicaIndices({n_replicas})") \
+                .Define(f"{name}_x", f"ROOT::RVec<double>({n_replicas}, {x_column})")
+            logger.info(f"Creating {n_replicas} bootstrap replicas of {hist['name']}")
+            if hist['style'] == 'histogram':
+                return replicas.Histo2D((name, title, hist['bins'], hist['min'], hist['max'], n_replicas, 0.,
+                                         float(n_replicas)), f"{name}_x", f"{name}_index", f"{name}_weights")
+            replicas = replicas.Define(f"{name}_y", f"ROOT::RVec<double>({n_replicas}, {hist['y_column']})")
+            x_bin_edges = hist.get('x_bin_edges', [])
+            if x_bin_edges:
+                x_bin_edges_vec = HistogramManager._convert_to_std_vector(x_bin_edges)
+                model = (name, title, len(x_bin_edges) - 1, x_bin_edges_vec.data(), n_replicas, 0., float(n_replicas))
+            else:
+                model = (name, title, hist['x_bins'], hist['x_min'], hist['x_max'], n_replicas, 0., float(n_replicas))
+            return replicas.Profile2D(model, f"{name}_x", f"{name}_index", f"{name}_y", f"{name}_weights")
+        except Exception as e:
+            logger.warning(f"Could not book bootstrap replicas of {hist['name']}. {str(e)}. No replicas created.")
+            return None
+
+    def _declare_bootstrap_helper(self) -> None:
+        """
+        Declare the C++ bootstrap weight functions to ROOT, once per session.
+        """
+        if not self.bootstrap_helper_declared:
+            dst.ROOT.gInterpreter.Declare(BOOTSTRAP_HELPER)
+            self.bootstrap_helper_declared = True
+
+    def finalize_bootstrap(self, hist_params: List[Dict], booked: List[Any], histograms: List[Any]) -> List[Any]:
+        """
+        Compute the per-bin bootstrap spreads of the histograms and profile plots with replicas.
+
+        For each entry, returns the replicas and a TH1D `<name>_bootstrap` with the nominal bin contents (counts,
+        or profile means) and the standard deviation over the replicas as errors. Replicas of a profile bin that
+        received no event do not count towards the spread.
+
+        :param hist_params: The histogram configurations with a 'bootstrap' entry, in booking order.
+        :param booked: The booked replicas returned by `create_bootstrap_replicas`, or filled ones (e.g. merged from
+            checkpoints).
+        :param histograms: The finalized histograms, searched by name for the nominal histograms.
+        :return: List of replica and spread histograms.
+        """
+        nominals = {histogram.GetName(): histogram for histogram in histograms if histogram}
+        results = []
+        for hist, result in zip(hist_params, booked):
+            if result is None:
+                continue
+            replicas = result.GetPtr() if hasattr(result, 'GetPtr') else result
+            results.append(replicas)
+            nominal = nominals.get(hist['name'])
+            if nominal is None:
+                continue
+
+            x_axis = replicas.GetXaxis()
+            n_bins, n_replicas = replicas.GetNbinsX(), replicas.GetNbinsY()
+            edges = np.array([x_axis.GetBinLowEdge(i + 1) for i in range(n_bins + 1)], dtype=np.float64)
+            spread = dst.ROOT.TH1D(f"{hist['name']}_bootstrap", f"{hist['title']} (bootstrap errors)", n_bins, edges)
+            spread.SetDirectory(0)
+            is_profile = replicas.InheritsFrom("TProfile2D")
+            for i in range(1, n_bins + 1):
+                values = [replicas.GetBinContent(i, r) for r in range(1, n_replicas + 1)
+                          if not is_profile or replicas.GetBinEntries(replicas.GetBin(i, r)) > 0]
+                spread.SetBinContent(i, nominal.GetBinContent(i))
+                spread.SetBinError(i, float(np.std(values, ddof=1)) if len(values) > 1 else 0.)
+            HistogramManager._set_histogram_parameters(hist, spread)
+            results.append(spread)
+        return results
+
+    @staticmethod
+    def _sparse_histogram_model(hist: Dict) -> dst.ROOT.THnSparseD:
+        """
+        Create the empty THnSparseD used as a model for filling.
+
+        Axes with 'bin_edges' get variable-width bins, in the same way as 'x_bin_edges' for profile plots.
+
+        :param hist: A dictionary containing the sparse histogram configuration.
+        :return: The model THnSparseD.
+        """
+        axes = hist['axes']
+        nbins = array('i', [len(axis['bin_edges']) - 1 if axis.get('bin_edges') else axis['bins'] for axis in axes])
+        xmin = array('d', [min(axis['bin_edges']) if axis.get('bin_edges') else axis['min'] for axis in axes])
+        xmax = array('d', [max(axis['bin_edges']) if axis.get('bin_edges') else axis['max'] for axis in axes])
+
+        model = dst.ROOT.THnSparseD(hist['name'], hist['title'], len(axes), nbins, xmin, xmax)
+        for i, axis in enumerate(axes):
+            if axis.get('bin_edges'):
+                bin_edges_vec = HistogramManager._convert_to_std_vector(axis['bin_edges'])
+                model.GetAxis(i).Set(len(axis['bin_edges']) - 1, bin_edges_vec.data())
+            model.GetAxis(i).SetTitle(axis.get('title', hist['columns'][i]))
+        return model
+
+    @staticmethod
+    def _project_sparse_histogram(hist: Dict, histogram: dst.ROOT.THnSparseD) -> List[dst.ROOT.TH1]:
+        """
+        Project a filled sparse histogram onto the configured one or two axes.
+
+        Projections are named `<name>_proj_<axes>`, e.g. `composition_proj_0_2` for the 2D projection with
+        axis 0 on x and axis 2 on y.
+
+        :param hist: A dictionary containing the sparse histogram configuration.
+        :param histogram: The filled THnSparseD.
+        :return: List of TH1D and TH2D projections.
+        """
+        projections = []
+        for dims in hist.get('projections') or []:
+            if len(dims) == 1:
+                projection = histogram.Projection(dims[0])
+            elif len(dims) == 2:
+                projection = histogram.Projection(dims[1], dims[0])
+            else:
+                logger.warning(f"Only 1D and 2D projections are supported. Skipping projection {dims}.")
+                continue
+            projection.SetName(f"{hist['name']}_proj_{'_'.join(str(dim) for dim in dims)}")
+            if not hist.get('show_stats', True):
+                projection.SetStats(0)
+            projections.append(projection)
+        return projections
 
     @staticmethod
     def _convert_to_std_vector(x_bin_edges: List[float]) -> dst.ROOT.std.vector('double'):
@@ -147,6 +466,20 @@ class HistogramManager:
             output_file = f"{self.output_dir}/{hist.GetName()}.root"
             self.save_histogram(hist, output_file)
 
+    def render_histograms(self, histograms: List[dst.ROOT.TH1F], hist_params: List[Dict], formats: List[str],
+                          n_workers: int = None) -> None:
+        """
+        Render the saved histograms to image files and a combined PDF in ROOT batch mode.
+
+        The histograms must have been saved with `save_histograms` first. See `PlotRenderer`.
+
+        :param histograms: List of histograms to be rendered.
+        :param hist_params: The 'hist_params' entries of the configuration, used for styling.
+        :param formats: Image formats to render (e.g. 'png', 'svg').
+        :param n_workers: Number of worker processes (default: number of CPUs).
+        """
+        PlotRenderer(self.output_dir, formats, n_workers).render(histograms, hist_params)
+
     @staticmethod
     def plot_histograms(histograms: List[dst.ROOT.TH1F]) -> None:
         """
@@ -157,7 +490,7 @@ class HistogramManager:
         logger.info("Plotting histograms...")
         canvas = dst.ROOT.TCanvas("canvas", "Analysis Results", 800, 600)
         for hist in histograms:
-            if hist:
+            if hist and hist.InheritsFrom("TH1"):
                 hist.Draw()
                 canvas.Update()
                 input("Press Enter to continue...")
\ No newline at end of file
@@ -1,4 +1,5 @@
 from typing import Dict, Any
+import re
 
 import dstpy as dst
 
@@ -9,14 +10,33 @@ class LibraryFunctionHandler:
     def __init__(self, user_class_instance: Any):
         self.user_class_instance = user_class_instance
 
+    def library_code(self, user_function: Dict) -> str:
+        """
+        Generate the C++ code of a user function with its library method, without declaring it to ROOT.
+
+        :param user_function: The 'user_functions' entry.
+        :return: The generated code, or an empty string if the library has no method for the callable.
+        """
+        func_call = user_function['callable']
+        if not func_call or not hasattr(self.user_class_instance, func_call):
+            return ""
+        func_args = user_function.get('args', [])
+        return getattr(self.user_class_instance, func_call)(*[str(arg['value']) for arg in func_args])
+
     def apply_library_function(self, user_function: Dict, df: dst.ROOT.RDataFrame) -> Dict[str, Any]:
         """
         Apply a user-defined function to the DataFrame to create a new column.
+
+        Arguments marked `constant: true` are passed to the library method that generates the C++ code (e.g. to
+        bake parameters into it) but not to the generated function in the column expression. If the generated code
+        defines a function named after the callable with a suffix (e.g. `sbParameter_1200_3` for baked constants),
+        the column expression calls that function.
         """
         new_column = user_function['new_column']
         func_call  = user_function['callable']
         func_args  = user_function.get('args', [])
         func_arg_list = [arg['value'] for arg in func_args]
+        call_arg_list = [str(arg['value']) for arg in func_args if not arg.get('constant')]
 
         if not func_call:
             logger.info(f"No function call found for {new_column}. Trying default methods...")
@@ -37,9 +57,11 @@ class LibraryFunctionHandler:
                 new_column_info = None
 
         elif hasattr(self.user_class_instance, func_call):
-            func = getattr(self.user_class_instance, func_call)
-            dst.ROOT.gInterpreter.Declare(func(*func_arg_list))
-            new_column_info = {'name': new_column, 'expression': f"{func_call}({', '.join(func_arg_list)})"}
+            code = self.library_code(user_function)
+            dst.ROOT.gInterpreter.Declare(code)
+            function_name = re.search(rf"\b({re.escape(func_call)}\w*)\s*\(", code)
+            function_name = function_name.group(1) if function_name else func_call
+            new_column_info = {'name': new_column, 'expression': f"{function_name}({', '.join(call_arg_list)})"}
 
         else:
             logger.warning(f"User function {func_call} not found. Column {new_column} not filled.")
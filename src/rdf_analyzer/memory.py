@@ -0,0 +1,230 @@
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+import resource
+import os
+import re
+
+from src.rdf_analyzer.utils import logger
+
+MEMORY_UNITS = {'': 1, 'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+
+# Heuristic memory use of one ROOT event-loop thread: decompressed input baskets of a cluster plus output buffers.
+BYTES_PER_THREAD = 256 * 2 ** 20
+
+# Checks the resident set size during the event loop, from C++, and warns once when it crosses the threshold.
+MEMORY_WATCH_HELPER = """
+#ifndef TAANALYSIS_MEMORY_WATCH_H
+#define TAANALYSIS_MEMORY_WATCH_H
+
+#include <fstream>
+#include <unistd.h>
+
+namespace taAnalysis {
+
+ULong64_t gMemoryWarningBytes = 0;
+std::atomic<bool> gMemoryWarned{false};
+
+ULong64_t CurrentRSSBytes() {
+    ULong64_t size = 0, resident = 0;
+    std::ifstream statm("/proc/self/statm");
+    statm >> size >> resident;
+    return resident * sysconf(_SC_PAGESIZE);
+}
+
+ROOT::RDF::RResultPtr<ULong64_t> WatchMemory(ROOT::RDF::RNode df, ULong64_t everyN) {
+    auto count = df.Count();
+    count.OnPartialResult(everyN, [](ULong64_t &) {
+        if (gMemoryWarningBytes == 0 || gMemoryWarned) {
+            return;
+        }
+        const ULong64_t rss = CurrentRSSBytes();
+        if (rss > gMemoryWarningBytes) {
+            gMemoryWarned = true;
+            ::Warning("taAnalysis", "Resident memory %.2f GB is close to the memory budget during the event loop.",
+                      rss / 1073741824.);
+        }
+    });
+    return count;
+}
+
+}
+
+#endif
+"""
+
+
+def parse_memory_size(size: str) -> int:
+    """
+    Parse a memory size such as '8GB', '512 MB' or '1000000'.
+
+    :param size: The memory size, in bytes or with a B/KB/MB/GB/TB unit (powers of 1024).
+    :return: The size in bytes.
+    :raises ValueError: If the size cannot be parsed.
+    """
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$", str(size).upper())
+    if not match:
+        raise ValueError(f"Invalid memory size: {size}")
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2)])
+
+
+def format_bytes(n_bytes: float) -> str:
+    """
+    Format a number of bytes with a binary unit.
+
+    :param n_bytes: The number of bytes.
+    :return: The formatted size, e.g. '1.5 GB'.
+    """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n_bytes) < 1024:
+            return f"{n_bytes:.1f} {unit}"
+        n_bytes /= 1024
+    return f"{n_bytes:.1f} TB"
+
+
+def current_rss() -> int:
+    """
+    Get the current resident set size of the process.
+
+    :return: The resident set size in bytes (the peak resident set size where /proc is not available).
+    """
+    try:
+        with open("/proc/self/statm", 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def peak_rss() -> int:
+    """
+    Get the peak resident set size of the process since start, or since the last `reset_peak_rss`.
+
+    :return: The peak resident set size in bytes.
+    """
+    try:
+        with open("/proc/self/status", 'r') as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss * 1024 if os.uname().sysname == "Linux" else max_rss
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the peak resident set size of the process to the current one (Linux only).
+
+    :return: True if the peak was reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", 'w') as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class MemoryMonitor:
+    def __init__(self, budget: Optional[int] = None, warning_fraction: float = 0.8):
+        """
+        Tracks the peak memory of the stages of a job and checks it against an optional memory budget.
+
+        :param budget: The memory budget in bytes (optional).
+        :param warning_fraction: Fraction of the budget above which a warning is logged.
+        """
+        self.budget = budget
+        self.warning_fraction = warning_fraction
+        self.stages: List[Tuple[str, int, int, int]] = []
+        self.peak_is_per_stage = True
+
+    @property
+    def warning_bytes(self) -> Optional[int]:
+        """
+        The resident memory above which a warning is logged, or None without a budget.
+        """
+        return int(self.budget * self.warning_fraction) if self.budget else None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Record the resident memory at the start and end of a stage and its peak during the stage.
+
+        :param name: Name of the stage.
+        """
+        self.peak_is_per_stage &= reset_peak_rss()
+        start = current_rss()
+        try:
+            yield
+        finally:
+            self.stages.append((name, start, current_rss(), peak_rss()))
+            self.check(name)
+
+    def check(self, context: str) -> None:
+        """
+        Warn if the resident memory is close to, or above, the memory budget.
+
+        :param context: Description of what the job is doing, for the warning message.
+        """
+        if not self.budget:
+            return
+        rss = max(current_rss(), self.stages[-1][3] if self.stages and self.stages[-1][0] == context else 0)
+        if rss > self.warning_bytes:
+            logger.warning(f"Memory use {format_bytes(rss)} during '{context}' is "
+                           f"{100. * rss / self.budget:.0f}% of the memory budget ({format_bytes(self.budget)}).")
+
+    def chunk_bytes(self, copies: int = 4) -> Optional[int]:
+        """
+        Get the size of a data chunk that fits the budget, given how many copies of it are alive at the same time
+        (e.g. compressed input, decompressed arrays, transformed arrays and output buffers).
+
+        :param copies: Number of chunk-sized buffers alive at the same time.
+        :return: The chunk size in bytes, or None without a budget.
+        """
+        if not self.budget:
+            return None
+        return max((self.budget - current_rss()) // copies, 2 ** 20)
+
+    def n_threads(self, max_threads: int) -> int:
+        """
+        Get the number of event-loop threads that fit in the memory budget.
+
+        :param max_threads: The maximum number of threads (e.g. the number of CPUs).
+        :return: The number of threads (at least one).
+        """
+        if not self.budget:
+            return max_threads
+        return max(1, min(max_threads, (self.budget // 2) // BYTES_PER_THREAD))
+
+    def snapshot_options(self, n_columns: int, n_threads: int = 1) -> Dict[str, int]:
+        """
+        Get the TTree flush and basket sizes of a snapshot that keep its buffers within a quarter of the budget.
+
+        :param n_columns: Number of columns written.
+        :param n_threads: Number of threads writing, each holding its own buffers.
+        :return: Dictionary with the 'auto_flush' size and the 'basket_size', in bytes (empty without a budget).
+        """
+        if not self.budget:
+            return {}
+        auto_flush = min(max(self.budget // (4 * max(n_threads, 1)), 2 ** 20), 256 * 2 ** 20)
+        basket_size = min(max(auto_flush // max(n_columns, 1), 4096), 2 ** 20)
+        return {'auto_flush': int(auto_flush), 'basket_size': int(basket_size)}
+
+    def print_report(self, sizes: Optional[Dict[str, int]] = None, top: int = 10) -> None:
+        """
+        Log the memory of each stage and the largest columns or arrays.
+
+        :param sizes: Sizes in bytes of the columns or arrays held by the job (optional).
+        :param top: Number of largest columns or arrays to list.
+        """
+        peak_label = "peak" if self.peak_is_per_stage else "peak since start"
+        logger.info("Memory report:")
+        for name, start, end, peak in self.stages:
+            logger.info(f"  {name:<25} start {format_bytes(start):>10}  end {format_bytes(end):>10}  "
+                        f"{peak_label} {format_bytes(peak):>10}")
+        if self.budget:
+            logger.info(f"  Memory budget: {format_bytes(self.budget)}")
+        if sizes:
+            logger.info("Largest columns/arrays:")
+            for name, n_bytes in sorted(sizes.items(), key=lambda item: item[1], reverse=True)[:top]:
+                logger.info(f"  {name:<40} {format_bytes(n_bytes):>10}")
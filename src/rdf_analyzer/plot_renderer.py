@@ -0,0 +1,192 @@
+from typing import Any, Dict, List, Optional, Tuple
+import multiprocessing
+import hashlib
+import json
+import os
+
+import dstpy as dst
+
+from src.rdf_analyzer.utils import logger
+
+# Optional drawing keys of 'hist_params' entries used by the batch renderer.
+STYLE_KEYS = ('x_title', 'y_title', 'show_stats', 'draw_options', 'log_x', 'log_y', 'log_z',
+              'line_color', 'fill_color', 'marker_style', 'marker_color', 'canvas_width', 'canvas_height')
+
+
+def apply_plot_style(canvas: Any, histogram: Any, style: Dict) -> str:
+    """
+    Apply the drawing parameters of a 'hist_params' entry to a canvas and a histogram.
+
+    :param canvas: The TCanvas the histogram is drawn on.
+    :param histogram: The histogram to draw.
+    :param style: The drawing keys of the 'hist_params' entry (see STYLE_KEYS).
+    :return: The draw option to use ('COLZ' by default for 2D histograms).
+    """
+    canvas.SetLogx(bool(style.get('log_x')))
+    canvas.SetLogy(bool(style.get('log_y')))
+    canvas.SetLogz(bool(style.get('log_z')))
+    if style.get('line_color') is not None:
+        histogram.SetLineColor(style['line_color'])
+    if style.get('fill_color') is not None:
+        histogram.SetFillColor(style['fill_color'])
+    if style.get('marker_style') is not None:
+        histogram.SetMarkerStyle(style['marker_style'])
+    if style.get('marker_color') is not None:
+        histogram.SetMarkerColor(style['marker_color'])
+    if style.get('draw_options'):
+        return style['draw_options']
+    return "COLZ" if histogram.GetDimension() == 2 else ""
+
+
+def render_plot(task: Tuple[str, str, Dict, str, List[str]]) -> str:
+    """
+    Render one saved histogram to image files, in ROOT batch mode. Runs in a worker process.
+
+    :param task: Tuple of (ROOT file, histogram name, style, plot directory, image formats).
+    :return: The name of the rendered histogram.
+    """
+    root_file, name, style, plot_dir, formats = task
+    dst.ROOT.gROOT.SetBatch(True)
+    file = dst.ROOT.TFile.Open(root_file)
+    histogram = file.Get(name)
+    if not histogram:
+        logger.warning(f"Histogram {name} not found in {root_file}. Not rendered.")
+        return name
+    canvas = dst.ROOT.TCanvas(f"canvas_{name}", name, style.get('canvas_width', 800),
+                              style.get('canvas_height', 600))
+    histogram.Draw(apply_plot_style(canvas, histogram, style))
+    for image_format in formats:
+        canvas.SaveAs(os.path.join(plot_dir, f"{name}.{image_format}"))
+    file.Close()
+    return name
+
+
+class PlotRenderer:
+    def __init__(self, output_dir: str, formats: List[str], n_workers: Optional[int] = None):
+        """
+        Renders saved histograms to image files and a combined PDF, without a display.
+
+        :param output_dir: Directory containing the saved histogram ROOT files. Plots go to its 'plots' subdirectory.
+        :param formats: Image formats to render (e.g. 'png', 'svg').
+        :param n_workers: Number of worker processes (default: number of CPUs).
+        """
+        self.output_dir = output_dir
+        self.plot_dir = os.path.join(output_dir, "plots")
+        self.formats = formats
+        self.n_workers = n_workers or os.cpu_count()
+        self.cache_file = os.path.join(self.plot_dir, "render_cache.json")
+
+    def render(self, histograms: List[Any], hist_params: List[Dict]) -> None:
+        """
+        Render every 1D and 2D histogram and profile to the image formats and to 'plots/all_plots.pdf'.
+
+        Histograms whose contents and style are unchanged since the last render are not rendered again. The images
+        are rendered in parallel worker processes; the combined PDF is written in this process, in the order of the
+        histograms.
+
+        :param histograms: The histograms returned by the analysis (saved to the output directory beforehand).
+        :param hist_params: The 'hist_params' entries of the configuration, used for styling.
+        """
+        os.makedirs(self.plot_dir, exist_ok=True)
+        plots = [(hist, self._style(hist.GetName(), hist_params)) for hist in histograms
+                 if hist and hist.InheritsFrom("TH1")]
+        cache = self._load_cache()
+        digests = {hist.GetName(): self._digest(hist, style) for hist, style in plots}
+
+        tasks = [(os.path.join(self.output_dir, f"{hist.GetName()}.root"), hist.GetName(), style, self.plot_dir,
+                  self.formats) for hist, style in plots if not self._is_current(hist.GetName(), digests, cache)]
+        logger.info(f"Rendering {len(tasks)} of {len(plots)} plots with {self.n_workers} workers...")
+        if tasks:
+            with multiprocessing.get_context("spawn").Pool(min(self.n_workers, len(tasks))) as pool:
+                for name in pool.imap_unordered(render_plot, tasks):
+                    logger.debug(f"Rendered {name}")
+
+        pdf_file = os.path.join(self.plot_dir, "all_plots.pdf")
+        if tasks or digests != cache or not os.path.exists(pdf_file):
+            self._render_pdf(plots, pdf_file)
+        self._save_cache(digests)
+
+    @staticmethod
+    def _style(name: str, hist_params: List[Dict]) -> Dict:
+        """
+        Find the drawing keys of the 'hist_params' entry a histogram was created from.
+
+        Projections of sparse histograms ('<name>_proj_<axes>') use the entry of their sparse histogram.
+
+        :param name: The histogram name.
+        :param hist_params: The 'hist_params' entries of the configuration.
+        :return: The drawing keys of the matching entry, or an empty dictionary.
+        """
+        for hist in hist_params:
+            if name == hist['name'] or name.startswith(f"{hist['name']}_proj_"):
+                return {key: hist[key] for key in STYLE_KEYS if hist.get(key) is not None}
+        return {}
+
+    def _digest(self, histogram: Any, style: Dict) -> str:
+        """
+        Compute a digest of the histogram contents, style and output formats.
+
+        :param histogram: The histogram.
+        :param style: Its drawing keys.
+        :return: Hexadecimal SHA-1 digest.
+        """
+        n_cells = histogram.GetNcells()
+        contents = [histogram.GetBinContent(i) for i in range(n_cells)]
+        errors = [histogram.GetBinError(i) for i in range(n_cells)]
+        content = json.dumps([histogram.GetTitle(), histogram.GetEntries(), contents, errors, style, self.formats],
+                             sort_keys=True, default=str)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def _is_current(self, name: str, digests: Dict[str, str], cache: Dict[str, str]) -> bool:
+        """
+        Check whether the rendered images of a histogram are up to date.
+
+        :param name: The histogram name.
+        :param digests: Current digests of the histograms.
+        :param cache: Digests of the last render.
+        :return: True if the histogram does not need to be rendered again.
+        """
+        return cache.get(name) == digests[name] and all(
+            os.path.exists(os.path.join(self.plot_dir, f"{name}.{image_format}")) for image_format in self.formats)
+
+    @staticmethod
+    def _render_pdf(plots: List[Tuple[Any, Dict]], pdf_file: str) -> None:
+        """
+        Draw all histograms into a multi-page PDF, one page per histogram.
+
+        :param plots: The histograms with their drawing keys.
+        :param pdf_file: Path to the PDF file.
+        """
+        if not plots:
+            return
+        was_batch = dst.ROOT.gROOT.IsBatch()
+        dst.ROOT.gROOT.SetBatch(True)
+        canvas = dst.ROOT.TCanvas("canvas_pdf", "Analysis Results", 800, 600)
+        canvas.Print(f"{pdf_file}[")
+        for hist, style in plots:
+            hist.Draw(apply_plot_style(canvas, hist, style))
+            canvas.Print(pdf_file, f"Title:{hist.GetName()}")
+        canvas.Print(f"{pdf_file}]")
+        canvas.Close()
+        dst.ROOT.gROOT.SetBatch(was_batch)
+        logger.info(f"Saved plots to {pdf_file}")
+
+    def _load_cache(self) -> Dict[str, str]:
+        """
+        Load the digests of the last render.
+
+        :return: Dictionary of histogram names to digests (empty if there is no cache).
+        """
+        if not os.path.exists(self.cache_file):
+            return {}
+        with open(self.cache_file, 'r') as file:
+            return json.load(file)
+
+    def _save_cache(self, digests: Dict[str, str]) -> None:
+        """
+        Save the digests of this render.
+
+        :param digests: Dictionary of histogram names to digests.
+        """
+        with open(self.cache_file, 'w') as file:
+            json.dump(digests, file, indent=2)
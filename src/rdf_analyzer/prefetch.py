@@ -0,0 +1,106 @@
+from typing import Any, Iterable, Iterator, Optional
+import threading
+import queue
+import time
+
+from src.rdf_analyzer.utils import logger
+
+# Chunk size used when prefetching without a memory budget.
+DEFAULT_PREFETCH_CHUNK_BYTES = 128 * 2 ** 20
+
+_END = object()
+
+
+class Prefetcher:
+    def __init__(self, chunks: Iterable[Any], depth: int = 2, name: str = "read"):
+        """
+        Reads the chunks of an iterable on a background thread, up to `depth` chunks ahead of the consumer.
+
+        Reading and decompressing the next chunk (uproot baskets, Parquet row groups) then overlaps with the
+        transformation and writing of the current one. The time the consumer waits for a chunk is the I/O stall.
+
+        :param chunks: The chunks to read, e.g. `tree.iterate(...)` or a generator of Parquet row groups.
+        :param depth: Maximum number of chunks read ahead (the size of the bounded queue).
+        :param name: Name of the stage, for the report.
+        """
+        self.chunks = chunks
+        self.depth = max(depth, 1)
+        self.name = name
+        self.stall_time = 0.
+        self.read_time = 0.
+        self.n_chunks = 0
+        self._queue: Optional[queue.Queue] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __iter__(self) -> Iterator[Any]:
+        """
+        Start the background thread and yield the chunks as they are read. A prefetcher can only be iterated once.
+
+        :raises RuntimeError: If the prefetcher was already iterated.
+        """
+        if self._queue is not None:
+            raise RuntimeError(f"Prefetcher '{self.name}' was already iterated. Create a new one to read again.")
+        self._queue = queue.Queue(maxsize=self.depth)
+        self._thread = threading.Thread(target=self._read, name=f"prefetch-{self.name}", daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                start = time.perf_counter()
+                item = self._queue.get()
+                self.stall_time += time.perf_counter() - start
+                if item is _END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                self.n_chunks += 1
+                yield item
+        finally:
+            self.close()
+
+    def _read(self) -> None:
+        """
+        Read the chunks into the queue, then put the end marker (or the exception that stopped the reading).
+        """
+        try:
+            iterator = iter(self.chunks)
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    break
+                self.read_time += time.perf_counter() - start
+                self._put(chunk)
+            self._put(_END)
+        except BaseException as e:
+            self._put(e)
+
+    def _put(self, item: Any) -> None:
+        """
+        Put an item into the queue, waiting for a free slot unless the consumer has stopped.
+
+        :param item: The chunk, end marker or exception.
+        """
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self) -> None:
+        """
+        Stop the background thread, e.g. when the consumer stops early.
+        """
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+            self._thread = None
+
+    def print_report(self) -> None:
+        """
+        Log the read time and the time the consumer stalled waiting for data.
+        """
+        logger.info(f"Prefetch '{self.name}': {self.n_chunks} chunks, queue depth {self.depth}, "
+                    f"read {self.read_time:.2f} s in background, stalled on I/O {self.stall_time:.2f} s")
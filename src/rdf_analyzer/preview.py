@@ -0,0 +1,73 @@
+from typing import List, Optional, Tuple
+import random
+
+from src.rdf_analyzer.data_frame_manager import DataFrameManager
+from src.rdf_analyzer.utils import logger
+
+
+class PreviewSampler:
+    def __init__(self, n_entries: Optional[int] = None, fraction: Optional[float] = None, seed: int = 0):
+        """
+        Selects the input entries processed in preview mode.
+
+        :param n_entries: Process the first N entries (takes precedence over 'fraction').
+        :param fraction: Process this fraction of the input clusters, chosen at random over all clusters and files.
+        :param seed: Seed of the cluster selection. The same seed always selects the same clusters.
+        """
+        self.n_entries = n_entries
+        self.fraction = fraction
+        self.seed = seed
+
+    def entry_ranges(self, df_manager: DataFrameManager) -> List[Tuple[int, int]]:
+        """
+        Get the entry ranges to process, within the entry ranges already selected in the DataFrameManager.
+
+        :param df_manager: The DataFrameManager of the analysis.
+        :return: List of [start, stop) entry ranges.
+        """
+        current_ranges = df_manager.entry_ranges
+        if current_ranges is None:
+            current_ranges = [(0, df_manager.n_input_entries())]
+
+        if self.n_entries is not None:
+            return self.first_entries(current_ranges, self.n_entries)
+
+        clusters = df_manager.intersect_entry_ranges(current_ranges, df_manager.cluster_ranges())
+        selected = self._sample_clusters(clusters, self.fraction, self.seed)
+        logger.info(f"Preview: selected {len(selected)} of {len(clusters)} clusters (seed {self.seed})")
+        return selected
+
+    @staticmethod
+    def first_entries(entry_ranges: List[Tuple[int, int]], n_entries: int) -> List[Tuple[int, int]]:
+        """
+        Truncate a list of entry ranges to its first N entries.
+
+        :param entry_ranges: Sorted list of [start, stop) entry ranges.
+        :param n_entries: Number of entries to keep.
+        :return: List of [start, stop) entry ranges containing at most N entries.
+        """
+        selected = []
+        for start, stop in entry_ranges:
+            if n_entries <= 0:
+                break
+            selected.append((start, min(stop, start + n_entries)))
+            n_entries -= stop - start
+        return selected
+
+    @staticmethod
+    def _sample_clusters(clusters: List[Tuple[int, int]], fraction: float, seed: int) -> List[Tuple[int, int]]:
+        """
+        Select each cluster with the given probability, using a seeded random number generator.
+
+        At least one cluster is always selected.
+
+        :param clusters: List of [start, stop) cluster entry ranges.
+        :param fraction: Probability of selecting a cluster.
+        :param seed: Seed of the random number generator.
+        :return: The selected clusters.
+        """
+        rng = random.Random(seed)
+        selected = [cluster for cluster in clusters if rng.random() < fraction]
+        if not selected and clusters:
+            selected = [rng.choice(clusters)]
+        return selected
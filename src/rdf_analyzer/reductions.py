@@ -0,0 +1,137 @@
+import dstpy as dst
+
+from src.rdf_analyzer.utils import logger
+
+# Fused reductions over RVec and nested-vector columns. All statistics of a vector are computed together, with
+# branch-free max/argmax updates and split accumulators that vectorize, and nested vectors are reduced into
+# preallocated RVec outputs.
+REDUCTIONS_HELPER = """
+#ifndef TAANALYSIS_REDUCTIONS_H
+#define TAANALYSIS_REDUCTIONS_H
+
+#include <algorithm>
+#include <cmath>
+#include <limits>
+#include <vector>
+
+namespace taReductions {
+
+struct Summary {
+    double max = std::numeric_limits<double>::lowest();
+    int argmax = -1;
+    double sum = 0.;
+    double mean = 0.;
+    double rms = 0.;
+    double stddev = 0.;
+    unsigned int count = 0;
+};
+
+// Sum with four independent accumulators, which lets the compiler vectorize the loop without reordering
+// floating-point additions itself.
+template <typename T>
+double Sum(const T *values, std::size_t n) {
+    double s[4] = {0., 0., 0., 0.};
+    std::size_t i = 0;
+    for (; i + 4 <= n; i += 4) {
+        for (std::size_t k = 0; k < 4; ++k) {
+            s[k] += values[i + k];
+        }
+    }
+    for (; i < n; ++i) {
+        s[0] += values[i];
+    }
+    return (s[0] + s[1]) + (s[2] + s[3]);
+}
+
+// max, argmax, sum, mean, RMS, standard deviation and count of a vector, in one pass over four independent lanes.
+template <typename T>
+Summary Summarize(const T *values, std::size_t n) {
+    Summary summary;
+    if (n == 0) {
+        return summary;
+    }
+    double s[4] = {0., 0., 0., 0.};
+    double q[4] = {0., 0., 0., 0.};
+    double m[4] = {double(values[0]), double(values[0]), double(values[0]), double(values[0])};
+    std::size_t a[4] = {0, 0, 0, 0};
+    std::size_t i = 0;
+    for (; i + 4 <= n; i += 4) {
+        for (std::size_t k = 0; k < 4; ++k) {
+            const double value = values[i + k];
+            const bool greater = value > m[k];
+            m[k] = greater ? value : m[k];
+            a[k] = greater ? i + k : a[k];
+            s[k] += value;
+            q[k] += value * value;
+        }
+    }
+    for (; i < n; ++i) {
+        const double value = values[i];
+        const bool greater = value > m[0];
+        m[0] = greater ? value : m[0];
+        a[0] = greater ? i : a[0];
+        s[0] += value;
+        q[0] += value * value;
+    }
+    // Combine the lanes; ties go to the first index, as with std::max_element.
+    for (std::size_t k = 1; k < 4; ++k) {
+        if (m[k] > m[0] || (m[k] == m[0] && a[k] < a[0])) {
+            m[0] = m[k];
+            a[0] = a[k];
+        }
+    }
+    const double sum = (s[0] + s[1]) + (s[2] + s[3]);
+    const double sumSquares = (q[0] + q[1]) + (q[2] + q[3]);
+    summary.max = m[0];
+    summary.argmax = static_cast<int>(a[0]);
+    summary.sum = sum;
+    summary.count = n;
+    summary.mean = sum / n;
+    summary.rms = std::sqrt(sumSquares / n);
+    summary.stddev = std::sqrt(std::max(sumSquares / n - summary.mean * summary.mean, 0.));
+    return summary;
+}
+
+template <typename T>
+Summary Summarize(const ROOT::RVec<T> &values) {
+    return Summarize(values.data(), values.size());
+}
+
+template <typename T>
+Summary Summarize(const std::vector<T> &values) {
+    return Summarize(values.data(), values.size());
+}
+
+// One summary per inner vector.
+template <typename Nested>
+ROOT::RVec<Summary> SummarizeEach(const Nested &vectors) {
+    ROOT::RVec<Summary> summaries(vectors.size());
+    for (std::size_t i = 0; i < vectors.size(); ++i) {
+        summaries[i] = Summarize(vectors[i].data(), vectors[i].size());
+    }
+    return summaries;
+}
+
+// Mean of each inner vector (0 for empty vectors).
+template <typename Nested>
+ROOT::RVec<double> MeanOfEach(const Nested &vectors) {
+    ROOT::RVec<double> means(vectors.size());
+    for (std::size_t i = 0; i < vectors.size(); ++i) {
+        const auto &inner = vectors[i];
+        means[i] = inner.empty() ? 0. : Sum(inner.data(), inner.size()) / inner.size();
+    }
+    return means;
+}
+
+}
+
+#endif
+"""
+
+
+def declare_reductions() -> None:
+    """
+    Declare the fused reductions (`taReductions` namespace) to ROOT.
+    """
+    dst.ROOT.gInterpreter.Declare(REDUCTIONS_HELPER)
+    logger.debug("Declared fused reductions")
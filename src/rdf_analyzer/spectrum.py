@@ -0,0 +1,271 @@
+from typing import Dict, Any, List, Optional
+import hashlib
+import glob
+import json
+import os
+
+import numpy as np
+import dstpy as dst
+
+from src.rdf_analyzer.utils import logger
+
+
+def spectrum_bin_edges(spectrum: Dict[str, Any]) -> List[float]:
+    """
+    Get the log10(E/eV) bin edges of a 'spectrum' configuration: 'bin_edges', or 'bins' equal bins from 'min' to 'max'.
+
+    :param spectrum: The 'spectrum' configuration.
+    :return: Sorted list of bin edges.
+    """
+    if spectrum.get('bin_edges'):
+        return sorted(float(edge) for edge in spectrum['bin_edges'])
+    return np.linspace(spectrum['min'], spectrum['max'], spectrum['bins'] + 1).tolist()
+
+
+class ExposureTable:
+    def __init__(self, key: str, bin_edges: List[float], exposure: List[float]):
+        """
+        Exposure of a detector configuration in log10(E/eV) bins.
+
+        :param key: The cache key of the table (see `cache_key`).
+        :param bin_edges: The log10(E/eV) bin edges.
+        :param exposure: The exposure of each bin, in m^2 sr s.
+        """
+        self.key = key
+        self.bin_edges = bin_edges
+        self.exposure = exposure
+
+    @staticmethod
+    def cache_key(detector: Dict[str, Any], bin_edges: List[float], exposure_config: Dict[str, Any]) -> str:
+        """
+        Compute the key of an exposure table from everything it depends on: the detector configuration, the energy
+        binning, the exposure configuration, and the size and modification time of the MC files and of the
+        precomputed table.
+
+        :param detector: The detector configuration.
+        :param bin_edges: The log10(E/eV) bin edges.
+        :param exposure_config: The 'exposure' entry of the 'spectrum' configuration.
+        :return: Hexadecimal SHA-1 digest.
+        """
+        mc_files = [(path, os.path.getsize(path), os.path.getmtime(path))
+                    for path in sorted(glob.glob(exposure_config.get('mc_file') or ''))]
+        table_files = [(path, os.path.getsize(path), os.path.getmtime(path))
+                       for path in [exposure_config.get('table')] if path and os.path.exists(path)]
+        content = json.dumps([detector, [round(edge, 9) for edge in bin_edges], exposure_config, mc_files,
+                              table_files], sort_keys=True, default=str)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    @staticmethod
+    def load_or_compute(detector: Dict[str, Any], bin_edges: List[float], exposure_config: Dict[str, Any],
+                        cache_dir: str) -> 'ExposureTable':
+        """
+        Load the exposure table from the cache, or compute it and add it to the cache.
+
+        :param detector: The detector configuration.
+        :param bin_edges: The log10(E/eV) bin edges.
+        :param exposure_config: The 'exposure' entry of the 'spectrum' configuration.
+        :param cache_dir: Directory of the cached exposure tables.
+        :return: The exposure table.
+        """
+        key = ExposureTable.cache_key(detector, bin_edges, exposure_config)
+        cache_file = os.path.join(cache_dir, f"exposure_{key}.json")
+        if os.path.exists(cache_file):
+            logger.info(f"Using cached exposure table {cache_file}")
+            return ExposureTable.load(cache_file)
+
+        table = ExposureTable.compute(key, bin_edges, exposure_config)
+        os.makedirs(cache_dir, exist_ok=True)
+        table.save(cache_file)
+        return table
+
+    @staticmethod
+    def validate(exposure_config: Dict[str, Any]) -> None:
+        """
+        Check that an exposure configuration has either a 'table' or numeric 'aperture' and 'livetime' (and an
+        'mc_energy' with an 'mc_file'), before any event loop runs.
+
+        :param exposure_config: The 'exposure' entry of the 'spectrum' configuration.
+        :raises ValueError: If the configuration cannot be used to compute the exposure.
+        """
+        if exposure_config.get('table'):
+            if not os.path.exists(exposure_config['table']):
+                raise ValueError(f"Exposure table {exposure_config['table']} not found.")
+            return
+        for parameter in ('aperture', 'livetime'):
+            try:
+                float(exposure_config[parameter])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f"The spectrum 'exposure' needs a 'table' file, or numeric 'aperture' (m^2 sr) and "
+                                 f"'livetime' (s); got {parameter}: {exposure_config.get(parameter)!r}.") from None
+        if exposure_config.get('mc_file') and not exposure_config.get('mc_energy'):
+            raise ValueError("The spectrum 'exposure' needs an 'mc_energy' expression with an 'mc_file'.")
+
+    @staticmethod
+    def compute(key: str, bin_edges: List[float], exposure_config: Dict[str, Any]) -> 'ExposureTable':
+        """
+        Compute the exposure in each energy bin.
+
+        The exposure is read from a precomputed 'table' file, or computed as 'aperture' (thrown aperture, m^2 sr)
+        times 'livetime' (s), times the reconstruction efficiency in each bin if an MC sample is given: the fraction
+        of thrown events ('mc_energy' of the 'mc_tree' in 'mc_file') that pass the 'mc_cuts'.
+
+        :param key: The cache key of the table.
+        :param bin_edges: The log10(E/eV) bin edges.
+        :param exposure_config: The 'exposure' entry of the 'spectrum' configuration.
+        :return: The exposure table.
+        """
+        if exposure_config.get('table'):
+            table = ExposureTable.load(exposure_config['table'])
+            exposure = np.interp(0.5 * (np.array(bin_edges[:-1]) + np.array(bin_edges[1:])),
+                                 0.5 * (np.array(table.bin_edges[:-1]) + np.array(table.bin_edges[1:])),
+                                 table.exposure)
+            return ExposureTable(key, bin_edges, exposure.tolist())
+
+        exposure = np.full(len(bin_edges) - 1, float(exposure_config['aperture']) * float(exposure_config['livetime']))
+        if exposure_config.get('mc_file'):
+            exposure *= ExposureTable._efficiency(bin_edges, exposure_config)
+        logger.info(f"Computed exposure table for {len(bin_edges) - 1} energy bins")
+        return ExposureTable(key, bin_edges, exposure.tolist())
+
+    @staticmethod
+    def _efficiency(bin_edges: List[float], exposure_config: Dict[str, Any]) -> np.ndarray:
+        """
+        Compute the reconstruction efficiency in each energy bin from an MC sample, in one event loop.
+
+        :param bin_edges: The log10(E/eV) bin edges.
+        :param exposure_config: The 'exposure' entry of the 'spectrum' configuration.
+        :return: Array of efficiencies (0 where no events were thrown).
+        """
+        edges = np.array(bin_edges, dtype=np.float64)
+        model = ("mc_exposure", "mc_exposure", len(edges) - 1, edges)
+        df = dst.ROOT.RDataFrame(exposure_config.get('mc_tree', 'taTree'), exposure_config['mc_file'])
+        df = df.Define("mc_log10_energy", exposure_config['mc_energy'])
+        passed = df
+        for cut in exposure_config.get('mc_cuts') or []:
+            passed = passed.Filter(cut)
+        thrown_hist = df.Histo1D(model, "mc_log10_energy")
+        passed_hist = passed.Histo1D(model, "mc_log10_energy")
+
+        thrown = np.array([thrown_hist.GetBinContent(i + 1) for i in range(len(edges) - 1)])
+        accepted = np.array([passed_hist.GetBinContent(i + 1) for i in range(len(edges) - 1)])
+        return np.divide(accepted, thrown, out=np.zeros_like(thrown), where=thrown > 0)
+
+    def save(self, output_file: str) -> None:
+        """
+        Save the exposure table to a JSON file.
+
+        :param output_file: Path to the JSON file.
+        """
+        with open(output_file, 'w') as file:
+            json.dump({'key': self.key, 'bin_edges': self.bin_edges, 'exposure': self.exposure}, file, indent=2)
+        logger.info(f"Saved exposure table to {output_file}")
+
+    @staticmethod
+    def load(table_file: str) -> 'ExposureTable':
+        """
+        Load an exposure table from a JSON file with 'bin_edges' and 'exposure' lists.
+
+        :param table_file: Path to the JSON file.
+        :return: The exposure table.
+        """
+        with open(table_file, 'r') as file:
+            content = json.load(file)
+        return ExposureTable(content.get('key', ''), content['bin_edges'], content['exposure'])
+
+
+class SpectrumCalculator:
+    def __init__(self, spectrum: Dict[str, Any], detector: Dict[str, Any], output_dir: str,
+                 cache_dir: Optional[str] = None):
+        """
+        Fills a log10(E/eV) histogram in the analysis event loop and divides it by the exposure of the detector.
+
+        :param spectrum: The 'spectrum' configuration.
+        :param detector: The detector configuration.
+        :param output_dir: Directory of the spectrum table.
+        :param cache_dir: Directory of the cached exposure tables, unless 'cache_dir' is configured
+            (default: the 'exposure_cache' subdirectory of output_dir).
+        :raises ValueError: If the 'exposure' configuration is incomplete (see `ExposureTable.validate`).
+        """
+        self.spectrum = spectrum
+        self.detector = detector
+        self.output_dir = output_dir
+        self.name = spectrum.get('name', 'spectrum')
+        self.bin_edges = spectrum_bin_edges(spectrum)
+        self.cache_dir = spectrum.get('cache_dir') or cache_dir or os.path.join(output_dir, "exposure_cache")
+        ExposureTable.validate(spectrum.get('exposure') or {})
+
+    def book(self, df: dst.ROOT.RDataFrame) -> Any:
+        """
+        Book the event-count histogram in log10(E/eV) bins.
+
+        :param df: The RDataFrame of selected events.
+        :return: The booked histogram.
+        """
+        edges = np.array(self.bin_edges, dtype=np.float64)
+        logger.info(f"Creating spectrum histogram for {self.spectrum['column']}")
+        return df.Histo1D((f"{self.name}_counts", "Event counts;log_{10}(E/eV);Events", len(edges) - 1, edges),
+                          self.spectrum['column'])
+
+    def finalize(self, booked: Any) -> List[Any]:
+        """
+        Compute the flux J and E^3 J with their statistical errors, and write them to '<name>.txt'.
+
+        With N events in a bin of width dE (in eV) and exposure X (m^2 sr s), J = N / (X dE) in eV^-1 m^-2 sr^-1 s^-1
+        and E^3 J is evaluated at the logarithmic bin center, in eV^2 m^-2 sr^-1 s^-1. Errors are Poissonian.
+
+        :param booked: The booked event-count histogram, or the filled one (e.g. merged from checkpoints).
+        :return: The event-count, exposure, flux and E^3 J histograms.
+        """
+        counts_hist = booked.GetPtr() if hasattr(booked, 'GetPtr') else booked
+        exposure = np.array(ExposureTable.load_or_compute(self.detector, self.bin_edges,
+                                                          self.spectrum.get('exposure') or {},
+                                                          self.cache_dir).exposure)
+        edges = np.array(self.bin_edges)
+        counts = np.array([counts_hist.GetBinContent(i + 1) for i in range(len(edges) - 1)])
+        energy = 10 ** (0.5 * (edges[:-1] + edges[1:]))
+        denominator = exposure * (10 ** edges[1:] - 10 ** edges[:-1])
+        flux = np.divide(counts, denominator, out=np.zeros_like(counts), where=denominator > 0)
+        flux_error = np.divide(np.sqrt(counts), denominator, out=np.zeros_like(counts), where=denominator > 0)
+        e3j, e3j_error = energy ** 3 * flux, energy ** 3 * flux_error
+
+        histograms = [counts_hist,
+                      self._histogram("exposure", "Exposure;log_{10}(E/eV);Exposure [m^{2} sr s]", exposure),
+                      self._histogram("flux", "Flux;log_{10}(E/eV);J [eV^{-1} m^{-2} sr^{-1} s^{-1}]", flux,
+                                      flux_error),
+                      self._histogram("e3j", "E^{3}J;log_{10}(E/eV);E^{3}J [eV^{2} m^{-2} sr^{-1} s^{-1}]", e3j,
+                                      e3j_error)]
+        self._write_table(counts, exposure, flux, flux_error, e3j, e3j_error)
+        return histograms
+
+    def _histogram(self, quantity: str, title: str, values: np.ndarray,
+                   errors: Optional[np.ndarray] = None) -> dst.ROOT.TH1D:
+        """
+        Create a histogram in the spectrum binning from per-bin values.
+
+        :param quantity: Suffix of the histogram name.
+        :param title: Histogram and axis titles.
+        :param values: The value of each bin.
+        :param errors: The error of each bin (default: 0).
+        :return: The histogram.
+        """
+        edges = np.array(self.bin_edges, dtype=np.float64)
+        histogram = dst.ROOT.TH1D(f"{self.name}_{quantity}", title, len(edges) - 1, edges)
+        histogram.SetDirectory(0)
+        for i, value in enumerate(values):
+            histogram.SetBinContent(i + 1, value)
+            histogram.SetBinError(i + 1, errors[i] if errors is not None else 0.)
+        histogram.SetStats(0)
+        return histogram
+
+    def _write_table(self, *columns: np.ndarray) -> None:
+        """
+        Write the spectrum table, one row per energy bin.
+
+        :param columns: Counts, exposure, flux, flux error, E^3 J and E^3 J error of each bin.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        output_file = os.path.join(self.output_dir, f"{self.name}.txt")
+        header = "log10E_low log10E_high counts exposure_m2srs J J_err E3J E3J_err"
+        table = np.column_stack([self.bin_edges[:-1], self.bin_edges[1:], *columns])
+        np.savetxt(output_file, table, header=header, fmt="%.6g")
+        logger.info(f"Saved spectrum table to {output_file}")
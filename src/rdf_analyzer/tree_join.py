@@ -0,0 +1,206 @@
+from typing import Dict, Any, List
+import hashlib
+import glob
+import json
+import os
+
+import numpy as np
+import dstpy as dst
+
+from src.rdf_analyzer.utils import logger
+
+# Time-sorted tables of secondary trees, looked up by binary search from the primary event loop. Each table holds the
+# event times of a secondary tree and the values of its joined columns, in time order.
+TREE_JOIN_HELPER = """
+#ifndef TAANALYSIS_TREE_JOIN_H
+#define TAANALYSIS_TREE_JOIN_H
+
+#include <algorithm>
+#include <cmath>
+#include <iterator>
+#include <limits>
+#include <vector>
+
+namespace taJoin {
+
+struct Table {
+    std::vector<double> times;
+    std::vector<std::vector<double>> values;
+    double tolerance = 0.;
+};
+
+std::vector<Table> gTables;
+
+void SetTable(unsigned int id, const double *times, std::size_t n, unsigned int nColumns, double tolerance) {
+    if (gTables.size() <= id) {
+        gTables.resize(id + 1);
+    }
+    gTables[id].times.assign(times, times + n);
+    gTables[id].values.assign(nColumns, std::vector<double>());
+    gTables[id].tolerance = tolerance;
+}
+
+void SetColumn(unsigned int id, unsigned int column, const double *values, std::size_t n) {
+    gTables[id].values[column].assign(values, values + n);
+}
+
+// Index of the secondary event nearest in time, or -1 if none is within the tolerance.
+Long64_t Match(unsigned int id, double time) {
+    const auto &table = gTables[id];
+    const auto it = std::lower_bound(table.times.begin(), table.times.end(), time);
+    Long64_t best = -1;
+    double bestDistance = table.tolerance;
+    if (it != table.times.end() && *it - time <= bestDistance) {
+        best = it - table.times.begin();
+        bestDistance = *it - time;
+    }
+    if (it != table.times.begin() && time - *std::prev(it) <= bestDistance) {
+        best = std::prev(it) - table.times.begin();
+    }
+    return best;
+}
+
+double Value(unsigned int id, unsigned int column, Long64_t index) {
+    return index < 0 ? std::numeric_limits<double>::quiet_NaN() : gTables[id].values[column][index];
+}
+
+double TimeDifference(unsigned int id, double time, Long64_t index) {
+    return index < 0 ? std::numeric_limits<double>::quiet_NaN() : time - gTables[id].times[index];
+}
+
+}
+
+#endif
+"""
+
+
+def join_columns(join: Dict[str, Any], join_id: int) -> List[Dict[str, str]]:
+    """
+    Get the column definitions of a join: '<name>_index' (index of the matched secondary event, -1 if none),
+    '<name>_matched', '<name>_dt' (primary minus secondary time) and the joined columns.
+
+    :param join: A 'joins' entry of the configuration.
+    :param join_id: The position of the join in the configuration.
+    :return: List of {'name': ..., 'expression': ...} definitions, in definition order.
+    """
+    name = join['name']
+    columns = [{'name': f"{name}_index", 'expression': f"taJoin::Match({join_id}, {join['primary_time']})"},
+               {'name': f"{name}_matched", 'expression': f"{name}_index >= 0"},
+               {'name': f"{name}_dt",
+                'expression': f"taJoin::TimeDifference({join_id}, {join['primary_time']}, {name}_index)"}]
+    for column_id, column in enumerate(join.get('columns') or []):
+        columns.append({'name': column['name'],
+                        'expression': f"taJoin::Value({join_id}, {column_id}, {name}_index)"})
+    return columns
+
+
+class JoinIndex:
+    def __init__(self, key: str, times: np.ndarray, values: Dict[str, np.ndarray]):
+        """
+        Time-sorted index of a secondary tree: the event times and the values of the joined columns.
+
+        :param key: The cache key of the index (see `cache_key`).
+        :param times: The sorted event times.
+        :param values: The joined column values, in time order.
+        """
+        self.key = key
+        self.times = times
+        self.values = values
+
+    @staticmethod
+    def cache_key(join: Dict[str, Any]) -> str:
+        """
+        Compute the key of an index from everything it depends on: the join configuration and the size and
+        modification time of the secondary input files.
+
+        :param join: A 'joins' entry of the configuration.
+        :return: Hexadecimal SHA-1 digest.
+        """
+        input_files = [(path, os.path.getsize(path), os.path.getmtime(path))
+                       for path in sorted(glob.glob(join['input_file']))]
+        content = json.dumps([join, input_files], sort_keys=True, default=str)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    @staticmethod
+    def load_or_build(join: Dict[str, Any], cache_dir: str) -> 'JoinIndex':
+        """
+        Load the index from the cache, or build it from the secondary tree and add it to the cache.
+
+        :param join: A 'joins' entry of the configuration.
+        :param cache_dir: Directory of the cached indices.
+        :return: The index.
+        """
+        key = JoinIndex.cache_key(join)
+        cache_file = os.path.join(cache_dir, f"join_{join['name']}_{key}.npz")
+        if os.path.exists(cache_file):
+            logger.info(f"Using cached join index {cache_file}")
+            return JoinIndex.load(cache_file)
+
+        index = JoinIndex.build(key, join)
+        os.makedirs(cache_dir, exist_ok=True)
+        index.save(cache_file)
+        return index
+
+    @staticmethod
+    def build(key: str, join: Dict[str, Any]) -> 'JoinIndex':
+        """
+        Read the event times and joined column values of the secondary tree in one event loop, and sort them by
+        time. The joined columns must be scalars.
+
+        :param key: The cache key of the index.
+        :param join: A 'joins' entry of the configuration.
+        :return: The index.
+        """
+        df = dst.ROOT.RDataFrame(join.get('tree_name', 'taTree'), join['input_file'])
+        df = df.Define("join_time", f"static_cast<double>({join['secondary_time']})")
+        for column in join.get('columns') or []:
+            df = df.Define(f"join_{column['name']}", f"static_cast<double>({column['expression']})")
+        for cut in join.get('cuts') or []:
+            df = df.Filter(cut)
+        names = ["join_time"] + [f"join_{column['name']}" for column in join.get('columns') or []]
+        arrays = df.AsNumpy(names)
+
+        order = np.argsort(arrays["join_time"], kind='stable')
+        values = {column['name']: np.asarray(arrays[f"join_{column['name']}"], dtype=np.float64)[order]
+                  for column in join.get('columns') or []}
+        times = np.asarray(arrays["join_time"], dtype=np.float64)[order]
+        logger.info(f"Built join index {join['name']} of {len(times)} events")
+        return JoinIndex(key, times, values)
+
+    def save(self, output_file: str) -> None:
+        """
+        Save the index to a NumPy archive.
+
+        :param output_file: Path to the .npz file.
+        """
+        np.savez(output_file, key=self.key, times=self.times,
+                 **{f"value_{name}": values for name, values in self.values.items()})
+        logger.info(f"Saved join index to {output_file}")
+
+    @staticmethod
+    def load(index_file: str) -> 'JoinIndex':
+        """
+        Load an index from a NumPy archive.
+
+        :param index_file: Path to the .npz file.
+        :return: The index.
+        """
+        with np.load(index_file) as content:
+            values = {name[len("value_"):]: content[name] for name in content.files if name.startswith("value_")}
+            return JoinIndex(str(content['key']), content['times'], values)
+
+    def declare(self, join: Dict[str, Any], join_id: int) -> None:
+        """
+        Pass the index to the C++ lookup table used by the joined columns.
+
+        :param join: A 'joins' entry of the configuration.
+        :param join_id: The position of the join in the configuration.
+        """
+        dst.ROOT.gInterpreter.Declare(TREE_JOIN_HELPER)
+        columns = join.get('columns') or []
+        times = np.ascontiguousarray(self.times, dtype=np.float64)
+        dst.ROOT.taJoin.SetTable(join_id, times, len(times), len(columns), float(join.get('tolerance', 0.)))
+        for column_id, column in enumerate(columns):
+            values = np.ascontiguousarray(self.values[column['name']], dtype=np.float64)
+            dst.ROOT.taJoin.SetColumn(join_id, column_id, values, len(values))
+
@@ -66,9 +66,58 @@ def parse_arguments():
     parser.add_argument("-d", "--draw",
                         action="store_true",
                         help="Display plots after completing analysis.")
+    parser.add_argument("-b", "--batch_render",
+                        nargs="*",
+                        choices=["png", "svg", "pdf", "eps"],
+                        metavar="FORMAT",
+                        help="Render the saved plots to image files (default: png) and a combined PDF in "
+                             "<output_dir>/plots, without a display. Unchanged plots are not rendered again.")
+    parser.add_argument("-w", "--render_workers",
+                        type=int,
+                        default=None,
+                        help="Number of worker processes for --batch_render (default: number of CPUs).")
     parser.add_argument("-p", "--parallel",
                         action="store_true",
-                        help="Use parallel processing with Dask [not yet implemented].")
+                        help="Use parallel processing with ROOT implicit multithreading "
+                             "(Dask is not yet implemented).")
+    parser.add_argument("-M", "--memory_budget",
+                        type=str,
+                        default=None,
+                        help="Memory budget (e.g. '8GB'). Sets the number of threads with --parallel and the "
+                             "snapshot buffer sizes, and warns when the job gets close to it.")
+    parser.add_argument("-m", "--memory_report",
+                        action="store_true",
+                        help="Print the peak memory of each stage and the largest histograms.")
+    parser.add_argument("-O", "--optimize_cuts",
+                        nargs="?",
+                        type=int,
+                        const=10000,
+                        default=None,
+                        metavar="N_SAMPLE",
+                        help="Reorder cuts so cheap, selective cuts run first, estimated on N_SAMPLE entries "
+                             "(default: 10000). Not available with --parallel.")
+    preview = parser.add_mutually_exclusive_group()
+    preview.add_argument("--preview",
+                         type=int,
+                         metavar="N_ENTRIES",
+                         help="Preview mode: process only the first N_ENTRIES entries, extrapolate the cut flow "
+                              "and estimate the wall time of the full run. The events are not saved.")
+    preview.add_argument("--preview_fraction",
+                         type=float,
+                         metavar="FRACTION",
+                         help="Preview mode: process a random fraction of the input clusters, spread over all files.")
+    parser.add_argument("--seed",
+                        type=int,
+                        default=0,
+                        help="Seed of the cluster selection with --preview_fraction and of the bootstrap replicas "
+                             "(default: 0).")
+    parser.add_argument("-c", "--checkpoint",
+                        nargs="?",
+                        const="file",
+                        default=None,
+                        metavar="EVERY",
+                        help="Process the input in segments ('file' or a number of entries; default: file) and "
+                             "checkpoint the results of each segment, so an interrupted run resumes where it stopped.")
     return parser.parse_args()
 
 
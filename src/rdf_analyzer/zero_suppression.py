@@ -0,0 +1,121 @@
+from typing import Any, Optional, Tuple
+import numpy as np
+
+# Number of time bins of an FADC trace.
+N_BINS = 128
+
+# Default threshold above the pedestal, in FADC counts.
+DEFAULT_THRESHOLD = 0.
+
+
+def parse_zero_suppress(spec: str) -> Tuple[str, str, float]:
+    """
+    Parse a zero-suppression option 'FADC:PEDESTAL[:THRESHOLD]'.
+
+    :param spec: The option value, e.g. 'fadc:pedestal:3'.
+    :return: The trace column, the pedestal column and the threshold.
+    """
+    parts = spec.split(":")
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Invalid zero-suppression option '{spec}'. Expected 'FADC:PEDESTAL[:THRESHOLD]'")
+    return parts[0], parts[1], float(parts[2]) if len(parts) == 3 else DEFAULT_THRESHOLD
+
+
+def encode_traces(traces: np.ndarray, pedestals: np.ndarray, counters: np.ndarray,
+                  threshold: float = DEFAULT_THRESHOLD) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Zero-suppress the traces of one layer: keep the bins whose counts minus the counter pedestal are above the
+    threshold, as offsets (counter index within the event * 128 + bin) and pedestal-subtracted values, in the
+    order of the zeroSuppressOffsets and zeroSuppressValues library functions.
+
+    :param traces: The traces of all counters of all events, of shape (counters, 128).
+    :param pedestals: The pedestal of each counter, of shape (counters,).
+    :param counters: The number of counters of each event.
+    :param threshold: The threshold in FADC counts above the pedestal.
+    :return: The flat offsets (int32) and values (float32), and the number of kept bins of each event.
+    """
+    n_events = len(counters)
+    subtracted = traces - pedestals[:, np.newaxis]
+    counter, time_bin = np.nonzero(subtracted > threshold)
+    event = np.repeat(np.arange(n_events), counters)[counter]
+    starts = np.cumsum(counters) - counters
+    offsets = ((counter - starts[event]) * traces.shape[1] + time_bin).astype(np.int32)
+    values = subtracted[counter, time_bin].astype(np.float32)
+    return offsets, values, np.bincount(event, minlength=n_events)
+
+
+def zero_suppress(data: Any, fadc: str, pedestal: str, threshold: float = DEFAULT_THRESHOLD) -> Any:
+    """
+    Replace the dense FADC traces fadc[N][2][128] of an awkward array by their zero-suppressed form: the columns
+    '<fadc>0_offsets', '<fadc>0_values', '<fadc>1_offsets' and '<fadc>1_values' (see `encode_traces`), and
+    '<fadc>_ncounters', the number of counters N needed to rebuild the dense traces (see `decode_traces`).
+
+    :param data: An awkward array of records, e.g. one chunk of the converted data.
+    :param fadc: Name of the trace column, of type var * 2 * 128.
+    :param pedestal: Name of the pedestal column pedestal[N][2], the per-bin pedestal of each counter and layer.
+    :param threshold: The threshold in FADC counts above the pedestal.
+    :return: The array with the zero-suppressed columns instead of the trace column.
+    """
+    import awkward as ak
+
+    counters = ak.to_numpy(ak.num(data[fadc], axis=1))
+    traces = ak.to_numpy(ak.to_regular(ak.flatten(data[fadc], axis=1), axis=None))
+    pedestals = ak.to_numpy(ak.to_regular(ak.flatten(data[pedestal], axis=1), axis=None))
+    if traces.ndim != 3:
+        # Without any counter in the chunk, the trace dimensions cannot be inferred: use the [2][128] layout
+        traces = traces.reshape(0, 2, N_BINS)
+        pedestals = pedestals.reshape(0, 2)
+    for layer in range(traces.shape[1]):
+        offsets, values, counts = encode_traces(traces[:, layer, :], pedestals[:, layer], counters, threshold)
+        data[f"{fadc}{layer}_offsets"] = ak.unflatten(offsets, counts)
+        data[f"{fadc}{layer}_values"] = ak.unflatten(values, counts)
+    data[f"{fadc}_ncounters"] = counters.astype(np.int32)
+    return data[[field for field in data.fields if field != fadc]]
+
+
+def decode_traces(offsets: Any, values: Any, n_counters: Optional[Any] = None, max_counters: Optional[int] = None,
+                  n_bins: int = N_BINS) -> np.ndarray:
+    """
+    Rebuild dense pedestal-subtracted traces from zero-suppressed offsets and values, for a batch of events, with
+    one scatter over all kept bins. Suppressed bins are 0.
+
+    :param offsets: The offsets of each event (awkward array or list of arrays), e.g. '<fadc>0_offsets'.
+    :param values: The values of each event, in the same layout.
+    :param n_counters: The number of counters of each event ('<fadc>_ncounters'), to size the output.
+    :param max_counters: The number of counters of the output; counters beyond are dropped, missing counters are
+        all 0 (default: the largest number of counters of the batch).
+    :param n_bins: The number of bins of a trace.
+    :return: Array of shape (events, max_counters, n_bins), float32.
+    """
+    import awkward as ak
+
+    offsets = ak.Array(offsets)
+    counts = ak.to_numpy(ak.num(offsets, axis=1))
+    flat_offsets = ak.to_numpy(ak.flatten(offsets, axis=1)).astype(np.int64)
+    flat_values = ak.to_numpy(ak.flatten(ak.Array(values), axis=1))
+    if max_counters is None:
+        if n_counters is not None and len(counts):
+            max_counters = int(np.max(np.asarray(n_counters)))
+        else:
+            max_counters = int(flat_offsets.max()) // n_bins + 1 if len(flat_offsets) else 0
+    return scatter_traces(flat_offsets, flat_values, counts, max_counters, n_bins)
+
+
+def scatter_traces(flat_offsets: np.ndarray, flat_values: np.ndarray, counts: np.ndarray, max_counters: int,
+                   n_bins: int = N_BINS) -> np.ndarray:
+    """
+    Scatter flat zero-suppressed offsets and values (as returned by `encode_traces`) into dense traces.
+
+    :param flat_offsets: The offsets of all events, concatenated.
+    :param flat_values: The values of all events, concatenated.
+    :param counts: The number of kept bins of each event.
+    :param max_counters: The number of counters of the output; counters beyond are dropped.
+    :param n_bins: The number of bins of a trace.
+    :return: Array of shape (events, max_counters, n_bins), float32.
+    """
+    flat_offsets = np.asarray(flat_offsets, dtype=np.int64)
+    event = np.repeat(np.arange(len(counts)), counts)
+    keep = flat_offsets < max_counters * n_bins
+    dense = np.zeros((len(counts), max_counters * n_bins), dtype=np.float32)
+    dense[event[keep], flat_offsets[keep]] = flat_values[keep]
+    return dense.reshape(len(counts), max_counters, n_bins)
@@ -0,0 +1,184 @@
+from typing import Dict, Any, List, Optional, Tuple
+import glob
+import json
+import os
+import re
+
+import numpy as np
+
+from src.rdf_analyzer.utils import logger
+
+# A comparison between a column and a number, in either order (e.g. "yymmdd >= 190101" or "18.5 < ENERGY").
+NUMBER = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+COLUMN = r"[A-Za-z_][\w.]*"
+COLUMN_FIRST_PATTERN = re.compile(rf"^\s*({COLUMN})\s*(<=|>=|==|<|>)\s*({NUMBER})\s*$")
+NUMBER_FIRST_PATTERN = re.compile(rf"^\s*({NUMBER})\s*(<=|>=|==|<|>)\s*({COLUMN})\s*$")
+FLIPPED_OPERATORS = {'<': '>', '>': '<', '<=': '>=', '>=': '<=', '==': '=='}
+COLUMN_PATTERN = re.compile(rf"^{COLUMN}$")
+
+
+class ZoneMap:
+    def __init__(self, tree_name: str, files: List[Dict[str, Any]], clusters: List[Tuple[int, int]],
+                 statistics: Dict[str, Dict[str, List[float]]]):
+        """
+        Per-cluster minimum and maximum values of scalar branches of a tree.
+
+        :param tree_name: Name of the indexed TTree.
+        :param files: The indexed files, in chain order, with their 'path', 'size' and 'mtime'.
+        :param clusters: List of [start, stop) global entry ranges, one per cluster.
+        :param statistics: For each branch, the lists of per-cluster 'min' and 'max' values.
+        """
+        self.tree_name = tree_name
+        self.files = files
+        self.clusters = clusters
+        self.statistics = statistics
+
+    @staticmethod
+    def build(input_file: str, tree_name: str, branches: List[str]) -> 'ZoneMap':
+        """
+        Index the clusters of a tree, reading only the requested branches.
+
+        Files matching a glob pattern are indexed in sorted order, the same order in which a TChain adds them.
+
+        :param input_file: Path (or glob pattern) of the ROOT file(s).
+        :param tree_name: Name of the TTree.
+        :param branches: Scalar branches to index. Jagged branches are skipped.
+        :return: The zone map.
+        """
+        import uproot
+
+        files, clusters = [], []
+        values = {branch: [] for branch in branches}
+        offset = 0
+        for path in sorted(glob.glob(input_file)):
+            with uproot.open(path) as file:
+                tree = file[tree_name]
+                boundaries = [int(entry) for entry in tree.common_entry_offsets()]
+                clusters.extend((offset + start, offset + stop) for start, stop in zip(boundaries, boundaries[1:]))
+                for branch in branches:
+                    values[branch].append(tree[branch].array(library="np"))
+                offset += tree.num_entries
+            files.append({'path': os.path.abspath(path), 'size': os.path.getsize(path),
+                          'mtime': os.path.getmtime(path)})
+
+        starts = np.array([start for start, _ in clusters], dtype=np.int64)
+        statistics = {}
+        for branch, arrays in values.items():
+            data = np.concatenate(arrays) if arrays else np.array([])
+            if data.dtype == object or data.ndim != 1:
+                logger.warning(f"Branch {branch} is not a scalar branch. It is not indexed.")
+                continue
+            statistics[branch] = ZoneMap.cluster_statistics(data, starts)
+        logger.info(f"Indexed {len(clusters)} clusters of {offset} entries for {list(statistics)}")
+        return ZoneMap(tree_name, files, clusters, statistics)
+
+    @staticmethod
+    def cluster_statistics(data: np.ndarray, starts: np.ndarray) -> Dict[str, List[float]]:
+        """
+        Compute the minimum and maximum of a branch in each cluster, ignoring NaN values. Clusters whose values are
+        all NaN get NaN statistics, and are never skipped (see `entry_ranges`).
+
+        :param data: The values of the branch, for all entries.
+        :param starts: The first entry of each cluster.
+        :return: The lists of per-cluster 'min' and 'max' values.
+        """
+        if not len(starts):
+            return {'min': [], 'max': []}
+        return {'min': np.fmin.reduceat(data, starts).tolist(), 'max': np.fmax.reduceat(data, starts).tolist()}
+
+    def save(self, output_file: str) -> None:
+        """
+        Save the zone map to a JSON sidecar file.
+
+        :param output_file: Path to the sidecar file.
+        """
+        with open(output_file, 'w') as file:
+            json.dump({'tree_name': self.tree_name, 'files': self.files, 'clusters': self.clusters,
+                       'statistics': self.statistics}, file)
+        logger.info(f"Saved zone map to {output_file}")
+
+    @staticmethod
+    def load(zone_map_file: str) -> 'ZoneMap':
+        """
+        Load a zone map from a JSON sidecar file.
+
+        :param zone_map_file: Path to the sidecar file.
+        :return: The zone map.
+        """
+        with open(zone_map_file, 'r') as file:
+            content = json.load(file)
+        return ZoneMap(content['tree_name'], content['files'], [tuple(cluster) for cluster in content['clusters']],
+                       content['statistics'])
+
+    def is_current(self, input_file: str, tree_name: str) -> bool:
+        """
+        Check that the zone map was built from the given files, and that they have not changed since.
+
+        :param input_file: Path (or glob pattern) of the ROOT file(s).
+        :param tree_name: Name of the TTree.
+        :return: True if the zone map can be used for the input.
+        """
+        paths = [os.path.abspath(path) for path in sorted(glob.glob(input_file))]
+        if tree_name != self.tree_name or paths != [file['path'] for file in self.files]:
+            return False
+        return all(os.path.getsize(file['path']) == file['size'] and os.path.getmtime(file['path']) == file['mtime']
+                   for file in self.files)
+
+    def entry_ranges(self, cuts: List[str], aliases: Optional[Dict[str, str]] = None) -> List[Tuple[int, int]]:
+        """
+        Find the entry ranges that may contain events passing the cuts.
+
+        Only simple range cuts on indexed branches are used: comparisons of a column with a number, possibly joined
+        by '&&'. Every other cut is ignored, so the ranges are a superset of the ranges with passing events.
+        Clusters without statistics for a branch (all values NaN) are kept. Adjacent clusters are merged.
+
+        :param cuts: The cuts of the analysis.
+        :param aliases: Defined columns that are plain copies of a branch, mapped to the branch name.
+        :return: List of [start, stop) global entry ranges.
+        """
+        aliases = aliases or {}
+        keep = np.ones(len(self.clusters), dtype=bool)
+        for column, operator, value in self._range_conditions(cuts):
+            branch = aliases.get(column, column)
+            if branch not in self.statistics:
+                continue
+            minimum = np.array(self.statistics[branch]['min'], dtype=float)
+            maximum = np.array(self.statistics[branch]['max'], dtype=float)
+            keep &= {'<': minimum < value, '<=': minimum <= value, '>': maximum > value, '>=': maximum >= value,
+                     '==': (minimum <= value) & (maximum >= value)}[operator] | np.isnan(minimum)
+            logger.debug(f"Zone map condition {branch} {operator} {value}: {keep.sum()} clusters left")
+
+        entry_ranges = []
+        for (start, stop), selected in zip(self.clusters, keep):
+            if not selected:
+                continue
+            if entry_ranges and entry_ranges[-1][1] == start:
+                entry_ranges[-1] = (entry_ranges[-1][0], stop)
+            else:
+                entry_ranges.append((start, stop))
+        return entry_ranges
+
+    @staticmethod
+    def _range_conditions(cuts: List[str]) -> List[Tuple[str, str, float]]:
+        """
+        Extract the column-versus-number comparisons that every passing event must satisfy.
+
+        :param cuts: The cuts of the analysis.
+        :return: List of (column, operator, value) conditions, with the column on the left-hand side.
+        """
+        conditions = []
+        for cut in cuts:
+            if '||' in cut:
+                continue
+            for term in cut.split('&&'):
+                term = term.strip()
+                while term.startswith('(') and term.endswith(')'):
+                    term = term[1:-1].strip()
+                match = COLUMN_FIRST_PATTERN.match(term)
+                if match:
+                    conditions.append((match.group(1), match.group(2), float(match.group(3))))
+                    continue
+                match = NUMBER_FIRST_PATTERN.match(term)
+                if match:
+                    conditions.append((match.group(3), FLIPPED_OPERATORS[match.group(2)], float(match.group(1))))
+        return conditions
@@ -1,8 +1,14 @@
 import argparse
 import uproot
 import awkward as ak
+import pyarrow.parquet as pq
 from pathlib import Path
 
+from src.rdf_analyzer.compaction import CompactionPlan, DEFAULT_FLOAT_TOLERANCE, compaction_plan
+from src.rdf_analyzer.memory import MemoryMonitor, parse_memory_size
+from src.rdf_analyzer.prefetch import Prefetcher, DEFAULT_PREFETCH_CHUNK_BYTES
+from src.rdf_analyzer.zero_suppression import parse_zero_suppress, zero_suppress
+
 
 def parse_args():
     """Parse command-line arguments."""
@@ -17,6 +23,21 @@ def parse_args():
                         help="Output directory (default: current)")
     parser.add_argument("-x", "--omit_columns", type=str, nargs="*",
                         help="Columns to exclude (overrides column_names)")
+    parser.add_argument("-M", "--memory_budget", type=str,
+                        help="Memory budget (e.g. '4GB'). The file is converted in chunks sized to fit in it")
+    parser.add_argument("-m", "--memory_report", action="store_true",
+                        help="Print the peak memory of each stage and the largest columns")
+    parser.add_argument("-P", "--prefetch", type=int, default=0, metavar="DEPTH",
+                        help="Read and decompress up to DEPTH chunks ahead on a background thread, "
+                             "and report the time stalled on I/O (default: 0, no prefetching)")
+    parser.add_argument("-C", "--compact", type=float, nargs="?", const=DEFAULT_FLOAT_TOLERANCE, metavar="TOLERANCE",
+                        help="Store floats as float16/float32 where the relative round-trip error stays within "
+                             f"TOLERANCE (default: {DEFAULT_FLOAT_TOLERANCE:g}), and integers in the smallest type "
+                             "that holds their range. Reports the bytes saved per column")
+    parser.add_argument("-Z", "--zero_suppress", type=parse_zero_suppress, nargs="+", metavar="FADC:PEDESTAL[:THR]",
+                        help="Store the FADC traces FADC[N][2][128] zero-suppressed: only the bins more than THR "
+                             "counts (default: 0) above the counter pedestal PEDESTAL[N][2], as offsets and "
+                             "pedestal-subtracted values per layer (e.g. 'fadc:pedestal:3')")
     return parser.parse_args()
 
 
@@ -31,20 +52,69 @@ def get_columns(tree, args):
     return all_columns
 
 
-def save_parquet(data, input_path, output_dir):
-    """Save converted data to Parquet format."""
+def read_columns(columns, args):
+    """Columns to read: the selected columns and the pedestals needed for zero suppression."""
+    pedestals = [pedestal for _, pedestal, _ in args.zero_suppress or [] if pedestal not in columns]
+    return list(columns) + pedestals
+
+
+def convert(data, columns, args):
+    """Zero-suppress the FADC traces, and drop the columns read only for it."""
+    for fadc, pedestal, threshold in args.zero_suppress or []:
+        data = zero_suppress(data, fadc, pedestal, threshold)
+    extra = read_columns(columns, args)[len(columns):]
+    return data[[field for field in data.fields if field not in extra]] if extra else data
+
+
+def get_output_path(input_path, output_dir):
+    """Resolve the Parquet output path and create its directory."""
     output_dir = Path(output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
     stem = Path(input_path).stem
-    output_path = output_dir / f"{stem}.parquet"
+    return output_dir / f"{stem}.parquet"
+
+
+def column_sizes(data):
+    """Memory held by each column of an awkward array, in bytes."""
+    return {field: data[field].nbytes for field in data.fields}
+
+
+def save_parquet(data, input_path, output_dir):
+    """Save converted data to Parquet format."""
+    output_path = get_output_path(input_path, output_dir)
 
     ak.to_parquet(data, output_path)
     print(f"Saved converted data to: {output_path}")
 
 
+def save_parquet_chunks(chunks, input_path, output_dir, memory, plan=None):
+    """Save converted data to Parquet format chunk by chunk, one row group per chunk, compacted if a plan is given."""
+    output_path = get_output_path(input_path, output_dir)
+
+    writer = None
+    sizes = {}
+    try:
+        for chunk in chunks:
+            if plan is not None:
+                chunk = plan.apply(chunk)
+            table = ak.to_arrow_table(chunk)
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, table.schema)
+            writer.write_table(table)
+            for column, size in column_sizes(chunk).items():
+                sizes[column] = max(size, sizes.get(column, 0))
+            memory.check("convert")
+    finally:
+        if writer is not None:
+            writer.close()
+    print(f"Saved converted data to: {output_path}")
+    return sizes
+
+
 def main():
     args = parse_args()
+    memory = MemoryMonitor(parse_memory_size(args.memory_budget) if args.memory_budget else None)
 
     # Load ROOT data
     with uproot.open(args.file_path) as file:
@@ -54,10 +124,44 @@ def main():
         if not columns:
             raise ValueError("No valid columns selected for conversion")
 
-        data = tree.arrays(columns)
-
-    # Convert and save
-    save_parquet(data, args.file_path, args.output_dir)
+        # With a memory budget or prefetching, convert and save chunk by chunk
+        chunk_bytes = memory.chunk_bytes(4 + args.prefetch) or (DEFAULT_PREFETCH_CHUNK_BYTES if args.prefetch else None)
+        plan = None
+        if chunk_bytes:
+            print(f"Converting in chunks of {chunk_bytes // 2 ** 20} MB")
+            step_size = f"{chunk_bytes // 2 ** 20} MB"
+            if args.compact is not None:
+                # Every row group must have the same schema, so the types are chosen in a first pass
+                with memory.stage("compaction plan"):
+                    plan = compaction_plan((convert(chunk, columns, args) for chunk in
+                                            tree.iterate(read_columns(columns, args), step_size=step_size)),
+                                           args.compact)
+            chunks = (convert(chunk, columns, args) for chunk in
+                      tree.iterate(read_columns(columns, args), step_size=step_size))
+            if args.prefetch:
+                chunks = Prefetcher(chunks, args.prefetch, "read")
+            with memory.stage("convert"):
+                sizes = save_parquet_chunks(chunks, args.file_path, args.output_dir, memory, plan)
+            if args.prefetch:
+                chunks.print_report()
+        else:
+            with memory.stage("read"):
+                data = convert(tree.arrays(read_columns(columns, args)), columns, args)
+            if args.compact is not None:
+                plan = CompactionPlan(args.compact)
+                plan.update(data)
+                data = plan.apply(data)
+            sizes = column_sizes(data)
+
+    if not chunk_bytes:
+        # Convert and save
+        with memory.stage("write"):
+            save_parquet(data, args.file_path, args.output_dir)
+
+    if plan is not None:
+        plan.print_report()
+    if args.memory_report:
+        memory.print_report(sizes)
 
 
 if __name__ == "__main__":
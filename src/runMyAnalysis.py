@@ -7,29 +7,51 @@ def main():
 
     client = None
     if args.parallel:
-        logger.warning("Parallel processing with Dask is not supported in this version. Running in serial mode.")
+        logger.warning("Parallel processing with Dask is not supported in this version. "
+                       "Using ROOT implicit multithreading.")
         # from rdf_analyzer import setup_dask_client
         # client = setup_dask_client()
 
     my_analysis = DataFrameAnalyzer(args, client)
 
     # Run the my_analysis and get the list of histograms
-    my_histograms = my_analysis.run_analysis()
+    with my_analysis.memory.stage("analysis"):
+        my_histograms = my_analysis.run_analysis()
 
     # Save histograms, unless the user specifies not to
     if not args.no_save:
-        my_analysis.histogram_manager.save_histograms(my_histograms)
+        with my_analysis.memory.stage("save histograms"):
+            my_analysis.histogram_manager.save_histograms(my_histograms)
+
+    # Render the saved histograms to image files without a display
+    if args.batch_render is not None:
+        if args.no_save:
+            logger.warning("Plots are not saved (--no_save). Nothing to render.")
+        else:
+            my_analysis.histogram_manager.render_histograms(my_histograms,
+                                                            my_analysis.config.get('hist_params', []),
+                                                            args.batch_render or ["png"],
+                                                            args.render_workers)
 
     # Plot the histograms on a ROOT canvas
     if args.draw:
         my_analysis.histogram_manager.plot_histograms(my_histograms)
 
-    # Print the efficiency report
-    if args.report:
-        my_analysis.df_manager.df.Report().Print()
-
-    # Save the DataFrame of good events
-    my_analysis.df_manager.save_df(my_analysis.df_manager.output_dir)
+    # In preview mode, print the extrapolated cut flow and time estimate instead of saving the events
+    if my_analysis.preview:
+        my_analysis.print_preview_summary()
+    else:
+        # Print the efficiency report
+        if args.report:
+            my_analysis.print_report()
+
+        # Save the DataFrame of good events
+        with my_analysis.memory.stage("save events"):
+            my_analysis.save_events()
+
+    # Print the memory used by each stage and the largest histograms
+    if args.memory_report:
+        my_analysis.memory.print_report(my_analysis.memory_sizes(my_histograms))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from src.rdf_analyzer.compaction import DEFAULT_FLOAT_TOLERANCE, CompactionPlan, compaction_plan, relative_error
+
+
+def test_relative_error_exact():
+    values = np.array([0., 1., -2.5, 1024., np.nan, np.inf, -np.inf])
+    assert relative_error(values, np.float32) == 0.
+    assert relative_error(values, np.float16) == 0.
+
+
+def test_relative_error_bounds():
+    values = np.random.default_rng(0).uniform(-1e6, 1e6, 10000)
+    assert 0. < relative_error(values, np.float32) <= 2. ** -24
+    assert relative_error(values, np.float16) > DEFAULT_FLOAT_TOLERANCE
+    small = np.random.default_rng(1).uniform(1., 100., 10000)
+    assert 0. < relative_error(small, np.float16) <= 2. ** -11
+
+
+def test_relative_error_overflow():
+    assert np.isinf(relative_error(np.array([1e300]), np.float32))
+    assert np.isinf(relative_error(np.array([1e5]), np.float16))
+
+
+def chunks():
+    ak = pytest.importorskip("awkward")
+    rng = np.random.default_rng(2)
+    return [ak.Array({"unsigned": np.arange(100, dtype=np.int64) + 100 * i,
+                      "signed": np.arange(-150, 150, 3, dtype=np.int64) * (i + 1),
+                      "wide": np.full(100, 2 ** 40, dtype=np.int64),
+                      "energy": rng.uniform(18., 21., 100),
+                      "jagged": ak.unflatten(rng.uniform(1., 10., 300), np.full(100, 3)),
+                      "label": [str(j) for j in range(100)]})
+            for i in range(2)]
+
+
+def test_types_chosen_from_all_chunks():
+    plan = compaction_plan(chunks())
+
+    assert plan.types["unsigned"] == np.uint8
+    assert plan.types["signed"] == np.int16
+    assert plan.types["energy"] == np.float32
+    assert plan.types["jagged"] == np.float32
+    assert "wide" not in plan.types
+    assert "label" not in plan.types
+
+
+def test_float16_needs_looser_tolerance():
+    assert compaction_plan(chunks(), float_tolerance=DEFAULT_FLOAT_TOLERANCE).types["jagged"] == np.float32
+    assert compaction_plan(chunks(), float_tolerance=1e-3).types["jagged"] == np.float16
+
+
+def test_apply_within_tolerance():
+    ak = pytest.importorskip("awkward")
+    data = chunks()
+    plan = compaction_plan(data)
+
+    for chunk in data:
+        original = {field: ak.to_numpy(ak.flatten(chunk[field], axis=None)) for field in ("signed", "jagged")}
+        compacted = plan.apply(chunk)
+        np.testing.assert_array_equal(ak.to_numpy(compacted["signed"]), original["signed"])
+        np.testing.assert_allclose(ak.to_numpy(ak.flatten(compacted["jagged"])), original["jagged"],
+                                   rtol=DEFAULT_FLOAT_TOLERANCE)
+    assert all(error <= DEFAULT_FLOAT_TOLERANCE for error in plan.max_errors.values())
+    assert plan.saved("unsigned") > 0
+
+
+def test_apply_rejects_unseen_range():
+    ak = pytest.importorskip("awkward")
+    plan = compaction_plan(chunks())
+
+    with pytest.raises(ValueError):
+        plan.apply(ak.Array({"unsigned": np.array([1000], dtype=np.int64)}))
+
+
+def test_empty_plan():
+    plan = CompactionPlan()
+    assert plan.choose() == {}
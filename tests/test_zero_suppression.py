@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from src.rdf_analyzer.zero_suppression import N_BINS, encode_traces, parse_zero_suppress, scatter_traces
+
+
+def dense_events(counters, seed=0):
+    """Random traces of one layer with their pedestals, a few bins well above the pedestal."""
+    rng = np.random.default_rng(seed)
+    n_counters = int(np.sum(counters))
+    pedestals = rng.uniform(10., 20., n_counters)
+    traces = pedestals[:, np.newaxis] + rng.normal(0., 1., (n_counters, N_BINS))
+    traces[rng.random((n_counters, N_BINS)) < 0.05] += 50.
+    return traces, pedestals
+
+
+def expected_traces(traces, pedestals, counters, threshold):
+    """Dense traces minus pedestal, 0 at or below the threshold, padded to the largest number of counters."""
+    subtracted = traces - pedestals[:, np.newaxis]
+    kept = np.where(subtracted > threshold, subtracted, 0.).astype(np.float32)
+    expected = np.zeros((len(counters), max(counters, default=0), N_BINS), dtype=np.float32)
+    for event, (start, n) in enumerate(zip(np.cumsum(counters) - counters, counters)):
+        expected[event, :n] = kept[start:start + n]
+    return expected
+
+
+@pytest.mark.parametrize("threshold", [0., 3., 20.])
+def test_round_trip(threshold):
+    counters = np.array([3, 0, 2, 5, 1])
+    traces, pedestals = dense_events(counters)
+    offsets, values, counts = encode_traces(traces, pedestals, counters, threshold)
+
+    decoded = scatter_traces(offsets, values, counts, int(counters.max()))
+    np.testing.assert_allclose(decoded, expected_traces(traces, pedestals, counters, threshold), rtol=1e-6)
+
+
+def test_offsets_within_event():
+    counters = np.array([2, 4])
+    traces, pedestals = dense_events(counters, seed=1)
+    offsets, values, counts = encode_traces(traces, pedestals, counters, 3.)
+
+    assert offsets.dtype == np.int32 and values.dtype == np.float32
+    assert counts.sum() == len(offsets) == len(values)
+    for event_offsets, n in zip(np.split(offsets, np.cumsum(counts)[:-1]), counters):
+        assert np.all(np.diff(event_offsets) > 0)
+        assert np.all(event_offsets < n * N_BINS)
+
+
+def test_no_counters():
+    counters = np.array([0, 0, 0])
+    offsets, values, counts = encode_traces(np.zeros((0, N_BINS)), np.zeros(0), counters, 3.)
+
+    assert len(offsets) == len(values) == 0
+    np.testing.assert_array_equal(counts, [0, 0, 0])
+    assert scatter_traces(offsets, values, counts, 0).shape == (3, 0, N_BINS)
+
+
+def test_max_counters_drops_counters():
+    counters = np.array([3])
+    traces, pedestals = dense_events(counters, seed=2)
+    offsets, values, counts = encode_traces(traces, pedestals, counters)
+
+    decoded = scatter_traces(offsets, values, counts, 2)
+    np.testing.assert_allclose(decoded, expected_traces(traces, pedestals, counters, 0.)[:, :2], rtol=1e-6)
+
+
+def test_parse_zero_suppress():
+    assert parse_zero_suppress("fadc:pedestal") == ("fadc", "pedestal", 0.)
+    assert parse_zero_suppress("fadc:pedestal:3") == ("fadc", "pedestal", 3.)
+    with pytest.raises(ValueError):
+        parse_zero_suppress("fadc")
+
+
+def test_zero_suppress_round_trip():
+    ak = pytest.importorskip("awkward")
+    from src.rdf_analyzer.zero_suppression import decode_traces, zero_suppress
+
+    counters = np.array([2, 0, 3])
+    traces, pedestals = dense_events(2 * counters, seed=3)
+    starts = np.cumsum(counters) - counters
+    fadc = [traces.reshape(-1, 2, N_BINS)[start:start + n].tolist() for start, n in zip(starts, counters)]
+    pedestal = [pedestals.reshape(-1, 2)[start:start + n].tolist() for start, n in zip(starts, counters)]
+    data = zero_suppress(ak.Array({"fadc": fadc, "pedestal": pedestal}), "fadc", "pedestal", 3.)
+
+    assert "fadc" not in data.fields
+    np.testing.assert_array_equal(ak.to_numpy(data["fadc_ncounters"]), counters)
+    for layer in range(2):
+        decoded = decode_traces(data[f"fadc{layer}_offsets"], data[f"fadc{layer}_values"], data["fadc_ncounters"])
+        expected = expected_traces(traces.reshape(-1, 2, N_BINS)[:, layer], pedestals.reshape(-1, 2)[:, layer],
+                                   counters, 3.)
+        np.testing.assert_allclose(decoded, expected, rtol=1e-6)
+
+
+@pytest.mark.parametrize("counters", [[], [0, 0]])
+def test_zero_suppress_without_counters(counters):
+    ak = pytest.importorskip("awkward")
+    from src.rdf_analyzer.zero_suppression import zero_suppress
+
+    empty = ak.Array({"fadc": [[] for _ in counters], "pedestal": [[] for _ in counters]})
+    data = zero_suppress(empty, "fadc", "pedestal")
+
+    assert len(data) == len(counters)
+    assert ak.to_list(data["fadc0_offsets"]) == [[] for _ in counters]
+    assert ak.to_list(data["fadc1_values"]) == [[] for _ in counters]
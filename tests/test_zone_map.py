@@ -0,0 +1,32 @@
+import numpy as np
+
+from src.rdf_analyzer.zone_map import ZoneMap
+
+
+def zone_map(data, clusters):
+    starts = np.array([start for start, _ in clusters], dtype=np.int64)
+    return ZoneMap("taTree", [], clusters, {"x": ZoneMap.cluster_statistics(np.array(data), starts)})
+
+
+def test_nan_does_not_hide_cluster():
+    zones = zone_map([1., np.nan, 3., 4., 5., 6.], [(0, 3), (3, 6)])
+
+    assert zones.statistics["x"] == {'min': [1., 4.], 'max': [3., 6.]}
+    assert zones.entry_ranges(["x > 2"]) == [(0, 6)]
+    assert zones.entry_ranges(["x > 3.5"]) == [(3, 6)]
+
+
+def test_all_nan_cluster_is_kept():
+    zones = zone_map([np.nan, np.nan, 4., 5.], [(0, 2), (2, 4)])
+
+    assert zones.entry_ranges(["x < 1"]) == [(0, 2)]
+    assert zones.entry_ranges(["x >= 4"]) == [(0, 4)]
+
+
+def test_range_conditions():
+    zones = zone_map([1., 2., 3., 10., 11., 12.], [(0, 3), (3, 6)])
+
+    assert zones.entry_ranges(["(x >= 10) && y > 0"]) == [(3, 6)]
+    assert zones.entry_ranges(["5 > x"]) == [(0, 3)]
+    assert zones.entry_ranges(["x > 100 || x < 0"]) == [(0, 6)]
+    assert zones.entry_ranges(["X > 100"], {"X": "x"}) == []